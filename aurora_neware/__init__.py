@@ -1,9 +1,27 @@
 """Neware API for Python."""
 
+from .async_api import AsyncNewareAPI
+from .cache import ChannelMapCache, DownloadCache
+from .channels import Channel, ChannelIndex
+from .chunking import AdaptiveChunkSize
+from .columns import DataColumns
+from .export import ColumnarWriter
 from .neware import NewareAPI
+from .pool import ConnectionPool
+from .scheduler import PollScheduler
 from .version import __version__
 
 __all__ = [
+    "AdaptiveChunkSize",
+    "AsyncNewareAPI",
+    "Channel",
+    "ChannelIndex",
+    "ChannelMapCache",
+    "ColumnarWriter",
+    "ConnectionPool",
+    "DataColumns",
+    "DownloadCache",
     "NewareAPI",
+    "PollScheduler",
     "__version__",
 ]
@@ -0,0 +1,272 @@
+"""Asyncio API for Neware Battery Testing System.
+
+AsyncNewareAPI talks to a BTS server over asyncio streams, so one event loop can drive many servers
+at once. Commands are built and replies are parsed in the same way as NewareAPI.
+"""
+
+import asyncio
+import contextlib
+from collections.abc import AsyncIterator, Mapping
+from pathlib import Path
+from types import TracebackType
+
+from .channels import ChannelIndex
+from .neware import (
+    _CONNECT_COMMAND,
+    _build_download,
+    _build_download_step_layer,
+    _build_downloadlog,
+    _build_start,
+    _ChannelMapMixin,
+    _check_startable,
+    _count_retries,
+    _lod_to_dol,
+    _merge_records,
+    _parse_devinfo,
+    _start_inputs,
+    _xml_to_records,
+)
+from .selection import apply_filters, split_filters
+
+
+class AsyncNewareAPI(_ChannelMapMixin):
+    """Asyncio API for Neware Battery Testing System.
+
+    Provides the same commands as NewareAPI as coroutines. Commands on one connection are sent one at
+    a time, use one AsyncNewareAPI per BTS server and run them concurrently e.g. with asyncio.gather.
+
+    Every method takes an optional timeout in seconds, which limits the wait for each reply. If a
+    reply does not arrive in time, the connection is closed and TimeoutError is raised, because the
+    late reply would otherwise be read as the reply to the next command.
+    """
+
+    def __init__(
+        self,
+        ip: str = "127.0.0.1",
+        port: int = 502,
+        timeout: float | None = None,
+        limit: int = 2**30,
+    ) -> None:
+        """Initialize the AsyncNewareAPI object, the connection is opened with connect().
+
+        Args:
+            ip: IP address of the BTS server
+            port: port of the BTS server
+            timeout (optional): default timeout in seconds for each reply
+            limit: maximum size of a reply in bytes
+
+        """
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.limit = limit
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.channel_map = ChannelIndex()
+        self.start_message = '<?xml version="1.0" encoding="UTF-8" ?><bts version="1.0">'
+        self.end_message = "</bts>"
+        self.termination = "\n\n#\r\n"
+        self._lock = asyncio.Lock()
+
+    async def connect(self, channel_map: Mapping[str, Mapping] | None = None, timeout: float | None = None) -> None:
+        """Establish the TCP connection.
+
+        Args:
+            channel_map (optional): channel map to use, e.g. from another connection to the same
+                server, if not given it is fetched with getdevinfo()
+            timeout (optional): timeout in seconds for opening the connection and each reply
+
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port, limit=self.limit), timeout
+        )
+        await self.command(_CONNECT_COMMAND, timeout=timeout)
+        self.channel_map = channel_map if channel_map is not None else await self.getdevinfo(timeout=timeout)
+
+    async def disconnect(self) -> None:
+        """Close the connection."""
+        if self.writer is not None:
+            self.writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self.writer.wait_closed()
+        self.reader = self.writer = None
+
+    async def __aenter__(self) -> "AsyncNewareAPI":
+        """Establish the TCP connection when entering the context."""
+        await self.connect()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the connection when exiting the context."""
+        await self.disconnect()
+
+    async def command(self, cmd: str, timeout: float | None = None) -> str:
+        """Send a command to the device, and return the response."""
+        if self.writer is None or self.reader is None:
+            msg = "Not connected, call connect() first."
+            raise ConnectionError(msg)
+        timeout = self.timeout if timeout is None else timeout
+        async with self._lock:
+            try:
+                self.writer.write((self.start_message + cmd + self.end_message + self.termination).encode())
+                await self.writer.drain()
+                reply = await asyncio.wait_for(self.reader.readuntil(self.termination.encode()), timeout)
+            except asyncio.IncompleteReadError as e:
+                self._abort()
+                msg = "Connection closed by the BTS server before the reply was complete."
+                raise ConnectionError(msg) from e
+            except BaseException:
+                # After a timeout or cancellation the reply may still arrive, and would be read as the
+                # reply to the next command
+                self._abort()
+                raise
+        return reply[: -len(self.termination)].decode()
+
+    def _abort(self) -> None:
+        """Close the connection without waiting, e.g. when a command is cancelled."""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def start(
+        self,
+        pipeline_ids: str | list[str],
+        sample_ids: str | list[str],
+        xml_files: str | Path | list[str] | list[Path],
+        save_location: str | Path = Path("C:\\Neware data\\"),
+        timeout: float | None = None,
+    ) -> list[dict]:
+        """Start designated payload file on a pipeline, see NewareAPI.start."""
+        pipelines = self._select_pipelines(pipeline_ids)
+        sample_ids, xml_filepaths = _start_inputs(sample_ids, xml_files)
+        _check_startable(await self.inquire(pipeline_ids, timeout=timeout))
+        result = await self.command(
+            _build_start([self._address_of(p) for p in pipelines], xml_filepaths, sample_ids, save_location), timeout
+        )
+        return _xml_to_records(result)
+
+    async def stop(self, pipeline_ids: str | list[str] | tuple[str], timeout: float | None = None) -> list[dict]:
+        """Stop job running on pipeline(s)."""
+        pipelines = self._select_pipelines(pipeline_ids)
+        result = await self.command(self._channel_command("stop", "stop", pipelines), timeout)
+        return _xml_to_records(result)
+
+    async def getchlstatus(
+        self, pipeline_ids: str | list[str] | None = None, timeout: float | None = None
+    ) -> dict[str, dict]:
+        """Get status of pipeline(s), all pipelines in the channel map if none are given."""
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = await self.command(self._channel_command("getchlstatus", "status", pipelines), timeout)
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="getchlstatus"))
+
+    async def inquire(
+        self, pipeline_ids: str | list[str] | None = None, timeout: float | None = None
+    ) -> dict[str, dict]:
+        """Inquire the status of the channel(s), all pipelines in the channel map if none are given."""
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = await self.command(
+            self._channel_command("inquire", "inquire", pipelines, attrs=' aux="0" barcode="1"'), timeout
+        )
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="inquire"))
+
+    async def select(self, selectors: str | list[str] | None = None, timeout: float | None = None) -> list[str]:
+        """Get the pipeline IDs matching selectors, see NewareAPI.select."""
+        if isinstance(selectors, str):
+            selectors = [selectors]
+        addresses, filters = split_filters(selectors or [])
+        pipelines = self._select_pipelines(addresses, default_all=True)
+        if not filters:
+            return list(pipelines)
+        return apply_filters(await self.inquire(list(pipelines), timeout=timeout), filters)
+
+    async def inquiredf(
+        self, pipeline_ids: str | list[str] | None = None, timeout: float | None = None
+    ) -> dict[str, dict]:
+        """Get the test ID and number of data points of pipeline(s), see NewareAPI.inquiredf."""
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = await self.command(self._inquiredf_command(pipelines), timeout)
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="inquiredf"))
+
+    async def downloadlog(self, pipeline_id: str, timeout: float | None = None) -> list[dict]:
+        """Download the log information from a channel."""
+        result = await self.command(_build_downloadlog(self._address_of(pipeline_id, ip=False)), timeout)
+        return _xml_to_records(result, command="downloadlog")
+
+    async def download(
+        self,
+        pipeline_id: str,
+        last_n_points: int = 10000,
+        chunk_size: int = 1000,
+        timeout: float | None = None,
+    ) -> dict[str, list]:
+        """Download the data points for a channel. By default grabs the last 10000 points.
+
+        Args:
+            pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
+            last_n_points: how many datapoints to download, set to 0 to get all data
+            chunk_size: number of datapoints to request per command
+            timeout (optional): timeout in seconds for each reply
+
+        Returns:
+            Dictionary of lists of data from latest test
+
+        """
+        start = -last_n_points if last_n_points else 0
+        data: dict[str, list] = {}
+        async for chunk in self.iter_download(pipeline_id, start=start, chunk_size=chunk_size, timeout=timeout):
+            for key, values in chunk.items():
+                data.setdefault(key, []).extend(values)
+        return data
+
+    async def iter_download(
+        self,
+        pipeline_id: str,
+        start: int = 0,
+        chunk_size: int = 1000,
+        timeout: float | None = None,
+    ) -> AsyncIterator[dict[str, list]]:
+        """Download the data points for a channel, yielding one chunk at a time.
+
+        Each chunk is requested from the first point not received yet, so a short reply leaves no
+        holes. Raises ValueError if replies have no points a few times in a row.
+
+        Args:
+            pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
+            start: number of datapoints to skip from the beginning of the test, if negative, counts
+                from the end e.g. -100 gives the last 100 points
+            chunk_size: number of datapoints to request per command
+            timeout (optional): timeout in seconds for each reply
+
+        Yields:
+            Dictionary of lists of data for each chunk from latest test
+
+        """
+        address = self._address_of(pipeline_id, ip=False)
+        res = await self.inquiredf(pipeline_id, timeout=timeout)
+        n_total = res[pipeline_id]["count"]
+        start = max(0, n_total + start) if start < 0 else min(start, n_total)
+        startpos = start + 1
+        retries = 0
+        while startpos <= n_total:
+            records = _xml_to_records(
+                await self.command(_build_download(address, startpos, chunk_size), timeout), command="download"
+            )
+            retries = _count_retries(retries, len(records), f"Data points {startpos} to {n_total} of {pipeline_id}")
+            if records:
+                yield _lod_to_dol(records)
+            startpos += len(records)
+
+    async def getdevinfo(self, timeout: float | None = None) -> dict[str, dict]:
+        """Get device information, see NewareAPI.getdevinfo."""
+        return _parse_devinfo(await self.command("<cmd>getdevinfo</cmd>", timeout))
+
+    async def get_steps(self, pipeline_id: str, timeout: float | None = None) -> list[dict]:
+        """Get the step layer of data, such as step index and type, start and end time etc."""
+        xml_string = await self.command(_build_download_step_layer(self._address_of(pipeline_id, ip=False)), timeout)
+        return _xml_to_records(xml_string, command="downloadStepLayer")
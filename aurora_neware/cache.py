@@ -0,0 +1,295 @@
+"""Persistent local cache for data downloaded from Neware channels.
+
+Downloaded data points are stored on disk keyed by the server and full test ID, e.g.
+127.0.0.1-502-21-1-1-143, so later downloads from the same test only need to fetch the points after
+the cached tail, and one cache can be used for many servers.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+
+def default_cache_dir() -> Path:
+    """Get the default cache directory.
+
+    Uses the AURORA_NEWARE_CACHE_DIR environment variable if set, otherwise a folder in the user's
+    local application data (Windows) or ~/.cache (other systems).
+    """
+    if env_dir := os.environ.get("AURORA_NEWARE_CACHE_DIR"):
+        return Path(env_dir)
+    base = os.environ.get("LOCALAPPDATA") or Path.home() / ".cache"
+    return Path(base) / "aurora_neware"
+
+
+# Seconds between writes of the index which only record when tests were last used
+_TOUCH_INTERVAL = 60.0
+# Eviction is checked when a test is added, and after appending this fraction of max_bytes
+_EVICT_FRACTION = 8
+
+
+class DownloadCache:
+    """Cache of downloaded data points on disk, keyed by server and full test ID.
+
+    Each test is stored as an append-only file with one JSON dictionary of lists per line, and an
+    append-only line index with the byte offset, first and last seqid of each line, so reads can seek
+    to the first line needed. An index of the cached tests records when each was last used. Only one
+    test is kept per pipeline, the key without the test ID after the last '-', older tests are
+    dropped when the test ID changes. If max_bytes is set, the least recently used tests are evicted
+    until the cache fits. One cache can be shared by the connections of a ConnectionPool, as the
+    index is only changed while holding a lock.
+    """
+
+    def __init__(self, directory: str | Path | None = None, max_bytes: int | None = None) -> None:
+        """Initialize the cache.
+
+        Args:
+            directory (optional): where to store the cache, default from default_cache_dir()
+            max_bytes (optional): maximum total size of cached data, default unlimited
+
+        """
+        self.directory = Path(directory) if directory else default_cache_dir() / "downloads"
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.directory / "index.json"
+        # Last use of tests since the index was written, written at most every _TOUCH_INTERVAL
+        self._last_used: dict[str, float] = {}
+        self._index_written = time.monotonic()
+        self._unchecked_bytes = 0
+        self._lock = threading.RLock()
+
+    def _read_index(self) -> dict[str, dict]:
+        """Read the index of cached tests, with the last uses not written yet."""
+        with self._lock:
+            try:
+                with self._index_path.open() as f:
+                    index = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                index = {}
+            for full_test_id, last_used in self._last_used.items():
+                if full_test_id in index:
+                    index[full_test_id]["last_used"] = max(index[full_test_id].get("last_used", 0), last_used)
+            return index
+
+    def _write_index(self, index: dict[str, dict]) -> None:
+        """Write the index of cached tests atomically."""
+        with self._lock:
+            tmp_path = self._index_path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(index, f)
+            tmp_path.replace(self._index_path)
+            self._last_used.clear()
+            self._index_written = time.monotonic()
+
+    def _touch(self, full_test_id: str) -> None:
+        """Record that a test was used, writing the index if it was not written recently."""
+        with self._lock:
+            self._last_used[full_test_id] = time.time()
+            if time.monotonic() - self._index_written > _TOUCH_INTERVAL:
+                self._write_index(self._read_index())
+
+    def _data_path(self, full_test_id: str) -> Path:
+        """Get the path of the data file for a test."""
+        return self.directory / f"{full_test_id}.ndjson"
+
+    def _lines_path(self, full_test_id: str) -> Path:
+        """Get the path of the line index for a test."""
+        return self.directory / f"{full_test_id}.lines"
+
+    def _lines(self, full_test_id: str) -> list[tuple[int, int, int]]:
+        """Get the byte offset, first and last seqid of each line of the data file of a test."""
+        try:
+            with self._lines_path(full_test_id).open() as f:
+                return [(int(p[0]), int(p[1]), int(p[2])) for line in f if len(p := line.split()) == 3]
+        except FileNotFoundError:
+            return self._index_lines(full_test_id)
+
+    def _index_lines(self, full_test_id: str) -> list[tuple[int, int, int]]:
+        """Build the line index of a data file written without one."""
+        lines = []
+        try:
+            with self._data_path(full_test_id).open("rb") as f:
+                offset = 0
+                for line in f:
+                    if seqids := json.loads(line).get("seqid"):
+                        lines.append((offset, seqids[0], seqids[-1]))
+                    offset += len(line)
+        except FileNotFoundError:
+            return []
+        with self._lines_path(full_test_id).open("w") as f:
+            f.writelines(f"{offset} {first} {last}\n" for offset, first, last in lines)
+        return lines
+
+    def get(self, full_test_id: str) -> dict | None:
+        """Get the index entry for a test, with keys 'first_seqid' and 'last_seqid', or None.
+
+        A test without data, e.g. if the first append was interrupted or the data file was removed,
+        is treated as missing.
+        """
+        entry = self._read_index().get(full_test_id)
+        if entry is None or not self._data_path(full_test_id).exists():
+            return None
+        if not (lines := self._lines(full_test_id)):
+            return None
+        entry["first_seqid"], entry["last_seqid"] = lines[0][1], lines[-1][2]
+        return entry
+
+    def read(self, full_test_id: str, first_seqid: int = 0) -> dict[str, list]:
+        """Read cached data points of a test as a dictionary of lists.
+
+        Only the lines from the one containing first_seqid are decoded.
+
+        Args:
+            full_test_id: key of the test e.g. 127.0.0.1-502-21-1-1-143
+            first_seqid (optional): only return data points from this seqid onwards
+
+        Returns:
+            Dictionary of lists of cached data
+
+        """
+        lines = self._lines(full_test_id)
+        i = bisect.bisect_left([last for _offset, _first, last in lines], first_seqid)
+        offset = lines[min(i, len(lines) - 1)][0] if lines else 0
+        data: dict[str, list] = {}
+        last_seqid = 0
+        try:
+            with self._data_path(full_test_id).open("rb") as f:
+                f.seek(offset)
+                for line in f:
+                    chunk = json.loads(line)
+                    seqids = chunk.get("seqid") or []
+                    # Skip points before first_seqid, and points repeated after an interrupted append
+                    skip = bisect.bisect_left(seqids, max(first_seqid, last_seqid + 1))
+                    if skip == len(seqids):
+                        continue
+                    if skip:
+                        chunk = {key: values[skip:] for key, values in chunk.items()}
+                    last_seqid = chunk["seqid"][-1]
+                    for key, values in chunk.items():
+                        data.setdefault(key, []).extend(values)
+        except FileNotFoundError:
+            return {}
+        self._touch(full_test_id)
+        return data
+
+    def append(self, full_test_id: str, chunk: dict[str, list]) -> None:
+        """Append a chunk of data points, as a dictionary of lists, to the cache of a test."""
+        if not chunk or not chunk.get("seqid"):
+            return
+        with self._lock:
+            is_new = full_test_id not in self._read_index()
+            if is_new:
+                pipeline_id = full_test_id.rsplit("-", 1)[0]
+                self.drop_pipeline(pipeline_id, keep=full_test_id)
+                self._data_path(full_test_id).unlink(missing_ok=True)
+                self._lines_path(full_test_id).unlink(missing_ok=True)
+                index = self._read_index()
+                index[full_test_id] = {"pipeline_id": pipeline_id, "last_used": time.time()}
+                self._write_index(index)
+            elif not self._lines_path(full_test_id).exists():
+                self._index_lines(full_test_id)
+            line = (json.dumps(chunk) + "\n").encode()
+            with self._data_path(full_test_id).open("ab") as f:
+                offset = f.tell()
+                f.write(line)
+            with self._lines_path(full_test_id).open("a") as f:
+                f.write(f"{offset} {chunk['seqid'][0]} {chunk['seqid'][-1]}\n")
+            self._touch(full_test_id)
+            self._unchecked_bytes += len(line)
+            if self.max_bytes is not None and (is_new or self._unchecked_bytes > self.max_bytes // _EVICT_FRACTION):
+                self._evict(keep=full_test_id)
+
+    def drop(self, full_test_id: str) -> None:
+        """Remove a test from the cache."""
+        with self._lock:
+            self._data_path(full_test_id).unlink(missing_ok=True)
+            self._lines_path(full_test_id).unlink(missing_ok=True)
+            self._last_used.pop(full_test_id, None)
+            index = self._read_index()
+            if index.pop(full_test_id, None) is not None:
+                self._write_index(index)
+
+    def drop_pipeline(self, pipeline_id: str, keep: str | None = None) -> None:
+        """Remove all tests of a pipeline from the cache, except the test ID to keep."""
+        with self._lock:
+            for full_test_id, entry in self._read_index().items():
+                if entry["pipeline_id"] == pipeline_id and full_test_id != keep:
+                    self.drop(full_test_id)
+
+    def size(self) -> int:
+        """Total size of cached data in bytes."""
+        return sum(p.stat().st_size for p in self.directory.glob("*.ndjson"))
+
+    def _data_size(self, full_test_id: str) -> int:
+        """Size of the data file of a test in bytes, 0 if it is missing."""
+        try:
+            return self._data_path(full_test_id).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _evict(self, keep: str | None = None) -> None:
+        """Evict least recently used tests until the cache is smaller than max_bytes."""
+        self._unchecked_bytes = 0
+        if self.max_bytes is None:
+            return
+        index = self._read_index()
+        sizes = {full_test_id: self._data_size(full_test_id) for full_test_id in index}
+        total = sum(sizes.values())
+        for full_test_id in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if full_test_id == keep:
+                continue
+            total -= sizes[full_test_id]
+            self.drop(full_test_id)
+
+
+class ChannelMapCache:
+    """Cache of channel maps on disk, keyed by the IP and port of the BTS server.
+
+    Lets connect() skip getdevinfo while the cached channel map is younger than ttl seconds.
+    """
+
+    def __init__(self, directory: str | Path | None = None, ttl: float = 86400) -> None:
+        """Initialize the cache.
+
+        Args:
+            directory (optional): where to store the cache, default from default_cache_dir()
+            ttl: maximum age of a cached channel map in seconds, default one day
+
+        """
+        self.directory = Path(directory) if directory else default_cache_dir() / "channel_maps"
+        self.ttl = ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, ip: str, port: int) -> Path:
+        """Get the path of the cached channel map for a server."""
+        return self.directory / f"{ip}-{port}.json"
+
+    def get(self, ip: str, port: int) -> dict[str, dict] | None:
+        """Get the cached channel map of a server, or None if it is missing or older than the TTL."""
+        try:
+            with self._path(ip, port).open() as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry["channel_map"]
+
+    def put(self, ip: str, port: int, channel_map: Mapping[str, Mapping]) -> None:
+        """Store the channel map of a server atomically."""
+        path = self._path(ip, port)
+        tmp_path = path.with_suffix(".tmp")
+        records = {pipeline_id: dict(channel) for pipeline_id, channel in channel_map.items()}
+        with tmp_path.open("w") as f:
+            json.dump({"fetched": time.time(), "channel_map": records}, f)
+        tmp_path.replace(path)
+
+    def drop(self, ip: str, port: int) -> None:
+        """Remove the cached channel map of a server."""
+        self._path(ip, port).unlink(missing_ok=True)
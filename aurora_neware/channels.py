@@ -0,0 +1,192 @@
+"""Compact, indexed channel information for the channel map.
+
+Each channel from getdevinfo is stored as a Channel with typed fields in __slots__, and the channel
+map is a ChannelIndex, which looks channels up by pipeline ID, by address (devid, subdevid, chlid),
+or by device and sub-device. Both are read-only mappings with the same keys as the getdevinfo reply,
+so they can be used like the dictionaries they replace.
+"""
+
+from collections.abc import Iterable, Iterator, Mapping
+
+# Keys of a Channel as a mapping, matching the attributes of a getdevinfo reply
+_CHANNEL_KEYS = ("ip", "devtype", "devid", "subdevid", "Channelid", "channel")
+
+
+class Channel(Mapping):
+    """Information about one channel, read-only and usable as a mapping like the getdevinfo record."""
+
+    __slots__ = ("address", "address_no_ip", "channel", "chlid", "devid", "devtype", "ip", "pipeline_id", "subdevid")
+
+    def __init__(  # noqa: PLR0913
+        self,
+        ip: str,
+        devtype: int,
+        devid: int,
+        subdevid: int,
+        chlid: int,
+        *,
+        channel: str | None = None,
+    ) -> None:
+        """Initialize the channel, and render its address attributes for commands once."""
+        self.ip = ip
+        self.devtype = int(devtype)
+        self.devid = int(devid)
+        self.subdevid = int(subdevid)
+        self.chlid = int(chlid)
+        self.channel = channel
+        self.pipeline_id = f"{self.devid}-{self.subdevid}-{self.chlid}"
+        self.address_no_ip = (
+            f'devtype="{self.devtype}" devid="{self.devid}" subdevid="{self.subdevid}" chlid="{self.chlid}"'
+        )
+        self.address = f'ip="{self.ip}" {self.address_no_ip}'
+
+    @classmethod
+    def from_record(cls, record: Mapping) -> "Channel":
+        """Create a channel from a getdevinfo record, or another Channel."""
+        if isinstance(record, Channel):
+            return record
+        return cls(
+            record["ip"],
+            record["devtype"],
+            record["devid"],
+            record["subdevid"],
+            record["Channelid"],
+            channel=record.get("channel"),
+        )
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        """Address of the channel as (devid, subdevid, chlid)."""
+        return (self.devid, self.subdevid, self.chlid)
+
+    def __getitem__(self, key: str) -> str | int | None:
+        """Get a field by its getdevinfo name."""
+        if key == "Channelid":
+            return self.chlid
+        if key in _CHANNEL_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the getdevinfo names of the fields."""
+        return iter(_CHANNEL_KEYS)
+
+    def __len__(self) -> int:
+        """Return the number of fields."""
+        return len(_CHANNEL_KEYS)
+
+    def __repr__(self) -> str:
+        """Show the pipeline ID and address."""
+        return f"Channel({self.pipeline_id!r}, ip={self.ip!r}, devtype={self.devtype})"
+
+
+class ChannelIndex(Mapping):
+    """Channels of a BTS server keyed by pipeline ID, with lookups by address, device and sub-device."""
+
+    def __init__(self, channels: Iterable[Channel] = ()) -> None:
+        """Build the index from channels."""
+        self._by_id: dict[str, Channel] = {}
+        self._by_key: dict[tuple[int, int, int], Channel] = {}
+        self._by_subdevice: dict[tuple[int, int], list[Channel]] = {}
+        for channel in channels:
+            self._by_id[channel.pipeline_id] = channel
+            self._by_key[channel.key] = channel
+            self._by_subdevice.setdefault((channel.devid, channel.subdevid), []).append(channel)
+
+    @classmethod
+    def from_records(cls, channel_map: Mapping[str, Mapping]) -> "ChannelIndex":
+        """Build the index from a channel map of getdevinfo records, e.g. from getdevinfo() or the cache."""
+        if isinstance(channel_map, ChannelIndex):
+            return channel_map
+        return cls(Channel.from_record(record) for record in channel_map.values())
+
+    def __getitem__(self, pipeline_id: str) -> Channel:
+        """Get a channel by pipeline ID."""
+        return self._by_id[pipeline_id]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over pipeline IDs."""
+        return iter(self._by_id)
+
+    def __len__(self) -> int:
+        """Return the number of channels."""
+        return len(self._by_id)
+
+    def find(self, devid: int, subdevid: int, chlid: int) -> Channel | None:
+        """Get a channel by address, or None if it is not in the index."""
+        return self._by_key.get((devid, subdevid, chlid))
+
+    def device(self, devid: int) -> list[Channel]:
+        """Get all channels of a device."""
+        return [ch for (dev, _subdev), channels in self._by_subdevice.items() if dev == devid for ch in channels]
+
+    def subdevice(self, devid: int, subdevid: int) -> list[Channel]:
+        """Get all channels of a sub-device."""
+        return list(self._by_subdevice.get((devid, subdevid), []))
+
+    def to_dict(self) -> dict[str, dict]:
+        """Convert to a dictionary of getdevinfo records, e.g. to store as JSON."""
+        return {pipeline_id: dict(channel) for pipeline_id, channel in self._by_id.items()}
+
+
+def _record_key(record: Mapping) -> tuple[int, int, int] | None:
+    """Get the address (devid, subdevid, chlid) a reply record reports, or None if it has none."""
+    try:
+        if "dev" in record:  # inquire replies, dev is devtype-devid-subdevid-chlid-auxid
+            _devtype, devid, subdevid, chlid = str(record["dev"]).split("-")[:4]
+            return (int(devid), int(subdevid), int(chlid))
+        return (int(record["devid"]), int(record["subdevid"]), int(record["chlid"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def match_records(pipelines: Mapping[str, Channel], records: list[dict]) -> dict[str, dict]:
+    """Match the records of a reply to the requested channels by the address they report.
+
+    Sometimes the reported subdevid is wrong, e.g. the status of 13-5-5 is reported as 13-1-5.
+    Records without an address, with an address which is not requested, or with an address which is
+    reported more than once are matched by their position in the reply instead. If that channel is
+    already matched, they go to the only unmatched channel with the same devid and chlid.
+
+    Args:
+        pipelines: requested channels, keyed by pipeline ID, in the order they were requested
+        records: records of the reply, in the order they were received
+
+    Returns:
+        records keyed by pipeline ID, in the order of the requested pipelines
+
+    Raises:
+        ValueError: if the records do not match the requested channels
+
+    """
+    if len(records) != len(pipelines):
+        msg = f"Reply has {len(records)} records for {len(pipelines)} requested channels."
+        raise ValueError(msg)
+    channels = list(pipelines.values())
+    requested = {ch.key: i for i, ch in enumerate(channels)}
+    keys = [_record_key(record) for record in records]
+    counts: dict[tuple[int, int, int] | None, int] = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+
+    matched: dict[int, dict] = {}
+    unmatched = []
+    for position, (key, record) in enumerate(zip(keys, records, strict=True)):
+        if key is not None and counts[key] == 1 and key in requested:
+            matched[requested[key]] = record
+        else:
+            unmatched.append((position, key, record))
+    for position, key, record in unmatched:
+        if position not in matched:
+            matched[position] = record
+            continue
+        candidates = [
+            i
+            for i, ch in enumerate(channels)
+            if i not in matched and key is not None and (ch.devid, ch.chlid) == (key[0], key[2])
+        ]
+        if len(candidates) != 1:
+            msg = f"Reply record {position} does not match the requested channels."
+            raise ValueError(msg)
+        matched[candidates[0]] = record
+    return {ch.pipeline_id: matched[i] for i, ch in enumerate(channels)}
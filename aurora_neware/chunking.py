@@ -0,0 +1,92 @@
+"""Adaptive sizing of download chunks.
+
+The number of data points requested per download command is grown or shrunk so each reply takes
+roughly a target time. Large chunks amortise the round-trip time on bulk exports, small chunks keep
+replies short on fragile links.
+"""
+
+from typing import ClassVar
+
+
+class AdaptiveChunkSize:
+    """Chunk size which adapts to the measured reply time of a BTS server.
+
+    After each reply, the size is scaled by target_time / reply time, by at most a factor of two per
+    step, within min_size and max_size. Throughput and round-trip time are tracked as exponentially
+    weighted moving averages. If a server IP is given, the latest size is remembered for the rest of
+    the session and used as the starting size for later downloads from the same server.
+    """
+
+    # Latest chunk size per server IP, shared by all instances in this session
+    _session_sizes: ClassVar[dict[str, int]] = {}
+
+    def __init__(
+        self,
+        server: str | None = None,
+        initial: int = 1000,
+        min_size: int = 100,
+        max_size: int = 50000,
+        target_time: float = 0.5,
+    ) -> None:
+        """Initialize the chunk size.
+
+        Args:
+            server (optional): IP of the BTS server, to remember the chunk size for the session
+            initial: chunk size to start with, if none is remembered for the server
+            min_size: smallest chunk size
+            max_size: largest chunk size
+            target_time: reply time in seconds to aim for
+
+        """
+        if not 0 < min_size <= max_size:
+            msg = "Chunk sizes must satisfy 0 < min_size <= max_size."
+            raise ValueError(msg)
+        self.server = server
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_time = target_time
+        initial = self._session_sizes.get(server, initial) if server else initial
+        self.size = min(max(initial, min_size), max_size)
+        self.bytes_per_second: float | None = None
+        self.round_trip_time: float | None = None
+
+    def __int__(self) -> int:
+        """Return the current chunk size."""
+        return self.size
+
+    def update(self, n_points: int, n_bytes: int, elapsed: float) -> int:
+        """Update the chunk size from a reply.
+
+        Args:
+            n_points: number of data points requested
+            n_bytes: size of the reply in bytes
+            elapsed: seconds from sending the command to receiving the full reply, or from receiving
+                the previous reply if commands are pipelined, so time spent queued is not counted
+
+        Returns:
+            the new chunk size
+
+        """
+        elapsed = max(elapsed, 1e-6)
+        self.bytes_per_second = _ewma(self.bytes_per_second, n_bytes / elapsed)
+        self.round_trip_time = _ewma(self.round_trip_time, elapsed)
+        # Only partial chunks at the end of a download are smaller than the size, do not shrink for those
+        if n_points >= self.size or elapsed > self.target_time:
+            factor = min(max(self.target_time / elapsed, 0.5), 2.0)
+            self.size = min(max(round(n_points * factor), self.min_size), self.max_size)
+        if self.server:
+            self._session_sizes[self.server] = self.size
+        return self.size
+
+    @classmethod
+    def forget(cls, server: str | None = None) -> None:
+        """Forget the remembered chunk size of a server, or of all servers."""
+        if server is None:
+            cls._session_sizes.clear()
+        else:
+            cls._session_sizes.pop(server, None)
+
+
+def _ewma(previous: float | None, value: float, alpha: float = 0.3) -> float:
+    """Exponentially weighted moving average."""
+    return value if previous is None else alpha * value + (1 - alpha) * previous
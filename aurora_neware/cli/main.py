@@ -1,22 +1,50 @@
 """CLI for the Neware battery cycling API."""
 
+import contextlib
 import enum
 import json
+import sys
 from pathlib import Path
 from typing import Annotated
 
 import typer
 
-from aurora_neware import NewareAPI
+from aurora_neware.daemon import DaemonClient, NewareDaemon, connect_api
+from aurora_neware.export import EXPORT_KINDS, export_test, write_csv, write_ndjson
+from aurora_neware.neware import NewareAPI
+from aurora_neware.selection import apply_filters, split_filters
+from aurora_neware.watch import watch_status
 
 app = typer.Typer()
 
+# Options given before the command, set by main()
+_options = {"refresh_channel_map": False}
+
 IndentOption = Annotated[int | None, typer.Option(help="Indent the output.")]
 PipelinesArgument = Annotated[list[str] | None, typer.Argument()]
+SelectorsArgument = Annotated[
+    list[str] | None,
+    typer.Argument(help="Pipeline IDs or selectors e.g. 21-1-3 21-*-* 21-2-1..8 state:working barcode:2512*"),
+]
 NumberOfPoints = Annotated[int, typer.Argument()]
 PathArgument = Annotated[Path, typer.Argument(help="Path to a file")]
 
 
+class DataFormat(str, enum.Enum):
+    """Output formats of get-data."""
+
+    JSON = "json"
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+FormatOption = Annotated[
+    DataFormat,
+    typer.Option("--format", help="json prints one object of lists, ndjson and csv stream one row per point."),
+]
+OutputOption = Annotated[Path | None, typer.Option("--output", "-o", help="Write to a file instead of stdout.")]
+
+
 class Verbosity(enum.IntEnum):
     """Verbosity levels."""
 
@@ -43,9 +71,28 @@ def validate_state(state: list[str] | None) -> list[str]:
     return state
 
 
+@app.callback()
+def main(
+    refresh: Annotated[
+        bool, typer.Option("--refresh", help="Fetch the channel map from the server instead of the cache.")
+    ] = False,
+) -> None:
+    """Control Neware battery cyclers through the BTS API."""
+    _options["refresh_channel_map"] = refresh
+
+
+def select_pipelines(nw: NewareAPI | DaemonClient, selectors: list[str]) -> list[str]:
+    """Resolve selectors to pipeline IDs, exit with an error if nothing matches."""
+    pipeline_ids = nw.select(selectors)
+    if not pipeline_ids:
+        typer.secho(f"Error: no pipelines match {' '.join(selectors)}", err=True, fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+    return pipeline_ids
+
+
 @app.command()
 def status(
-    pipeline_ids: PipelinesArgument = None,
+    pipeline_ids: SelectorsArgument = None,
     state: Annotated[
         list[str] | None,
         typer.Option(..., "--state", "-s", help="Allowed channel state(s)", callback=validate_state),
@@ -61,19 +108,21 @@ def status(
     {"13-1-5":{...}}
     >>> neware status 13-1-5 14-3-5
     {"13-1-5":{...}, "14-3-5":{...}}
+    >>> neware status 13-*-* state:working
+    {"13-1-2":{...}, "13-4-1":{...}, ...}
 
     Args:
-        pipeline_ids (optional): list of pipeline IDs to get status from
+        pipeline_ids (optional): list of pipeline IDs or selectors to get status from
             will use the full channel map if not provided
         state (optional): list of allowed channel statuses
         indent (optional): an integer number that controls the identation of the printed output
 
     """
-    with NewareAPI() as nw:
-        channels = nw.inquire(pipeline_ids)
-        if state:
-            channels = {key: value for key, value in channels.items() if value["workstatus"] in state}
-        typer.echo(json.dumps(channels, indent=indent))
+    addresses, filters = split_filters([*(pipeline_ids or []), *(f"state:{s}" for s in state or [])])
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        channels = nw.inquire(addresses or None)
+    channels = {key: channels[key] for key in apply_filters(channels, filters)}
+    typer.echo(json.dumps(channels, indent=indent))
 
 
 @app.command()
@@ -95,27 +144,87 @@ def get_num_datapoints(
         indent (optional): an integer number that controls the identation of the printed output
 
     """
-    with NewareAPI() as nw:
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
         output = {key: value["count"] for key, value in nw.inquiredf(pipeline_ids).items()}
     typer.echo(json.dumps(output, indent=indent))
 
 
 @app.command()
-def get_data(pipeline_id: str, n_points: NumberOfPoints = 0, indent: IndentOption = None) -> None:
+def get_data(
+    pipeline_id: str,
+    n_points: NumberOfPoints = 0,
+    indent: IndentOption = None,
+    data_format: FormatOption = DataFormat.JSON,
+    output: OutputOption = None,
+) -> None:
     """Get data points (voltage, current, time, etc.) from specified channel.
 
     Example usage:
     >>> neware get-data 220-10-1 10
     {"cycleid": [488, ...], "volt": [4.11252689361572, ... ], "curr": [0.00271010375581682, ...], ...}
+    >>> neware get-data 220-10-1 --format csv --output data.csv
 
     Args:
-        pipeline_id: pipeline ID in format {devid}-{subdevid}-{chlid} e.g. 220-10-1
+        pipeline_id: pipeline ID in format {devid}-{subdevid}-{chlid} e.g. 220-10-1, or a selector
+            which matches exactly one pipeline e.g. barcode:my_sample
         n_points: last n points to get, set to 0 to download all data (can be slow)
         indent (optional): an integer number that controls the identation of the printed output
+        data_format: json for one object of lists, held in memory until all data is downloaded, or
+            ndjson or csv to write rows as each chunk arrives
+        output (optional): path of a file to write to instead of stdout
+
+    """
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        pipeline_ids = select_pipelines(nw, [pipeline_id])
+        if len(pipeline_ids) > 1:
+            typer.secho(
+                f"Error: {pipeline_id} matches {len(pipeline_ids)} pipelines, it must match exactly one",
+                err=True,
+                fg=typer.colors.RED,
+            )
+            raise typer.Exit(code=1)
+        with output.open("w", newline="", encoding="utf-8") if output else contextlib.nullcontext(sys.stdout) as file:
+            if data_format == DataFormat.JSON:
+                file.write(json.dumps(nw.download(pipeline_ids[0], n_points), indent=indent) + "\n")
+                return
+            chunks = nw.iter_download(pipeline_ids[0], start=-n_points if n_points else 0)
+            if data_format == DataFormat.NDJSON:
+                write_ndjson(chunks, file)
+            else:
+                write_csv(chunks, file)
+
+
+@app.command()
+def export(
+    pipeline_id: str,
+    path: PathArgument,
+    kind: Annotated[str, typer.Option(help=f"What to export: {', '.join(EXPORT_KINDS)}.")] = "data",
+    n_points: Annotated[int, typer.Option(help="Last n data points to export, 0 for all data.")] = 0,
+    compression: Annotated[str, typer.Option(help="Compression codec e.g. zstd, lz4 or none.")] = "zstd",
+) -> None:
+    """Export the data, step layer or log of the latest test to a Parquet or Feather file.
+
+    Data is written as it is downloaded, and the full test ID is stored in the file metadata.
+    Needs pyarrow, install with 'pip install aurora-neware[arrow]'.
+
+    Example usage:
+    >>> neware export 220-10-1 data.parquet
+    >>> neware export 220-10-1 steps.feather --kind steps
+
+    Args:
+        pipeline_id: pipeline ID in format {devid}-{subdevid}-{chlid} e.g. 220-10-1
+        path: path of the file ending in .parquet, .feather or .arrow
+        kind: 'data' for the data points, 'steps' for the step layer, or 'log' for the log
+        n_points: for data, last n points to export, 0 to export all data
+        compression: compression codec e.g. zstd, lz4 or none
 
     """
-    with NewareAPI() as nw:
-        typer.echo(json.dumps(nw.download(pipeline_id, n_points), indent=indent))
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        try:
+            export_test(nw, pipeline_id, path, kind, last_n_points=n_points, compression=compression)
+        except (ImportError, ValueError) as e:
+            typer.secho(f"Error: {e}", err=True, fg=typer.colors.RED)
+            raise typer.Exit(code=1) from e
 
 
 @app.command()
@@ -131,7 +240,7 @@ def log(pipeline_id: str, indent: IndentOption = None) -> None:
         indent (optional): an integer number that controls the identation of the printed output
 
     """
-    with NewareAPI() as nw:
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
         typer.echo(json.dumps(nw.downloadlog(pipeline_id), indent=indent))
 
 
@@ -161,7 +270,7 @@ def start(
         verbosity: the level of verbosity 0 - Error, 1 - Warning, 2 - Info, 3 - Debug.
 
     """
-    with NewareAPI() as nw:
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
         result = nw.start(
             pipeline_id,
             sample_id,
@@ -183,20 +292,22 @@ def start(
 
 
 @app.command()
-def stop(pipeline_id: str) -> None:
-    """Stop job on selected channel.
+def stop(pipeline_ids: Annotated[list[str], typer.Argument()]) -> None:
+    """Stop job on selected channel(s).
 
     Example usage:
     >>> neware stop 220-10-1
     [{"ip": "127.0.0.1", "devtype": 27, "devid": 220, "subdevid": 10, "chlid": 1, "stop": "ok"}]
+    >>> neware stop 220-10-* state:working
 
     Args:
-        pipeline_id: pipeline ID in format {devid}-{subdevid}-{chlid} e.g. 220-10-1
+        pipeline_ids: list of pipeline IDs in format {devid}-{subdevid}-{chlid} e.g. 220-10-1, or
+            selectors e.g. 220-10-1..4 220-*-* state:working
 
     """
-    with NewareAPI() as nw:
-        result = nw.stop(pipeline_id)
-        if result[0]["stop"] != "ok":
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        result = nw.stop(select_pipelines(nw, pipeline_ids))
+        if any(r["stop"] != "ok" for r in result):
             typer.secho("Error: could not stop job", err=True, fg=typer.colors.RED)
             typer.secho("Output: " + json.dumps(result), err=True, fg=typer.colors.RED)
             raise typer.Exit(code=1)
@@ -211,12 +322,13 @@ def clear_flag(pipeline_ids: Annotated[list[str], typer.Argument()], indent: Ind
     [{"ip": "127.0.0.1", "devtype": 27, "devid": 220, "subdevid": 10, "chlid": 1, "clearflag": "ok"}]
 
     Args:
-        pipeline_ids: list of pipeline IDs in format {devid}-{subdevid}-{chlii} e.g. 220-10-1 220-10-2
+        pipeline_ids: list of pipeline IDs in format {devid}-{subdevid}-{chlii} e.g. 220-10-1 220-10-2,
+            or selectors e.g. 220-10-* state:protect
         indent (optional): an integer number that controls the identation of the printed output
 
     """
-    with NewareAPI() as nw:
-        typer.echo(json.dumps(nw.clearflag(pipeline_ids), indent=indent))
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        typer.echo(json.dumps(nw.clearflag(select_pipelines(nw, pipeline_ids)), indent=indent))
 
 
 # For backwards compatibility
@@ -224,7 +336,7 @@ app.command("clearflag", hidden=True)(clear_flag)
 
 
 @app.command()
-def get_job_id(pipeline_ids: PipelinesArgument = None, full_id: bool = False, indent: IndentOption = None) -> None:
+def get_job_id(pipeline_ids: SelectorsArgument = None, full_id: bool = False, indent: IndentOption = None) -> None:
     """Get the latest test ID from selected pipeline.
 
     Example usage:
@@ -235,15 +347,63 @@ def get_job_id(pipeline_ids: PipelinesArgument = None, full_id: bool = False, in
     {"101-1-1": "101-1-1-21", "101-1-2": "101-1-2-22"}
 
     Args:
-        pipeline_ids (optional): list of pipeline IDs in format {devid}-{subdevid}-{chlid} e.g. 220-10-1 220-10-2
-            will use the full channel map if not provided (warning: this function is slow compared to status)
+        pipeline_ids (optional): list of pipeline IDs in format {devid}-{subdevid}-{chlid} e.g. 220-10-1 220-10-2,
+            or selectors e.g. 220-10-* barcode:2512*, will use the full channel map if not provided
         full_id (optional): controls whether to print short or full id
         indent (optional): an integer number that controls the identation of the printed output
 
     """
     id_key = "full_test_id" if full_id else "test_id"
 
-    with NewareAPI() as nw:
-        result = nw.get_testid(pipeline_ids)
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw:
+        result = nw.get_testid(select_pipelines(nw, pipeline_ids) if pipeline_ids else None)
     out = {key: value[id_key] for key, value in result.items()}
     typer.echo(json.dumps(out, indent=indent))
+
+
+@app.command()
+def watch(
+    pipeline_ids: SelectorsArgument = None,
+    interval: Annotated[float, typer.Option(help="Seconds between polls.")] = 5.0,
+    count: Annotated[int | None, typer.Option(help="Stop after this many polls.")] = None,
+) -> None:
+    """Watch the status of channels, print one JSON line per channel which changed.
+
+    A channel has changed if its workstatus, step_id, cycle_id or log_code is different from the
+    previous poll. Every channel is printed on the first poll. Stop it with Ctrl+C.
+
+    Example usage:
+    >>> neware watch 220-*-* --interval 10
+    {"pipeline_id": "220-1-1", "changed": ["workstatus", ...], "dev": "27-220-1-1-0", ...}
+    {"pipeline_id": "220-1-2", "changed": ["workstatus", ...], "dev": "27-220-1-2-0", ...}
+    {"pipeline_id": "220-1-1", "changed": ["step_id"], "dev": "27-220-1-1-0", ...}
+
+    Args:
+        pipeline_ids (optional): list of pipeline IDs or selectors to watch
+            will use the full channel map if not provided
+        interval: seconds between polls
+        count (optional): stop after this many polls, otherwise watch until interrupted
+
+    """
+    with connect_api(refresh_channel_map=_options["refresh_channel_map"]) as nw, contextlib.suppress(KeyboardInterrupt):
+        selected = select_pipelines(nw, pipeline_ids) if pipeline_ids else None
+        for event in watch_status(nw.inquire, selected, interval=interval, polls=count):
+            typer.echo(json.dumps(event))
+
+
+@app.command()
+def daemon() -> None:
+    """Run a local daemon which keeps the connection to the BTS server open.
+
+    While the daemon is running, other neware commands are sent through it, skipping the connection
+    and device information requests on every call. Stop it with Ctrl+C.
+
+    Example usage:
+    >>> neware daemon
+    Daemon listening on C:/Users/user/AppData/Local/aurora_neware/daemon-127.0.0.1-502.sock
+
+    """
+    with NewareDaemon() as nd:
+        typer.echo(f"Daemon listening on {nd.path}")
+        with contextlib.suppress(KeyboardInterrupt):
+            nd.serve_forever()
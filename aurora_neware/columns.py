@@ -0,0 +1,232 @@
+"""Column-oriented, typed storage for data points downloaded from Neware channels.
+
+Data points are parsed straight into array.array buffers with fixed types from a known schema,
+instead of one dictionary of boxed Python objects per point. If NumPy is installed, columns are
+returned as NumPy arrays which share memory with the buffers.
+"""
+
+import array
+from collections.abc import Iterator
+from datetime import datetime, timezone
+
+from defusedxml import ElementTree
+
+from .parsing import _auto_convert_type, scan_table
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Known fields of <data> elements in download replies and their array.array typecodes
+# 'q' is a 64-bit integer, 'd' is a 64-bit float, None is stored as a list of strings
+# atime is stored as integer seconds since 1970-01-01 00:00:00 in the cycler's local time
+DATA_SCHEMA: dict[str, str | None] = {
+    "seqid": "q",
+    "stepid": "q",
+    "cycleid": "q",
+    "steptype": None,
+    "testtime": "d",
+    "atime": "q",
+    "volt": "d",
+    "curr": "d",
+    "cap": "d",
+    "eng": "d",
+}
+
+# Value stored in integer columns when the BTS reports no value ("--")
+MISSING_INT = -1
+
+_TIME_FIELDS = {"atime"}
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _to_int(value: str) -> int:
+    """Convert a string to int, missing values become MISSING_INT."""
+    return MISSING_INT if value == "--" else int(value)
+
+
+def _to_float(value: str) -> float:
+    """Convert a string to float, missing values become NaN."""
+    return float("nan") if value == "--" else float(value)
+
+
+def _to_seconds(value: str) -> int:
+    """Convert a BTS timestamp string to integer seconds, missing values become MISSING_INT."""
+    if value == "--":
+        return MISSING_INT
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+
+
+# Builtins which convert a whole column at once, if no value is missing
+_BULK_CONVERTERS = {_to_int: int, _to_float: float}
+
+
+def _from_seconds(value: int) -> str | None:
+    """Convert integer seconds back to a BTS timestamp string."""
+    if value == MISSING_INT:
+        return None
+    return datetime.fromtimestamp(value, tz=timezone.utc).strftime(_TIME_FORMAT)
+
+
+class DataColumns:
+    """Column-oriented, typed container for data points.
+
+    Columns in the schema are stored in array.array buffers, other fields are kept in lists.
+    Chunks are added with append_xml or extend, and columns are accessed like a dictionary.
+    """
+
+    def __init__(self, schema: dict[str, str | None] | None = None) -> None:
+        """Initialize empty columns from the schema, by default DATA_SCHEMA."""
+        self.schema = DATA_SCHEMA if schema is None else schema
+        self._columns: dict[str, array.array | list] = {
+            field: array.array(typecode) if typecode else [] for field, typecode in self.schema.items()
+        }
+        self._converters = {
+            field: _to_seconds if field in _TIME_FIELDS else _to_int if typecode == "q" else _to_float
+            for field, typecode in self.schema.items()
+            if typecode
+        }
+        self._extra_fields: list[str] = []
+        self._length = 0
+
+    def __len__(self) -> int:
+        """Return the number of data points."""
+        return self._length
+
+    def __contains__(self, key: object) -> bool:
+        """Check if a column exists."""
+        return key in self._columns
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over column names."""
+        return iter(self._columns)
+
+    def __getitem__(self, key: str) -> "array.array | list | np.ndarray":
+        """Get a column, as a NumPy array if NumPy is installed.
+
+        NumPy arrays share memory with the column buffers, so they must be released before more
+        data points can be added.
+        """
+        column = self._columns[key]
+        if np is None:
+            return column
+        if isinstance(column, array.array):
+            dtype = "datetime64[s]" if key in _TIME_FIELDS else column.typecode
+            return np.frombuffer(column, dtype=dtype)
+        return np.array(column, dtype=object)
+
+    def keys(self) -> list[str]:
+        """Return the column names."""
+        return list(self._columns)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the column buffers in bytes, excluding list columns."""
+        return sum(c.itemsize * len(c) for c in self._columns.values() if isinstance(c, array.array))
+
+    def append_xml(self, xml_string: str, list_name: str = "list") -> int:
+        """Parse <data> elements from a download reply straight into the columns.
+
+        Args:
+            xml_string: raw xml string of the reply
+            list_name: the tag that contains the list of elements to parse
+
+        Returns:
+            number of data points added
+
+        """
+        table = scan_table(xml_string, list_name)
+        if table is not None:
+            _tag, fields, values = table
+            return self._append_columns(dict(zip(fields, values, strict=True)), len(values[0]) if values else 0)
+        list_element = ElementTree.fromstring(xml_string).find(list_name)
+        if list_element is None:
+            return 0
+        return self._append_rows([el.attrib for el in list_element])
+
+    def _append_columns(self, values: dict[str, tuple[str, ...]], n_rows: int) -> int:
+        """Append data points given as one tuple of raw strings per field."""
+        columns = self._columns
+        for field, conv in self._converters.items():
+            raw = values.get(field)
+            if raw is None:
+                columns[field].extend([conv("--")] * n_rows)
+                continue
+            builtin = _BULK_CONVERTERS.get(conv)
+            try:
+                columns[field].extend(list(map(builtin or conv, raw)))
+            except ValueError:
+                columns[field].extend(list(map(conv, raw)))
+        for field, typecode in self.schema.items():
+            if not typecode:
+                raw = values.get(field, ("--",) * n_rows)
+                columns[field].extend([None if v == "--" else v for v in raw])
+        for field, raw in values.items():
+            if field not in self.schema:
+                self._extra_column(field).extend(map(_auto_convert_type, raw))
+        for field in self._extra_fields:
+            if field not in values:
+                columns[field].extend([None] * n_rows)
+        self._length += n_rows
+        return n_rows
+
+    def _append_rows(self, attribs: list[dict[str, str]]) -> int:
+        """Append data points given as one dictionary of raw strings per data point."""
+        columns = self._columns
+        schema = self.schema
+        typed = [(columns[field].append, conv, field) for field, conv in self._converters.items()]
+        untyped = [(columns[field].append, field) for field, typecode in schema.items() if not typecode]
+        n_before = self._length
+        for attrib in attribs:
+            for append, conv, field in typed:
+                append(conv(attrib.get(field, "--")))
+            for append, field in untyped:
+                value = attrib.get(field)
+                append(None if value in (None, "--") else value)
+            extra = attrib.keys() - schema.keys()
+            if extra or self._extra_fields:
+                for field in extra:
+                    self._extra_column(field).append(_auto_convert_type(attrib[field]))
+                for field in self._extra_fields:
+                    if len(columns[field]) == self._length:
+                        columns[field].append(None)
+            self._length += 1
+        return self._length - n_before
+
+    def _extra_column(self, field: str) -> list:
+        """Get or create a list column for a field outside of the schema."""
+        if field not in self._columns:
+            self._columns[field] = [None] * self._length
+            self._extra_fields.append(field)
+        return self._columns[field]
+
+    def extend(self, other: "DataColumns") -> None:
+        """Append the data points of another DataColumns."""
+        for field in other:
+            if field not in self._columns:
+                self._extra_column(field)
+        for field, column in self._columns.items():
+            if field in other:
+                column.extend(other._columns[field])  # noqa: SLF001
+            else:
+                column.extend([None] * len(other))
+        self._length += len(other)
+
+    def slice(self, start: int, stop: int) -> "DataColumns":
+        """Get a copy of the data points from position start up to stop."""
+        result = DataColumns(self.schema)
+        result._columns = {field: column[start:stop] for field, column in self._columns.items()}
+        result._extra_fields = list(self._extra_fields)
+        result._length = len(range(self._length)[start:stop])
+        return result
+
+    def to_dict(self) -> dict[str, list]:
+        """Convert to a dictionary of lists of Python objects, like NewareAPI.download."""
+        result: dict[str, list] = {}
+        for field, column in self._columns.items():
+            if field in _TIME_FIELDS and isinstance(column, array.array):
+                result[field] = [_from_seconds(v) for v in column]
+            else:
+                result[field] = column.tolist() if isinstance(column, array.array) else list(column)
+        return result
@@ -0,0 +1,449 @@
+"""Local daemon which keeps a connection to a BTS server open between CLI calls.
+
+Every CLI command would otherwise open a TCP connection, do the 'connect' handshake and fetch the
+channel map with getdevinfo before running. The daemon does this once, and serves commands to local
+clients with one JSON request and one JSON response per line. It listens on a Unix socket, or on a
+localhost TCP port written to the same path where Unix sockets are not available. As any local user
+can connect to a TCP port, requests to it must then include a random token, which is written next to
+the port file and only readable by the user running the daemon.
+"""
+
+import contextlib
+import functools
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+from .cache import ChannelMapCache, default_cache_dir
+from .neware import NewareAPI
+
+# Methods of NewareAPI which clients may call through the daemon
+DAEMON_METHODS = frozenset(
+    {
+        "clearflag",
+        "download",
+        "downloadlog",
+        "get_steps",
+        "get_testid",
+        "getchlstatus",
+        "getdevinfo",
+        "inquire",
+        "inquiredf",
+        "light",
+        "refresh_channel_map",
+        "select",
+        "start",
+        "stop",
+    }
+)
+# Generator methods of NewareAPI, their results are sent as one line per item
+STREAMING_METHODS = frozenset({"iter_download"})
+# Methods which only read, these are retried once after reconnecting if the connection was lost
+_READ_ONLY_METHODS = DAEMON_METHODS - {"clearflag", "light", "start", "stop"}
+# Errors passed through to the client with the same type, others are raised as RuntimeError
+_ERRORS = {
+    e.__name__: e for e in (ConnectionError, FileNotFoundError, KeyError, PermissionError, TimeoutError, ValueError)
+}
+# Errors which mean the connection to the BTS server was lost, other OSErrors e.g. a missing payload file do not
+_CONNECTION_ERRORS = (ConnectionError, TimeoutError, socket.gaierror, socket.herror)
+_HAS_UNIX_SOCKETS = hasattr(socket, "AF_UNIX")
+# Maximum age in seconds of cached channel maps used by the daemon and CLI, so new channels show up soon
+CLI_CHANNEL_MAP_TTL = 600.0
+
+
+def daemon_path(ip: str = "127.0.0.1", port: int = 502) -> Path:
+    """Get the path of the daemon socket for a BTS server, in the cache directory."""
+    return default_cache_dir() / f"daemon-{ip}-{port}.sock"
+
+
+def _token_path(path: Path) -> Path:
+    """Get the path of the token file for a daemon listening on a TCP port."""
+    return path.with_name(path.name + ".token")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answer the requests from one client."""
+
+    server: "_UnixServer | _TCPServer"
+
+    def handle(self) -> None:
+        """Answer one request per line until the client disconnects."""
+        for line in self.rfile:
+            request = json.loads(line, object_hook=_decode)
+            if not self.server.daemon.authorized(request):
+                response = {"error": "PermissionError", "message": "Request without a valid daemon token."}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                return
+            if request.get("method") in STREAMING_METHODS:
+                with contextlib.closing(self.server.daemon.stream(request)) as responses:
+                    for response in responses:
+                        self.wfile.write(json.dumps(response, default=_to_json).encode() + b"\n")
+                continue
+            response = self.server.daemon.dispatch(request)
+            self.wfile.write(json.dumps(response, default=_to_json).encode() + b"\n")
+
+
+if _HAS_UNIX_SOCKETS:
+
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        daemon: "NewareDaemon"
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    daemon: "NewareDaemon"
+
+
+class NewareDaemon:
+    """Daemon holding one authenticated connection and channel map for a BTS server.
+
+    Requests from all clients are run one at a time on the shared connection. If the connection to
+    the BTS server is lost, it is reopened on the next request.
+    """
+
+    def __init__(self, ip: str = "127.0.0.1", port: int = 502, path: str | Path | None = None) -> None:
+        """Initialize the daemon, it starts listening with start() or when entering the context.
+
+        Args:
+            ip: IP address of the BTS server
+            port: port of the BTS server
+            path (optional): path of the daemon socket, default from daemon_path()
+
+        """
+        self.ip = ip
+        self.port = port
+        self.path = Path(path) if path else daemon_path(ip, port)
+        self.nw = NewareAPI(ip, port, channel_map_cache=ChannelMapCache(ttl=CLI_CHANNEL_MAP_TTL))
+        self._lock = threading.Lock()
+        self._server: _UnixServer | _TCPServer | None = None
+        self._token: str | None = None
+
+    def start(self) -> None:
+        """Connect to the BTS server and start listening for clients."""
+        if daemon_running(self.path):
+            msg = f"A daemon is already running on {self.path}"
+            raise RuntimeError(msg)
+        self.nw.connect()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)  # Left behind by a daemon which did not shut down cleanly
+        if _HAS_UNIX_SOCKETS:
+            self._server = _UnixServer(str(self.path), _Handler)
+            self.path.chmod(0o600)
+        else:
+            self._server = _TCPServer(("127.0.0.1", 0), _Handler)
+            self._token = secrets.token_hex(16)
+            _write_private(_token_path(self.path), self._token)
+            self.path.write_text(str(self._server.server_address[1]))
+        self._server.daemon = self
+
+    def serve_forever(self) -> None:
+        """Answer clients until shutdown() is called."""
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        """Stop answering clients and close all connections."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self.path.unlink(missing_ok=True)
+            _token_path(self.path).unlink(missing_ok=True)
+            self._token = None
+        self.nw.disconnect()
+
+    def __enter__(self) -> "NewareDaemon":
+        """Start the daemon when entering the context."""
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Shut down the daemon when exiting the context."""
+        self.shutdown()
+
+    def authorized(self, request: dict) -> bool:
+        """Check a request has the token of the daemon, if it listens on a TCP port."""
+        if self._token is None:
+            return True
+        token = request.get("token")
+        return isinstance(token, str) and hmac.compare_digest(token, self._token)
+
+    def dispatch(self, request: dict) -> dict:
+        """Run a request, return the result or error.
+
+        Args:
+            request: dictionary with 'method', and optionally 'args' and 'kwargs'
+
+        Returns:
+            dictionary with 'result', or 'error' and 'message' if the method raised
+
+        """
+        method = request.get("method")
+        if method not in DAEMON_METHODS:
+            return {"error": "ValueError", "message": f"Method {method!r} cannot be called through the daemon."}
+        args, kwargs = request.get("args", []), request.get("kwargs", {})
+        kwargs.pop("columnar", None)  # DataColumns cannot be sent as JSON
+        with self._lock:
+            try:
+                try:
+                    return {"result": getattr(self.nw, method)(*args, **kwargs)}
+                except _CONNECTION_ERRORS:
+                    self._reconnect()
+                    if method not in _READ_ONLY_METHODS:
+                        raise
+                    return {"result": getattr(self.nw, method)(*args, **kwargs)}
+            except Exception as e:  # noqa: BLE001
+                return _error(e)
+
+    def stream(self, request: dict) -> Iterator[dict]:
+        """Run a request for a generator method, yield each item and then the end or error.
+
+        The connection to the BTS server is held until the generator is exhausted or closed. The
+        request is not retried if the connection is lost, as part of the result has been sent.
+
+        Args:
+            request: dictionary with 'method', and optionally 'args' and 'kwargs'
+
+        Yields:
+            dictionary with 'chunk' for each item, then 'result' as None, or 'error' and 'message'
+
+        """
+        method = request.get("method")
+        if method not in STREAMING_METHODS:
+            yield {"error": "ValueError", "message": f"Method {method!r} cannot be streamed through the daemon."}
+            return
+        args, kwargs = request.get("args", []), request.get("kwargs", {})
+        kwargs.pop("columnar", None)  # DataColumns cannot be sent as JSON
+        with self._lock:
+            try:
+                for chunk in getattr(self.nw, method)(*args, **kwargs):
+                    yield {"chunk": chunk}
+            except _CONNECTION_ERRORS as e:
+                self._reconnect()
+                yield _error(e)
+            except Exception as e:  # noqa: BLE001
+                yield _error(e)
+            else:
+                yield {"result": None}
+
+    def _reconnect(self) -> None:
+        """Replace the connection to the BTS server."""
+        self.nw.disconnect()
+        self.nw = NewareAPI(self.ip, self.port, channel_map_cache=self.nw.channel_map_cache)
+        self.nw.connect()
+
+
+def _encode(obj: object) -> object:
+    """Encode datetimes in requests so the daemon can decode them, other objects as strings."""
+    if isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    return str(obj)
+
+
+def _to_json(obj: object) -> object:
+    """Encode results for the client, e.g. a ChannelIndex as a dictionary, other objects as strings."""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+
+def _decode(obj: dict) -> object:
+    """Decode datetimes encoded by _encode."""
+    if obj.keys() == {"__datetime__"}:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _error(e: Exception) -> dict:
+    """Get the response for an exception."""
+    return {"error": type(e).__name__, "message": str(e.args[0]) if e.args else ""}
+
+
+class DaemonClient:
+    """Client for a NewareDaemon, with the same methods as NewareAPI listed in DAEMON_METHODS."""
+
+    def __init__(self, ip: str = "127.0.0.1", port: int = 502, path: str | Path | None = None) -> None:
+        """Initialize the client, the connection is opened with connect() or when entering the context.
+
+        Args:
+            ip: IP address of the BTS server
+            port: port of the BTS server
+            path (optional): path of the daemon socket, default from daemon_path()
+
+        """
+        self.path = Path(path) if path else daemon_path(ip, port)
+        self._socket: socket.socket | None = None
+        self._file = None
+        self._token: str | None = None
+
+    def connect(self) -> None:
+        """Connect to the daemon, raises ConnectionError if it is not running."""
+        self._socket = _connect_to_daemon(self.path)
+        if not _HAS_UNIX_SOCKETS:
+            try:
+                self._token = _token_path(self.path).read_text()
+            except OSError as e:
+                self._socket.close()
+                self._socket = None
+                msg = f"Cannot read the token of the daemon on {self.path}"
+                raise ConnectionError(msg) from e
+        self._file = self._socket.makefile("rwb")
+
+    def disconnect(self) -> None:
+        """Close the connection to the daemon."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self) -> "DaemonClient":
+        """Connect to the daemon when entering the context."""
+        self.connect()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the connection when exiting the context."""
+        self.disconnect()
+
+    def call(self, method: str, *args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+        """Call a NewareAPI method through the daemon, and return the result."""
+        self._request(method, args, kwargs)
+        return self._response()["result"]
+
+    def iter_download(
+        self,
+        pipeline_id: str,
+        start: int = 0,
+        chunk_size: int | str = 1000,
+        window: int = 1,
+    ) -> Iterator[dict[str, list]]:
+        """Download the data points for a channel through the daemon, yielding one chunk at a time.
+
+        See NewareAPI.iter_download, chunks are always dictionaries of lists. If the iterator is
+        closed early, the connection to the daemon is reopened to skip the rest of the reply.
+        """
+        self._request("iter_download", [pipeline_id], {"start": start, "chunk_size": chunk_size, "window": window})
+        try:
+            response = self._response()
+            while "chunk" in response:
+                yield response["chunk"]
+                response = self._response()
+        except GeneratorExit:
+            self.disconnect()
+            self.connect()
+            raise
+
+    def _request(self, method: str, args: Sequence, kwargs: dict) -> None:
+        """Send a request to the daemon."""
+        request = {"method": method, "args": args, "kwargs": kwargs}
+        if self._token is not None:
+            request["token"] = self._token
+        self._file.write(json.dumps(request, default=_encode).encode() + b"\n")
+        self._file.flush()
+
+    def _response(self) -> dict:
+        """Read one response from the daemon, raise the error if it is one."""
+        line = self._file.readline()
+        if not line:
+            msg = "Connection closed by the daemon before the reply was complete."
+            raise ConnectionError(msg)
+        response = json.loads(line)
+        if "error" in response:
+            raise _ERRORS.get(response["error"], RuntimeError)(response["message"])
+        return response
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        """Get a NewareAPI method which is run through the daemon."""
+        if name in DAEMON_METHODS:
+            return functools.partial(self.call, name)
+        msg = f"{type(self).__name__!r} object has no attribute {name!r}"
+        raise AttributeError(msg)
+
+
+def _write_private(path: Path, text: str) -> None:
+    """Write a file which only the current user can read."""
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+
+def _connect_to_daemon(path: Path) -> socket.socket:
+    """Open a socket to the daemon at path."""
+    if not path.exists():
+        msg = f"No daemon running on {path}"
+        raise ConnectionError(msg)
+    try:
+        if _HAS_UNIX_SOCKETS:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(str(path))
+            except OSError:
+                sock.close()
+                raise
+            return sock
+        return socket.create_connection(("127.0.0.1", int(path.read_text())))
+    except (OSError, ValueError) as e:
+        msg = f"No daemon running on {path}"
+        raise ConnectionError(msg) from e
+
+
+def daemon_running(path: str | Path) -> bool:
+    """Check if a daemon is answering on path."""
+    try:
+        _connect_to_daemon(Path(path)).close()
+    except ConnectionError:
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def connect_api(
+    ip: str = "127.0.0.1",
+    port: int = 502,
+    *,
+    refresh_channel_map: bool = False,
+) -> Iterator[NewareAPI | DaemonClient]:
+    """Connect through the daemon if it is running, otherwise directly to the BTS server.
+
+    The channel map is cached for CLI_CHANNEL_MAP_TTL seconds, with refresh_channel_map it is
+    fetched from the server and the cache is updated.
+    """
+    client = DaemonClient(ip, port)
+    try:
+        client.connect()
+    except ConnectionError:
+        channel_map_cache = ChannelMapCache(ttl=CLI_CHANNEL_MAP_TTL)
+        if refresh_channel_map:
+            channel_map_cache.drop(ip, port)
+        with NewareAPI(ip, port, channel_map_cache=channel_map_cache) as nw:
+            yield nw
+        return
+    try:
+        if refresh_channel_map:
+            client.refresh_channel_map()
+        yield client
+    finally:
+        client.disconnect()
@@ -0,0 +1,265 @@
+"""Write downloaded data to files chunk by chunk.
+
+The writers take the chunks from iter_download and write each one before the next is downloaded,
+so only one chunk is held in memory however long the test is. Data can be written as NDJSON or CSV
+text, or with pyarrow installed, as compressed Parquet or Feather files with typed columns.
+"""
+
+import csv
+import json
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any, TextIO
+
+from .columns import DATA_SCHEMA
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+# Columnar file formats by file extension
+COLUMNAR_FORMATS = {".parquet": "parquet", ".feather": "feather", ".arrow": "feather"}
+# What can be exported from a test
+EXPORT_KINDS = ("data", "steps", "log")
+
+# Fields with BTS timestamp strings, stored as timestamps in columnar files
+_TIME_FIELDS = {"atime", "endatime"}
+
+
+def iter_rows(chunk: Mapping[str, Sequence]) -> Iterator[dict]:
+    """Turn a chunk of columns into one dictionary per data point."""
+    keys = list(chunk)
+    for values in zip(*(chunk[key] for key in keys), strict=True):
+        yield dict(zip(keys, values, strict=True))
+
+
+def write_ndjson(chunks: Iterable[Mapping[str, Sequence]], file: TextIO) -> int:
+    """Write data as one JSON object per line.
+
+    Args:
+        chunks: chunks of data, e.g. from iter_download
+        file: text file to write to
+
+    Returns:
+        number of data points written
+
+    """
+    n_rows = 0
+    for chunk in chunks:
+        lines = [json.dumps(row) for row in iter_rows(chunk)]
+        if lines:
+            file.write("\n".join(lines) + "\n")
+            file.flush()
+        n_rows += len(lines)
+    return n_rows
+
+
+def write_csv(chunks: Iterable[Mapping[str, Sequence]], file: TextIO) -> int:
+    """Write data as CSV, with a header from the columns of the first chunk.
+
+    Args:
+        chunks: chunks of data, e.g. from iter_download
+        file: text file to write to, opened with newline=""
+
+    Returns:
+        number of data points written
+
+    """
+    writer = None
+    n_rows = 0
+    for chunk in chunks:
+        if writer is None:
+            writer = csv.DictWriter(file, fieldnames=list(chunk), extrasaction="ignore")
+            writer.writeheader()
+        rows = list(iter_rows(chunk))
+        writer.writerows(rows)
+        file.flush()
+        n_rows += len(rows)
+    return n_rows
+
+
+def _require_pyarrow() -> None:
+    """Raise ImportError if pyarrow is not installed."""
+    if pa is None:
+        msg = "Writing Parquet or Feather files needs pyarrow, install it with 'pip install aurora-neware[arrow]'"
+        raise ImportError(msg)
+
+
+def _arrow_type(typecode: str | None, field: str) -> "pa.DataType":
+    """Get the Arrow type of a field in DATA_SCHEMA."""
+    if field in _TIME_FIELDS:
+        return pa.timestamp("s")
+    return {"q": pa.int64(), "d": pa.float64()}.get(typecode, pa.string())
+
+
+def _to_arrow(field: str, values: Sequence, arrow_type: "pa.DataType | None" = None) -> "pa.Array":
+    """Convert a column to an Arrow array, inferring the type if not given."""
+    if field in _TIME_FIELDS and isinstance(values, list):
+        values = [datetime.fromisoformat(v) if isinstance(v, str) else v for v in values]
+    if arrow_type is not None:
+        return pa.array(values, type=arrow_type)
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):  # Mixed types are stored as strings
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    return array.cast(pa.string()) if pa.types.is_null(array.type) else array
+
+
+class ColumnarWriter:
+    """Write chunks of data to a Parquet or Feather file, without holding the whole file in memory.
+
+    The columns and types are set by the schema and the first chunk, each chunk is written as one
+    row group or record batch. Needs pyarrow.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        *,
+        file_format: str | None = None,
+        schema: dict[str, str | None] | None = None,
+        metadata: dict[str, Any] | None = None,
+        compression: str = "zstd",
+    ) -> None:
+        """Initialize the writer, the file is created when the first chunk is written.
+
+        Args:
+            path: path of the file
+            file_format (optional): 'parquet' or 'feather', by default from the file extension
+            schema (optional): typecodes of known columns like DATA_SCHEMA, other columns are inferred
+            metadata (optional): key-value metadata stored in the file, values are converted to strings
+            compression: compression codec e.g. 'zstd', 'lz4' or 'none'
+
+        """
+        _require_pyarrow()
+        self.path = Path(path)
+        self.file_format = file_format or COLUMNAR_FORMATS.get(self.path.suffix.lower())
+        if self.file_format not in COLUMNAR_FORMATS.values():
+            msg = f"Unknown file format for {self.path}, use one of {', '.join(COLUMNAR_FORMATS)}"
+            raise ValueError(msg)
+        self.schema = schema or {}
+        self.metadata = {str(k): str(v) for k, v in (metadata or {}).items()}
+        self.compression = compression
+        self.n_rows = 0
+        self._arrow_schema: pa.Schema | None = None
+        self._writer: Any = None
+        self._sink: Any = None
+
+    def write(self, chunk: Mapping[str, Sequence]) -> int:
+        """Write a chunk of columns, e.g. from iter_download. Returns the number of data points written."""
+        if self._arrow_schema is None:
+            fields = [pa.field(f, _arrow_type(t, f)) for f, t in self.schema.items()]
+            fields += [pa.field(f, _to_arrow(f, chunk[f]).type) for f in chunk if f not in self.schema]
+            self._open(pa.schema(fields, metadata=self.metadata))
+        n_rows = len(next(iter(chunk.values()), ()))
+        arrays = [
+            _to_arrow(field.name, chunk[field.name], field.type)
+            if field.name in chunk
+            else pa.nulls(n_rows, field.type)
+            for field in self._arrow_schema
+        ]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self._arrow_schema))
+        self.n_rows += n_rows
+        return n_rows
+
+    def close(self) -> None:
+        """Finish the file, an empty file is written if no chunks were written."""
+        if self._arrow_schema is None:
+            fields = [pa.field(f, _arrow_type(t, f)) for f, t in self.schema.items()]
+            self._open(pa.schema(fields, metadata=self.metadata))
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def __enter__(self) -> "ColumnarWriter":
+        """Enter the context, the file is closed on exit."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the file when exiting the context."""
+        self.close()
+
+    def _open(self, schema: "pa.Schema") -> None:
+        """Create the file with the schema."""
+        self._arrow_schema = schema
+        compression = None if self.compression == "none" else self.compression
+        if self.file_format == "parquet":
+            self._writer = pq.ParquetWriter(self.path, schema, compression=compression or "none")
+        else:
+            self._sink = pa.OSFile(str(self.path), "wb")
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._writer = pa.ipc.new_file(self._sink, schema, options=options)
+
+
+def _records_to_columns(records: list[dict]) -> dict[str, list]:
+    """Turn a list of records, e.g. from get_steps, into a dictionary of columns."""
+    fields = list(dict.fromkeys(field for record in records for field in record))
+    return {field: [record.get(field) for record in records] for field in fields}
+
+
+def export_test(  # noqa: PLR0913
+    nw: Any,  # noqa: ANN401
+    pipeline_id: str,
+    path: str | Path,
+    kind: str = "data",
+    *,
+    last_n_points: int = 0,
+    file_format: str | None = None,
+    compression: str = "zstd",
+) -> int:
+    """Write the data, step layer or log of the latest test on a channel to a Parquet or Feather file.
+
+    Data is downloaded and written chunk by chunk. The pipeline ID, test ID and full test ID are
+    stored in the file metadata. Needs pyarrow.
+
+    Args:
+        nw: connected NewareAPI, or a DaemonClient
+        pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
+        path: path of the file, the format is taken from the extension .parquet, .feather or .arrow
+        kind: 'data' for the data points, 'steps' for the step layer, or 'log' for the log
+        last_n_points: for data, how many datapoints to export, 0 for all data
+        file_format (optional): 'parquet' or 'feather', by default from the file extension
+        compression: compression codec e.g. 'zstd', 'lz4' or 'none'
+
+    Returns:
+        number of rows written
+
+    """
+    if kind not in EXPORT_KINDS:
+        msg = f"Unknown export kind {kind!r}, use one of {', '.join(EXPORT_KINDS)}"
+        raise ValueError(msg)
+    _require_pyarrow()  # Before any commands are sent
+    test = nw.get_testid(pipeline_id)[pipeline_id]
+    metadata = {
+        "pipeline_id": pipeline_id,
+        "test_id": test["test_id"],
+        "full_test_id": test["full_test_id"],
+        "kind": kind,
+    }
+    with ColumnarWriter(
+        path,
+        file_format=file_format,
+        schema=DATA_SCHEMA if kind == "data" else None,
+        metadata=metadata,
+        compression=compression,
+    ) as writer:
+        if kind == "data":
+            for chunk in nw.iter_download(pipeline_id, start=-last_n_points if last_n_points else 0):
+                writer.write(chunk)
+        else:
+            records = nw.get_steps(pipeline_id) if kind == "steps" else nw.downloadlog(pipeline_id)
+            if records:
+                writer.write(_records_to_columns(records))
+        return writer.n_rows
@@ -4,12 +4,34 @@ Contains a single class NewareAPI that provides methods to interact with the
 Neware Battery Testing System.
 """
 
+import bisect
+import contextlib
+import functools
+import queue
 import re
 import socket
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Generator, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from types import TracebackType
+from typing import Any
 
-from defusedxml import ElementTree
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import ParseError
+
+from .cache import ChannelMapCache, DownloadCache
+from .channels import Channel, ChannelIndex, match_records
+from .chunking import AdaptiveChunkSize
+from .columns import DataColumns
+from .export import export_test
+from .parsing import RecordStream, fast_records, generic_records
+from .ranges import Bounds, interpolate, parse_time, seqid_ranges, split_ranges, time_anchors, to_cycler_time
+from .selection import apply_filters, resolve, split_filters
+from .watch import WATCH_FIELDS, watch_status
 
 # Possible commands from Neware's API
 # DONE
@@ -19,44 +41,28 @@ from defusedxml import ElementTree
 # broadcaststop, continue, chl_ctrl, goto, parallel, getparallel, resetalarm, reset
 
 
-def _auto_convert_type(value: str) -> int | float | str | None:
-    """Try to automatically convert a string to float or int."""
-    if value == "--":
-        return None
-    try:
-        if "." in value:
-            return float(value)
-        return int(value)
-    except ValueError:
-        return value
-
-
 def _xml_to_records(
     xml_string: str,
     list_name: str = "list",
+    command: str | None = None,
 ) -> list[dict]:
     """Extract elements inside <list> tags, convert to a list of dictionaries.
 
+    Flat lists are scanned with the fast parser, anything else is parsed with defusedxml.
+
     Args:
         xml_string: raw xml string
         list_name: the tag that contains the list of elements to parse
+        command (optional): the command of the reply, to convert values with its schema
 
     Returns:
         list of dictionaries like 'orient = records' in JSON
 
     """
-    # Parse response XML string
-    root = ElementTree.fromstring(xml_string)
-    # Find <list> element
-    list_element = root.find(list_name)
-    # Extract <name> elements to a list of dictionaries
-    result = []
-    for el in list_element:
-        el_dict = el.attrib
-        if el.text:
-            el_dict[el.tag] = el.text
-        result.append(el_dict)
-    return [{k: _auto_convert_type(v) for k, v in el.items()} for el in result]
+    records = fast_records(xml_string, list_name, command)
+    if records is None:
+        records = generic_records(xml_string, list_name, command)
+    return records
 
 
 def _lod_to_dol(ld: list[dict]) -> dict[str, list]:
@@ -67,7 +73,301 @@ def _lod_to_dol(ld: list[dict]) -> dict[str, list]:
         return {}
 
 
-class NewareAPI:
+_CONNECT_COMMAND = "<cmd>connect</cmd><username>admin</username><password>neware</password><type>bfgs</type>"
+_START_ALLOWED_STATES = ["finish", "stop", "protect"]
+# When searching for a time, ranges of up to this many points are downloaded in one probe
+_PROBE_CHUNK = 64
+# Times a verified download restarts from the same position before giving up
+_VERIFY_RETRIES = 3
+# Chunks each span of a parallel download may get ahead of the span being yielded
+_SPAN_QUEUE_SIZE = 4
+# Marks the end of a span in its queue
+_SPAN_END = object()
+
+
+def _build_list_command(cmd: str, elements: list[str], footer: str = "</list>") -> str:
+    """Build a command with a list of per-channel elements."""
+    return f'<cmd>{cmd}</cmd><list count = "{len(elements)}">' + "".join(elements) + footer
+
+
+def _build_channel_command(cmd: str, tag: str, addresses: list[str], body: str = "true", attrs: str = "") -> str:
+    """Build a command with one element per channel address, e.g. stop, light, inquire."""
+    return _build_list_command(cmd, [f"<{tag} {address}{attrs}>{body}</{tag}>" for address in addresses])
+
+
+def _build_inquiredf(addresses: list[str]) -> str:
+    """Build an inquiredf command from channel addresses without ip."""
+    return _build_list_command("inquiredf", [f'<chl {address} testid="0" />' for address in addresses])
+
+
+def _build_start(
+    addresses: list[str],
+    xml_filepaths: list[Path],
+    sample_ids: list[str],
+    save_location: str | Path,
+) -> str:
+    """Build a start command."""
+    elements = [
+        f'<start {address} barcode="{sampleid}">{payload}</start>'
+        for address, payload, sampleid in zip(addresses, xml_filepaths, sample_ids, strict=True)
+    ]
+    footer = (
+        f'<backup backupdir="{Path(save_location).resolve()}" remotedir="" filenametype="0" '
+        'customfilename="" addtimewhenrepeat="0" createdirbydate="0" '
+        'filetype="0" backupontime="1" backupontimeinterval="720" '
+        'backupfree="1" /></list>"'
+    )
+    return _build_list_command("start", elements, footer)
+
+
+def _build_download(address: str, startpos: int, count: int) -> str:
+    """Build a download command for a chunk of data points, from a channel address without ip."""
+    return f'<cmd>download</cmd><download {address} auxid="0" testid="0" startpos="{startpos}" count="{count}"/>'
+
+
+def _build_downloadlog(address: str) -> str:
+    """Build a downloadlog command from a channel address without ip."""
+    return f'<cmd>downloadlog</cmd><download {address} testid="0"/>'
+
+
+def _build_download_step_layer(address: str) -> str:
+    """Build a downloadStepLayer command from a channel address without ip."""
+    return f"<cmd>downloadStepLayer</cmd><downloadStepLayer {address} />"
+
+
+def _merge_records(pipelines: Mapping[str, Channel], records: list[dict]) -> dict[str, dict]:
+    """Merge the records of a reply with the channel information of the requested pipelines.
+
+    Records are matched to the requested channels by the address they report, see match_records.
+    The channel information from the channel map takes priority, as replies sometimes report the
+    wrong subdevid.
+    """
+    return {
+        pipeline_id: {**record, **pipelines[pipeline_id]}
+        for pipeline_id, record in match_records(pipelines, records).items()
+    }
+
+
+def _slice_chunk(chunk: dict[str, list] | DataColumns, start: int, stop: int) -> dict[str, list] | DataColumns:
+    """Get the data points of a chunk from position start up to stop."""
+    if isinstance(chunk, DataColumns):
+        return chunk.slice(start, stop)
+    return {key: values[start:stop] for key, values in chunk.items()}
+
+
+def _parse_download(reply: bytearray | list[dict], columnar: bool = False) -> dict[str, list] | DataColumns | None:
+    """Parse a download reply, or its records from _read_records, into a chunk, None if it has no points."""
+    if columnar:
+        columns = DataColumns()
+        return columns if columns.append_xml(reply.decode()) else None
+    records = reply if isinstance(reply, list) else _xml_to_records(reply.decode(), command="download")
+    return _lod_to_dol(records) if records else None
+
+
+def _chunk_length(chunk: dict[str, list] | DataColumns | None) -> int:
+    """Get the number of data points in a chunk, 0 for None."""
+    if chunk is None:
+        return 0
+    if isinstance(chunk, DataColumns):
+        return len(chunk)
+    return len(next(iter(chunk.values()), ()))
+
+
+def _put_unless_stopped(span_queue: queue.Queue, item: object, stop: threading.Event) -> bool:
+    """Put an item in a bounded queue, False if stop was set while waiting for space."""
+    while not stop.is_set():
+        with contextlib.suppress(queue.Full):
+            span_queue.put(item, timeout=0.1)
+            return True
+    return False
+
+
+def _count_retries(retries: int, n_received: int, what: str) -> int:
+    """Count attempts in a row which received no points, raise ValueError after too many."""
+    retries = 0 if n_received else retries + 1
+    if retries > _VERIFY_RETRIES:
+        msg = f"{what} are missing after {retries} attempts."
+        raise ValueError(msg)
+    return retries
+
+
+def _parse_devinfo(xml_string: str) -> dict[str, dict]:
+    """Parse a getdevinfo reply into a channel map."""
+    devices = _xml_to_records(xml_string, "middle", "getdevinfo")
+    if not devices:
+        msg = "No devices found. Check that devices are working in BTS Client."
+        raise ValueError(msg)
+    return {f"{d['devid']}-{d['subdevid']}-{d['Channelid']}": d for d in devices}
+
+
+def _parse_testid(xml_string: str) -> int:
+    """Get the test ID from a download reply."""
+    match = re.search(r'(?<=testid=")\d+(?=")', xml_string)
+    assert match, "Could not find a 'testid' in response."  # noqa: S101
+    return int(match.group())
+
+
+def _cache_key(ip: str, port: int, pipeline_id: str) -> str:
+    """Get the key of a pipeline in a DownloadCache, which is also safe to use in file names."""
+    return f"{re.sub(r'[^0-9A-Za-z.]', '_', ip)}-{port}-{pipeline_id}"
+
+
+def _start_inputs(
+    sample_ids: str | list[str],
+    xml_files: str | Path | list[str] | list[Path],
+) -> tuple[list[str], list[Path]]:
+    """Normalise and check the sample IDs and payload files of a start command."""
+    if isinstance(sample_ids, str):
+        sample_ids = [sample_ids]
+    if isinstance(xml_files, list):
+        xml_filepaths = [Path(f) for f in xml_files]
+    if isinstance(xml_files, str | Path):
+        xml_filepaths = [Path(xml_files)]
+    if not all(f.exists() for f in xml_filepaths):
+        raise FileNotFoundError
+    return sample_ids, xml_filepaths
+
+
+def _check_startable(status: dict[str, dict]) -> None:
+    """Raise a ValueError if any pipeline is in a state where a job cannot be started."""
+    blocked_pipelines = {
+        k: v.get("workstatus") for k, v in status.items() if v.get("workstatus") not in _START_ALLOWED_STATES
+    }
+    if blocked_pipelines:
+        msg = (
+            "Can only start jobs if pipeline state is "
+            f"{', '.join(repr(state) for state in _START_ALLOWED_STATES)}. "
+            "The following pipelines are in blocked states: "
+            f"{blocked_pipelines}"
+        )
+        raise ValueError(msg)
+
+
+def _refresh_stale_channel_map(method: Callable[..., dict]) -> Callable[..., dict]:
+    """Retry a command once with a fresh channel map, if its reply does not match the cached map."""
+
+    @functools.wraps(method)
+    def wrapper(self: "NewareAPI", *args: Any, **kwargs: Any) -> dict:  # noqa: ANN401
+        try:
+            return method(self, *args, **kwargs)
+        except ValueError:
+            if not self._channel_map_from_cache:
+                raise
+            self.refresh_channel_map()
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class _ChannelMapMixin:
+    """Channel map lookups and command building shared by the synchronous and asynchronous APIs.
+
+    The channel map is a ChannelIndex, the addresses of its channels are rendered once when it is
+    set, and commands for the whole channel map are rendered once and reused.
+    """
+
+    _channel_map: ChannelIndex
+    _full_map_commands: dict[tuple, str]
+
+    @property
+    def channel_map(self) -> ChannelIndex:
+        """Channel information of every pipeline on the server, keyed by pipeline ID."""
+        return self._channel_map
+
+    @channel_map.setter
+    def channel_map(self, channel_map: Mapping[str, Mapping]) -> None:
+        self._channel_map = ChannelIndex.from_records(channel_map)
+        self._full_map_commands = {}
+
+    def _address_of(self, pipeline_id: str, ip: bool = True) -> str:
+        """Get the rendered address of a pipeline in the channel map."""
+        channel = self.get_pipeline(pipeline_id)
+        return channel.address if ip else channel.address_no_ip
+
+    def _render(
+        self,
+        key: tuple,
+        build: Callable[[list[str]], str],
+        pipelines: Mapping[str, Channel],
+        ip: bool = True,
+    ) -> str:
+        """Build a command from the addresses of the pipelines, reused if it is for the whole channel map.
+
+        Args:
+            key: identifies the command, apart from the pipelines
+            build: builder which takes the list of channel addresses
+            pipelines: channel information of the pipelines, e.g. from _select_pipelines
+            ip: whether the addresses include the ip attribute
+
+        """
+        if pipelines is self._channel_map and key in self._full_map_commands:
+            return self._full_map_commands[key]
+        cmd = build([ch.address if ip else ch.address_no_ip for ch in pipelines.values()])
+        if pipelines is self._channel_map:
+            self._full_map_commands[key] = cmd
+        return cmd
+
+    def _channel_command(
+        self,
+        cmd: str,
+        tag: str,
+        pipelines: Mapping[str, Channel],
+        body: str = "true",
+        attrs: str = "",
+    ) -> str:
+        """Build a command with one element per channel, see _build_channel_command."""
+        return self._render(
+            (cmd, tag, body, attrs),
+            functools.partial(_build_channel_command, cmd, tag, body=body, attrs=attrs),
+            pipelines,
+        )
+
+    def _inquiredf_command(self, pipelines: Mapping[str, Channel]) -> str:
+        """Build an inquiredf command, see _build_inquiredf."""
+        return self._render(("inquiredf",), _build_inquiredf, pipelines, ip=False)
+
+    def get_pipeline(self, pipeline_id: str) -> Channel:
+        """Get the channel information for a single pipeline."""
+        try:
+            return self.channel_map[pipeline_id]
+        except KeyError as e:
+            msg = (
+                f"Pipeline ID {pipeline_id} not in channel map. "
+                "Pipeline IDs are in the format {device ID}-{sub-device ID}-{channel ID}. "
+                "On Neware cyclers these are usually integers e.g. 120-10-8 is device 120, sub-device 10, channel 8. "
+                "You can check available pipelines with getdevinfo() or the 'neware status' CLI command."
+            )
+            raise KeyError(msg) from e
+
+    def _select_pipelines(
+        self,
+        pipeline_ids: str | list[str] | tuple[str, ...] | None,
+        default_all: bool = False,
+    ) -> Mapping[str, Channel]:
+        """Get the channel information of one or more pipelines.
+
+        Args:
+            pipeline_ids: pipeline ID or list of pipeline IDs, which may be address selectors like
+                '21-*-*' or '21-2-1..8', see selection.py
+            default_all: use all pipelines in the channel map if no pipeline IDs are given
+
+        """
+        if pipeline_ids is None and default_all:
+            return self.channel_map
+        if isinstance(pipeline_ids, str):
+            pipeline_ids = [pipeline_ids]
+        if isinstance(pipeline_ids, list | tuple):
+            if not pipeline_ids and default_all:
+                return self.channel_map
+            resolved = resolve(self.channel_map, pipeline_ids)
+            if resolved == list(self.channel_map):  # Reuse the commands rendered for the whole map
+                return self.channel_map
+            return {p: self.get_pipeline(p) for p in resolved}
+        msg = "Pipeline_ids must be None, a string, or list of strings."
+        raise ValueError(msg)
+
+
+class NewareAPI(_ChannelMapMixin):
     """Python API for Neware Battery Testing System.
 
     Provides a method to send and receive commands to the Neware Battery Testing
@@ -75,22 +375,82 @@ class NewareAPI:
     status and data from the channels.
     """
 
-    def __init__(self, ip: str = "127.0.0.1", port: int = 502) -> None:
-        """Initialize the NewareAPI object with the IP, port, and channel map."""
+    def __init__(  # noqa: PLR0913
+        self,
+        ip: str = "127.0.0.1",
+        port: int = 502,
+        recv_size: int = 65536,
+        download_cache: DownloadCache | None = None,
+        channel_map_cache: ChannelMapCache | None = None,
+        *,
+        incremental_parse: bool = False,
+    ) -> None:
+        """Initialize the NewareAPI object with the IP, port, and channel map.
+
+        Args:
+            ip: IP address of the BTS server
+            port: port of the BTS server
+            recv_size: maximum number of bytes to read from the socket at once
+            download_cache (optional): cache downloaded data on disk, so repeated downloads from the
+                same test only fetch new data points, use one cache directory per BTS server
+            channel_map_cache (optional): cache the channel map on disk, so connect() can skip
+                getdevinfo, the map is refreshed if a pipeline is missing or a reply does not match it
+            incremental_parse: parse download and downloadlog replies while they are received, so
+                parsing overlaps with the network, by default each reply is parsed once it is complete,
+                columnar downloads are always parsed once the reply is complete
+
+        """
         self.ip = ip
         self.port = port
+        self.recv_size = recv_size
+        self.download_cache = download_cache
+        self.channel_map_cache = channel_map_cache
+        self.incremental_parse = incremental_parse
         self.neware_socket = socket.socket()
-        self.channel_map: dict[str, dict] = {}
+        self.channel_map = ChannelIndex()
+        self._channel_map_from_cache = False
         self.start_message = '<?xml version="1.0" encoding="UTF-8" ?><bts version="1.0">'
         self.end_message = "</bts>"
         self.termination = "\n\n#\r\n"
+        self._recv_buffer = bytearray(recv_size)
+        self._pending = bytearray()
+        # Set while borrowed from a ConnectionPool, which counts it against the per-server limit
+        self._holds_server_slot = False
+
+    def connect(self, channel_map: Mapping[str, Mapping] | None = None) -> None:
+        """Establish the TCP connection.
+
+        Args:
+            channel_map (optional): channel map to use, e.g. from another connection to the same
+                server, if not given it is read from the channel map cache or fetched with getdevinfo()
 
-    def connect(self) -> None:
-        """Establish the TCP connection."""
+        """
         self.neware_socket.connect((self.ip, self.port))
-        connect = "<cmd>connect</cmd><username>admin</username><password>neware</password><type>bfgs</type>"
-        self.command(connect)
+        self.command(_CONNECT_COMMAND)
+        if channel_map is not None:
+            self.channel_map = channel_map
+        elif self.channel_map_cache and (cached := self.channel_map_cache.get(self.ip, self.port)) is not None:
+            self.channel_map = cached
+            self._channel_map_from_cache = True
+        else:
+            self.refresh_channel_map()
+
+    def refresh_channel_map(self) -> ChannelIndex:
+        """Fetch the channel map with getdevinfo, and store it in the channel map cache if used."""
         self.channel_map = self.getdevinfo()
+        self._channel_map_from_cache = False
+        if self.channel_map_cache:
+            self.channel_map_cache.put(self.ip, self.port, self.channel_map)
+        return self.channel_map
+
+    def get_pipeline(self, pipeline_id: str) -> Channel:
+        """Get the channel information for a single pipeline.
+
+        If the channel map came from the cache and does not have the pipeline, it is refreshed first.
+        """
+        if pipeline_id not in self.channel_map and self._channel_map_from_cache:
+            self.refresh_channel_map()
+        return super().get_pipeline(pipeline_id)
 
     def disconnect(self) -> None:
         """Close the port."""
@@ -115,28 +475,109 @@ class NewareAPI:
         """Close the port when the object is deleted."""
         self.disconnect()
 
-    def get_pipeline(self, pipeline_id: str) -> dict:
-        """Get the channel information for a single pipeline."""
-        try:
-            return self.channel_map[pipeline_id]
-        except KeyError as e:
-            msg = (
-                f"Pipeline ID {pipeline_id} not in channel map. "
-                "Pipeline IDs are in the format {device ID}-{sub-device ID}-{channel ID}. "
-                "On Neware cyclers these are usually integers e.g. 120-10-8 is device 120, sub-device 10, channel 8. "
-                "You can check available pipelines with getdevinfo() or the 'neware status' CLI command."
-            )
-            raise KeyError(msg) from e
-
     def command(self, cmd: str) -> str:
         """Send a command to the device, and return the response."""
+        self._send(cmd)
+        return self._read_reply().decode()
+
+    def _send(self, cmd: str) -> None:
+        """Wrap a command in the BTS message envelope and send it."""
         self.neware_socket.sendall(
             str.encode(self.start_message + cmd + self.end_message + self.termination, "utf-8"),
         )
-        received = ""
-        while not received.endswith(self.termination):
-            received += self.neware_socket.recv(2048).decode()
-        return received[: -len(self.termination)]
+
+    def _read_reply(self) -> bytearray:
+        """Read one reply from the socket, up to but excluding the termination.
+
+        Bytes are received into a preallocated buffer and appended to the reply, only the newly
+        received bytes are searched for the termination, and nothing is decoded here, so the cost is
+        linear in the size of the reply and multi-byte characters split across reads are not broken.
+        Any bytes received after the termination are kept for the next reply.
+        """
+        termination = self.termination.encode()
+        if len(self._recv_buffer) != self.recv_size:
+            self._recv_buffer = bytearray(self.recv_size)
+        view = memoryview(self._recv_buffer)
+        reply = self._pending
+        end = reply.find(termination)
+        while end == -1:
+            search_from = max(0, len(reply) - len(termination) + 1)
+            n_bytes = self.neware_socket.recv_into(view)
+            if not n_bytes:
+                msg = "Connection closed by the BTS server before the reply was complete."
+                raise ConnectionError(msg)
+            reply += view[:n_bytes]
+            end = reply.find(termination, search_from)
+        self._pending = reply[end + len(termination) :]
+        del reply[end:]
+        return reply
+
+    def _iter_reply_records(
+        self,
+        command: str | None = None,
+        list_name: str = "list",
+    ) -> Generator[list[dict], None, int]:
+        """Read one reply from the socket, parsing it as it arrives.
+
+        Received bytes are fed to a RecordStream, except the last few which could be the start of
+        the termination, and the records completed by each read are yielded before the rest of the
+        reply has arrived. If the caller stops early or the reply cannot be parsed, the rest of the
+        reply is read so the socket stays in sync. Any bytes received after the termination are kept
+        for the next reply.
+
+        Args:
+            command (optional): the command of the reply, to convert values with its schema
+            list_name: the tag that contains the list of elements to parse
+
+        Returns:
+            size of the reply in bytes
+
+        """
+        termination = self.termination.encode()
+        if len(self._recv_buffer) != self.recv_size:
+            self._recv_buffer = bytearray(self.recv_size)
+        view = memoryview(self._recv_buffer)
+        stream = RecordStream(list_name, command)
+        buffer, self._pending = self._pending, bytearray()
+        n_fed = 0
+        try:
+            while (end := buffer.find(termination)) == -1:
+                n_feed = len(buffer) - len(termination) + 1
+                if n_feed > 0:
+                    records = stream.feed(bytes(buffer[:n_feed]))
+                    del buffer[:n_feed]
+                    n_fed += n_feed
+                    if records:
+                        yield records
+                n_bytes = self.neware_socket.recv_into(view)
+                if not n_bytes:
+                    msg = "Connection closed by the BTS server before the reply was complete."
+                    raise ConnectionError(msg)
+                buffer += view[:n_bytes]
+            records = stream.feed(bytes(buffer[:end])) + stream.close()
+        except (GeneratorExit, ParseError, DefusedXmlException, UnicodeDecodeError):
+            self._pending = buffer
+            self._read_reply()
+            raise
+        self._pending = buffer[end + len(termination) :]
+        if records:
+            yield records
+        return n_fed + end
+
+    def _read_records(self, command: str | None = None) -> tuple[list[dict], int]:
+        """Read and parse one reply while it arrives, see _iter_reply_records.
+
+        Returns:
+            list of dictionaries, and the size of the reply in bytes
+
+        """
+        records: list[dict] = []
+        reader = self._iter_reply_records(command)
+        try:
+            while True:
+                records += next(reader)
+        except StopIteration as stop:
+            return records, stop.value
 
     def start(
         self,
@@ -157,71 +598,21 @@ class NewareAPI:
             one dictionary per channel, key 'start' is 'ok' if job started, otherwise 'false'
 
         """
-        # Check inputs
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-        if isinstance(sample_ids, str):
-            sample_ids = [sample_ids]
-        if isinstance(xml_files, list):
-            xml_filepaths = [Path(f) for f in xml_files]
-        if isinstance(xml_files, str | Path):
-            xml_filepaths = [Path(xml_files)]
-        if not all(f.exists() for f in xml_filepaths):
-            raise FileNotFoundError
-
-        allowed_states = ["finish", "stop", "protect"]
-        status = self.inquire(pipeline_ids)
-        blocked_pipelines = {
-            k: v.get("workstatus") for k, v in status.items() if v.get("workstatus") not in allowed_states
-        }
-        if blocked_pipelines:
-            msg = (
-                "Can only start jobs if pipeline state is "
-                f"{', '.join(repr(state) for state in allowed_states)}. "
-                "The following pipelines are in blocked states: "
-                f"{blocked_pipelines}"
-            )
-            raise ValueError(msg)
-
-        # Create and submit command XML string
-        header = f'<cmd>start</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip, payload, sampleid in zip(pipelines.values(), xml_filepaths, sample_ids, strict=True):
-            middle += (
-                f'<start ip="{pip["ip"]}" devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" barcode="{sampleid}">'
-                f"{payload}</start>"
-            )
-        footer = (
-            f'<backup backupdir="{Path(save_location).resolve()}" remotedir="" filenametype="0" '
-            'customfilename="" addtimewhenrepeat="0" createdirbydate="0" '
-            'filetype="0" backupontime="1" backupontimeinterval="720" '
-            'backupfree="1" /></list>"'
+        pipelines = self._select_pipelines(pipeline_ids)
+        sample_ids, xml_filepaths = _start_inputs(sample_ids, xml_files)
+        _check_startable(self.inquire(pipeline_ids))
+        result = self.command(
+            _build_start([self._address_of(p) for p in pipelines], xml_filepaths, sample_ids, save_location)
         )
-        cmd = header + middle + footer
-        result = self.command(cmd)
         return _xml_to_records(result)
 
     def stop(self, pipeline_ids: str | list[str] | tuple[str]) -> list[dict]:
         """Stop job running on pipeline(s)."""
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-
-        header = f'<cmd>stop</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<stop ip="{pip["ip"]}" devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}">true</stop>'
-            )
-        footer = "</list>"
-        result = self.command(header + middle + footer)
+        pipelines = self._select_pipelines(pipeline_ids)
+        result = self.command(self._channel_command("stop", "stop", pipelines))
         return _xml_to_records(result)
 
+    @_refresh_stale_channel_map
     def getchlstatus(self, pipeline_ids: str | list[str] | None = None) -> dict[str, dict]:
         """Get status of pipeline(s).
 
@@ -236,37 +627,11 @@ class NewareAPI:
             KeyError: if pipeline ID not in the channel map
 
         """
-        # Get the (subset) of the channel map
-        if not pipeline_ids:  # If no argument passed use all pipelines
-            pipelines = self.channel_map
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-
-        # Create and submit command XML string
-        header = f'<cmd>getchlstatus</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<status ip="{pip["ip"]}" devtype="{pip["devtype"]}" '
-                f'devid="{pip["devid"]}" subdevid="{pip["subdevid"]}" '
-                f'chlid="{pip["Channelid"]}">true</status>'
-            )
-        footer = "</list>"
-        xml_string = self.command(header + middle + footer)
-        records = _xml_to_records(xml_string)
-
-        # Sometimes the response subdevid is incorrectly 1
-        # E.g. if you request the status of 13-5-5 it correctly gets the status of 13-5-5, but tells
-        # you it is returning the status of 13-1-5.
-        # Workaround: instead of returning the result directly, we merge it with the input
-        # pipelines, prioritising the (correct) channel information from the channel map.
-        return {
-            pipeline_id: {**record, **pipeline_dict}
-            for (pipeline_id, pipeline_dict), record in zip(pipelines.items(), records, strict=True)
-        }
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = self.command(self._channel_command("getchlstatus", "status", pipelines))
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="getchlstatus"))
 
+    @_refresh_stale_channel_map
     def inquire(self, pipeline_ids: str | list[str] | None = None) -> dict[str, dict]:
         """Inquire the status of the channel.
 
@@ -282,33 +647,56 @@ class NewareAPI:
                 key is the pipeline ID e.g. "13-1-5"
 
         """
-        # Get the (subset) of the channel map
-        if not pipeline_ids:  # If no argument passed use all pipelines
-            pipelines = self.channel_map
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-
-        # Create and submit command XML string
-        header = f'<cmd>inquire</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<inquire ip="{pip["ip"]}" devtype="{pip["devtype"]}" '
-                f'devid="{pip["devid"]}" subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" '
-                'aux="0" barcode="1">true</inquire>'
-            )
-        footer = "</list>"
-        xml_string = self.command(header + middle + footer)
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = self.command(self._channel_command("inquire", "inquire", pipelines, attrs=' aux="0" barcode="1"'))
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="inquire"))
 
-        records = _xml_to_records(xml_string)
+    def watch(
+        self,
+        pipeline_ids: str | list[str] | None = None,
+        interval: float = 5.0,
+        fields: tuple[str, ...] = WATCH_FIELDS,
+        polls: int | None = None,
+    ) -> Iterator[dict]:
+        """Poll the status of channels with inquire, yield only the channels which changed.
 
-        return {
-            pipeline_id: {**record, **pipeline_dict}
-            for (pipeline_id, pipeline_dict), record in zip(pipelines.items(), records, strict=True)
-        }
+        Args:
+            pipeline_ids (optional): pipeline IDs or selectors, all pipelines if not given
+            interval: seconds between the start of each poll
+            fields: fields which are compared, by default workstatus, step_id, cycle_id and log_code
+            polls (optional): stop after this many polls, otherwise watch forever
+
+        Yields:
+            dictionary with 'pipeline_id', the list of 'changed' fields, and the inquire record,
+            every channel is reported on the first poll
+
+        """
+        pipeline_ids = self.select(pipeline_ids) if pipeline_ids else None
+        return watch_status(self.inquire, pipeline_ids, interval=interval, fields=fields, polls=polls)
 
+    def select(self, selectors: str | list[str] | None = None) -> list[str]:
+        """Get the pipeline IDs matching selectors.
+
+        Selectors are pipeline IDs, wildcards and ranges like '21-*-*' or '21-2-1..8', and filters
+        like 'state:working' or 'barcode:251203_*', see selection.py. Filters are applied to the
+        result of one inquire command for all selected pipelines.
+
+        Args:
+            selectors (optional): selector or list of selectors, all pipelines if not given
+
+        Returns:
+            list of pipeline IDs in the order they were selected
+
+        """
+        if isinstance(selectors, str):
+            selectors = [selectors]
+        addresses, filters = split_filters(selectors or [])
+        pipelines = self._select_pipelines(addresses, default_all=True)
+        if not filters:
+            return list(pipelines)
+        return apply_filters(self.inquire(list(pipelines)), filters)
+
+    @_refresh_stale_channel_map
     def inquiredf(self, pipeline_ids: str | list[str] | None = None) -> dict[str, dict]:
         """Use the inquiredf command on the channel.
 
@@ -323,30 +711,9 @@ class NewareAPI:
                 key is the pipeline ID e.g. "13-1-5"
 
         """
-        # Get the (subset) of the channel map
-        if not pipeline_ids:  # If no argument passed use all pipelines
-            pipelines = self.channel_map
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-
-        # Create and submit command XML string
-        header = f'<cmd>inquiredf</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<chl devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" testid="0" />'
-            )
-        footer = "</list>"
-        xml_string = self.command(header + middle + footer)
-        records = _xml_to_records(xml_string)
-
-        return {
-            pipeline_id: {**record, **pipeline_dict}
-            for (pipeline_id, pipeline_dict), record in zip(pipelines.items(), records, strict=True)
-        }
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        xml_string = self.command(self._inquiredf_command(pipelines))
+        return _merge_records(pipelines, _xml_to_records(xml_string, command="inquiredf"))
 
     def downloadlog(self, pipeline_id: str) -> list[dict]:
         """Download the log information for latest test. Only queries one channel at a time.
@@ -358,49 +725,526 @@ class NewareAPI:
             List of dictionaries containing log information.
 
         """
-        pip = self.get_pipeline(pipeline_id)
-        command = (
-            "<cmd>downloadlog</cmd>"
-            f'<download devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-            f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" testid="0"/>'
-        )
-        result = self.command(command)
-        return _xml_to_records(result)
+        cmd = _build_downloadlog(self._address_of(pipeline_id, ip=False))
+        if self.incremental_parse:
+            self._send(cmd)
+            return self._read_records("downloadlog")[0]
+        return _xml_to_records(self.command(cmd), command="downloadlog")
 
-    def download(self, pipeline_id: str, last_n_points: int = 10000) -> dict[str, list]:
+    def download(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        last_n_points: int = 10000,
+        columnar: bool = False,
+        window: int = 1,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        *,
+        cycles: Bounds | None = None,
+        steps: Bounds | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        verify: bool = False,
+        parallelism: int = 1,
+    ) -> dict[str, list] | DataColumns:
         """Download the data points for a channel. By default grabs the last 10000 points.
 
-        WARNING: for large amounts of data (>100k) this can take seconds.
-        Download and parse the .nda/.ndax file if speed matters.
+        WARNING: for large amounts of data (>100k) this can take seconds, and all data is held in
+        memory. Use iter_download to process the data chunk by chunk, use columnar=True to store
+        the data in typed arrays, or download and parse the .nda/.ndax file if speed matters.
+
+        Args:
+            pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
+            last_n_points: how many datapoints to download, set to 0 to get all data, ignored if
+                cycles, steps, since or until are given
+            columnar: return a DataColumns with typed columns instead of a dictionary of lists
+            window: number of chunk requests to keep in flight at once, see iter_download
+            chunk_size: number of datapoints to request per command, see iter_download
+            cycles (optional): only download these cycles, see iter_download
+            steps (optional): only download these steps, see iter_download
+            since (optional): only download points at or after this time, see iter_download
+            until (optional): only download points at or before this time, see iter_download
+            verify: check no points are missing, see iter_download, always done with the download
+                cache
+            parallelism: number of connections to download with at once, see iter_download
+
+        Returns:
+            Dictionary of lists, or DataColumns, of data from latest test
+
+        """
+        ranges = any(x is not None for x in (cycles, steps, since, until))
+        if self.download_cache is not None and not columnar and not ranges:
+            return self._download_cached(pipeline_id, last_n_points, window, chunk_size, parallelism)
+        start = -last_n_points if last_n_points and not ranges else 0
+        chunks = self.iter_download(
+            pipeline_id,
+            start=start,
+            chunk_size=chunk_size,
+            columnar=columnar,
+            window=window,
+            cycles=cycles,
+            steps=steps,
+            since=since,
+            until=until,
+            verify=verify,
+            parallelism=parallelism,
+        )
+        if columnar:
+            columns = DataColumns()
+            for chunk in chunks:
+                columns.extend(chunk)
+            return columns
+        data: dict[str, list] = {}
+        for chunk in chunks:
+            for key, values in chunk.items():
+                data.setdefault(key, []).extend(values)
+        return data
+
+    def download_many(
+        self,
+        pipeline_ids: list[str] | None = None,
+        last_n_points: int = 10000,
+        connections: int = 4,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> tuple[dict[str, dict[str, list]], dict[str, float]]:
+        """Download data from many channels in parallel over a pool of connections.
+
+        Opens a pool of extra connections to the same server, sharing this object's channel map and
+        download cache, and spreads the channels across them.
+
+        Args:
+            pipeline_ids (optional): pipeline IDs to download, default all in the channel map
+            last_n_points: how many datapoints to download per channel, set to 0 to get all data
+            connections: number of connections to open
+            **kwargs: passed to download, e.g. window or chunk_size
+
+        Returns:
+            dictionary of the downloaded data keyed by pipeline ID,
+            dictionary of the download time in seconds keyed by pipeline ID
+
+        """
+        from .pool import ConnectionPool  # noqa: PLC0415
+
+        with ConnectionPool(
+            self.ip,
+            self.port,
+            size=connections,
+            channel_map=self.channel_map,
+            recv_size=self.recv_size,
+            download_cache=self.download_cache,
+            incremental_parse=self.incremental_parse,
+        ) as pool:
+            return pool.download_many(pipeline_ids, last_n_points, **kwargs)
+
+    def _download_cached(
+        self,
+        pipeline_id: str,
+        last_n_points: int,
+        window: int = 1,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        parallelism: int = 1,
+    ) -> dict[str, list]:
+        """Download data points, only fetching points after the tail of the download cache.
+
+        Downloads are verified and each chunk is appended to the cache as it arrives, so an
+        interrupted download resumes after the last cached point. Assumes seqid is the position of
+        the data point in the test, starting from 1. Tests are cached under the IP and port of the
+        server, so one cache can be used for many servers.
+        """
+        cache = self.download_cache
+        res = self.inquiredf(pipeline_id)[pipeline_id]
+        n_total = res["count"]
+        test_id = self._fill_test_ids({pipeline_id: res.get("testid")})[pipeline_id]
+        pipeline_key = _cache_key(self.ip, self.port, pipeline_id)
+        full_test_id = f"{pipeline_key}-{test_id}"
+        start = max(0, n_total - last_n_points) if last_n_points else 0
+
+        # Drop other tests on this pipeline, and cached data that does not cover the request
+        cache.drop_pipeline(pipeline_key, keep=full_test_id)
+        entry = cache.get(full_test_id)
+        if entry is None or entry["first_seqid"] > start + 1 or entry["last_seqid"] > n_total:
+            cache.drop(full_test_id)
+            fetch_from = start
+        else:
+            fetch_from = entry["last_seqid"]
+
+        if parallelism > 1:
+            chunks = self._iter_parallel(
+                pipeline_id, [(fetch_from, n_total)], parallelism, chunk_size=chunk_size, window=window, verify=True
+            )
+        else:
+            chunks = self._iter_verified(pipeline_id, fetch_from, n_total, chunk_size=chunk_size, window=window)
+        for chunk in chunks:
+            cache.append(full_test_id, chunk)
+        return cache.read(full_test_id, first_seqid=start + 1)
+
+    def iter_download(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        start: int = 0,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        columnar: bool = False,
+        window: int = 1,
+        *,
+        cycles: Bounds | None = None,
+        steps: Bounds | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        verify: bool = False,
+        parallelism: int = 1,
+    ) -> Iterator[dict[str, list]] | Iterator[DataColumns]:
+        """Download the data points for a channel, yielding one chunk at a time.
+
+        Only one chunk is held in memory at a time, so results can be written out as they arrive.
+
+        With cycles or steps, the step layer is downloaded first and used to request only the data
+        points of those steps. With since or until, the step layer narrows down where the times
+        are, and a few single points are downloaded to find the exact positions. Both assume seqid
+        is the position of the data point in the test, and times only go forward.
 
         Args:
             pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
-            last_n_points: how many datapoints to download, set to 0 to get all data
+            start: number of datapoints to skip from the beginning of the test, if negative, counts
+                from the end e.g. -100 gives the last 100 points
+            chunk_size: number of datapoints to request per command, or 'auto' to adapt the size to
+                the measured reply time, or an AdaptiveChunkSize to configure the adaptation
+            columnar: yield DataColumns with typed columns instead of dictionaries of lists
+            window: number of chunk requests to keep in flight at once, higher values hide the
+                round-trip time on slow networks
+            cycles (optional): cycle ID, or (first, last) cycle IDs inclusive, to download
+            steps (optional): step index counting every step of the test, or (first, last) inclusive,
+                to download, combined with cycles this selects steps within those cycles
+            since (optional): download points at or after this time, naive datetimes are in the
+                local time of the cycler, aware datetimes are converted to local time
+            until (optional): download points at or before this time
+            verify: check the seqids are continuous as chunks arrive, and download missing points
+                again, raises ValueError if they are still missing
+            parallelism: number of connections to download with at once, the points are split into
+                this many contiguous spans downloaded at once, and their chunks are yielded in order
+
+        Yields:
+            Dictionary of lists, or DataColumns, of data for each chunk from latest test
+
+        """
+        ranges, trim = self._position_ranges(pipeline_id, start, cycles=cycles, steps=steps, since=since, until=until)
+        if parallelism > 1:
+            yield from self._iter_parallel(
+                pipeline_id,
+                ranges,
+                parallelism,
+                chunk_size=chunk_size,
+                columnar=columnar,
+                window=window,
+                trim=trim,
+                verify=verify,
+            )
+            return
+        download_range = self._iter_verified if verify else self._iter_download_range
+        for after, end in ranges:
+            yield from download_range(
+                pipeline_id, after, end, chunk_size=chunk_size, columnar=columnar, window=window, trim=trim
+            )
+
+    def _position_ranges(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        start: int,
+        *,
+        cycles: Bounds | None,
+        steps: Bounds | None,
+        since: datetime | None,
+        until: datetime | None,
+    ) -> tuple[list[tuple[int, int]], bool]:
+        """Get the ranges of positions to download, see iter_download.
+
+        Returns:
+            list of (start, end) to download the points after start up to and including end,
+            and whether the last request must stop at end, instead of also getting newer points
+
+        """
+        if any(x is not None for x in (cycles, steps, since, until)) and start:
+            msg = "start cannot be combined with cycles, steps, since or until."
+            raise ValueError(msg)
+        if since is not None or until is not None:
+            if cycles is not None or steps is not None:
+                msg = "since and until cannot be combined with cycles or steps."
+                raise ValueError(msg)
+            first, last = self._time_range(pipeline_id, since, until)
+            return ([(first - 1, last)] if first <= last else []), until is not None
+        if cycles is not None or steps is not None:
+            ranges = seqid_ranges(self.get_steps(pipeline_id), cycles=cycles, steps=steps)
+            return [(first - 1, last) for first, last in ranges], True
+        n_total = self.inquiredf(pipeline_id)[pipeline_id]["count"]
+        start = max(0, n_total + start) if start < 0 else min(start, n_total)
+        return [(start, n_total)], False
+
+    def _iter_parallel(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        ranges: list[tuple[int, int]],
+        parallelism: int,
+        *,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        columnar: bool = False,
+        window: int = 1,
+        trim: bool = False,
+        verify: bool = False,
+    ) -> Iterator[dict[str, list]] | Iterator[DataColumns]:
+        """Download position ranges split into contiguous spans at the same time, one per connection.
+
+        Opens a pool of connections sharing this object's channel map. Each span is downloaded on its
+        own connection, and the chunks are yielded in order. Spans after the one being yielded only
+        download a few chunks ahead, so memory stays bounded however large the ranges are.
+        """
+        from .pool import ConnectionPool  # noqa: PLC0415
+
+        spans = split_ranges(ranges, parallelism)
+        if not spans:
+            return
+        queues: list[queue.Queue] = [queue.Queue(maxsize=_SPAN_QUEUE_SIZE) for _ in spans]
+        stop = threading.Event()
+
+        def download_span(i: int) -> None:
+            try:
+                with pool.connection() as nw:
+                    download_range = nw._iter_verified if verify else nw._iter_download_range  # noqa: SLF001
+                    for j, (after, end) in enumerate(spans[i]):
+                        # Only the end of the last span may get points recorded after it
+                        last = i == len(spans) - 1 and j == len(spans[i]) - 1
+                        chunks = download_range(
+                            pipeline_id,
+                            after,
+                            end,
+                            chunk_size=chunk_size,
+                            columnar=columnar,
+                            window=window,
+                            trim=trim or not last,
+                        )
+                        with contextlib.closing(chunks):
+                            if not all(_put_unless_stopped(queues[i], chunk, stop) for chunk in chunks):
+                                return
+                _put_unless_stopped(queues[i], _SPAN_END, stop)
+            except BaseException as e:  # noqa: BLE001
+                _put_unless_stopped(queues[i], e, stop)
+
+        with (
+            ConnectionPool(
+                self.ip,
+                self.port,
+                size=len(spans),
+                channel_map=self.channel_map,
+                server_limit=not self._holds_server_slot,
+                recv_size=self.recv_size,
+                incremental_parse=self.incremental_parse,
+            ) as pool,
+            ThreadPoolExecutor(max_workers=len(spans)) as executor,
+        ):
+            for i in range(len(spans)):
+                executor.submit(download_span, i)
+            try:
+                for span_queue in queues:
+                    while (item := span_queue.get()) is not _SPAN_END:
+                        if isinstance(item, BaseException):
+                            raise item
+                        yield item
+            finally:
+                # If the caller stops early or a span failed, the other spans stop at their next chunk
+                stop.set()
+
+    def _iter_download_range(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        start: int,
+        end: int,
+        *,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        columnar: bool = False,
+        window: int = 1,
+        trim: bool = False,
+    ) -> Iterator[dict[str, list]] | Iterator[DataColumns]:
+        """Download the data points after position start, up to and including position end.
+
+        Up to 'window' download commands are kept in flight on the socket. The next command is sent
+        before a reply is parsed, so parsing overlaps with the server and network handling the next
+        chunk. Replies always arrive in the order the commands were sent. With incremental_parse, each
+        reply is also parsed while it is received, except for columnar chunks which are parsed
+        straight into typed columns.
+
+        If a reply has fewer points than requested, e.g. points still being written, the replies in
+        flight are discarded and the download continues from the first missing point, so there are
+        no holes in the data. Raises ValueError if points are still missing after a few attempts.
+
+        If trim is False, the last command requests a full chunk, which also gets points recorded
+        after end. If trim is True, no points after end are requested.
+        """
+        address = self._address_of(pipeline_id, ip=False)
+        sizer = self._chunk_sizer(chunk_size)
+        in_flight: deque[tuple[int, int, float]] = deque()
+        # A reply queued behind others only starts arriving once the previous reply is complete
+        replied_at = float("-inf")
+        next_pos = start + 1
+
+        def send_next() -> None:
+            nonlocal next_pos
+            count = sizer.size if sizer is not None else chunk_size
+            count = min(count, end - next_pos + 1) if trim else count
+            self._send(_build_download(address, next_pos, count))
+            in_flight.append((next_pos, min(count, end - next_pos + 1), time.perf_counter()))
+            next_pos += count
+
+        def fill_window() -> None:
+            while next_pos <= end and len(in_flight) < max(window, 1):
+                send_next()
+
+        retries = 0
+        try:
+            fill_window()
+            while in_flight:
+                pos, n_points, sent_at = in_flight.popleft()
+                reply, n_bytes = self._read_download_reply(columnar)
+                if sizer is not None:
+                    now = time.perf_counter()
+                    sizer.update(n_points, n_bytes, now - max(sent_at, replied_at))
+                    replied_at = now
+                if next_pos <= end:
+                    send_next()
+                chunk = _parse_download(reply, columnar=columnar)
+                n_received = _chunk_length(chunk)
+                if n_received < n_points:  # Continue from the first missing point
+                    retries = _count_retries(retries, n_received, f"Data points {pos} to {end} of {pipeline_id}")
+                    self._discard_replies(len(in_flight))
+                    in_flight.clear()
+                    next_pos = pos + n_received
+                    fill_window()
+                if chunk is not None:
+                    yield chunk
+        finally:
+            # If the caller stops early, read the replies still in flight so the socket stays in sync
+            self._discard_replies(len(in_flight))
+
+    def _discard_replies(self, n_replies: int) -> None:
+        """Read and drop replies to commands already sent, so the socket stays in sync."""
+        for _ in range(n_replies):
+            self._read_reply()
+
+    def _read_download_reply(self, columnar: bool) -> tuple[bytearray | list[dict], int]:
+        """Read one download reply, parsed while it is received with incremental_parse.
 
         Returns:
-            Dictionary of lists of data from latest test
+            the reply, or its records, and the size of the reply in bytes
 
         """
-        res = self.inquiredf(pipeline_id)
-
-        n_total = res[pipeline_id]["count"]
-        start = min(n_total, n_total - last_n_points if last_n_points else 0)
-        n_remaining = n_total - start
-        chunk_size = 1000
-        data: list[dict] = []
-        pip = self.get_pipeline(pipeline_id)
-        while n_remaining > 0:
-            cmd_string = (
-                "<cmd>download</cmd>"
-                f'<download devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" '
-                f'auxid="0" testid="0" startpos="{start + len(data) + 1}" count="{chunk_size}"/>'
+        if self.incremental_parse and not columnar:
+            return self._read_records("download")
+        reply = self._read_reply()
+        return reply, len(reply)
+
+    def _time_range(self, pipeline_id: str, since: datetime | None, until: datetime | None) -> tuple[int, int]:
+        """Get the first and last position of the points between two times, first > last if there are none."""
+        n_total = self.inquiredf(pipeline_id)[pipeline_id]["count"]
+        anchors = [
+            (pos, anchor_time) for pos, anchor_time in time_anchors(self.get_steps(pipeline_id)) if pos <= n_total
+        ]
+        first = self._find_time(pipeline_id, anchors, n_total, to_cycler_time(since)) if since else 1
+        last = (
+            self._find_time(pipeline_id, anchors, n_total, to_cycler_time(until), after=True) - 1 if until else n_total
+        )
+        return first, last
+
+    def _find_time(
+        self,
+        pipeline_id: str,
+        anchors: list[tuple[int, datetime]],
+        n_total: int,
+        value: datetime,
+        after: bool = False,
+    ) -> int:
+        """Find the first position with a time at or after value, or strictly after if after is True.
+
+        The known times of the anchors give the range to search, then single points are probed,
+        alternating between guessing the position from the times and halving the range, until the
+        range is small enough to download in one probe. Returns n_total + 1 if there is no such point.
+        """
+        find = bisect.bisect_right if after else bisect.bisect_left
+        i = find([anchor_time for _pos, anchor_time in anchors], value)
+        lo: tuple[int, datetime | None] = anchors[i - 1] if i > 0 else (0, None)
+        hi: tuple[int, datetime | None] = anchors[i] if i < len(anchors) else (n_total + 1, None)
+        guess = True
+        while hi[0] - lo[0] > _PROBE_CHUNK + 1:
+            pos = interpolate(lo, hi, value) if guess else (lo[0] + hi[0]) // 2
+            guess = not guess
+            probe = self._probe_times(pipeline_id, pos, pos)
+            probe_time = probe[0][1] if probe else None
+            if probe_time is not None and (probe_time > value if after else probe_time >= value):
+                hi = (pos, probe_time)
+            else:
+                lo = (pos, probe_time)
+        for pos, probe_time in self._probe_times(pipeline_id, lo[0] + 1, hi[0] - 1):
+            if probe_time is not None and (probe_time > value if after else probe_time >= value):
+                return pos
+        return max(hi[0], 1)
+
+    def _probe_times(self, pipeline_id: str, first: int, last: int) -> list[tuple[int, datetime | None]]:
+        """Download the points from first to last position, get their seqid and time."""
+        if first > last:
+            return []
+        chunks = self._iter_download_range(pipeline_id, first - 1, last, chunk_size=last - first + 1, trim=True)
+        return [
+            (seqid, parse_time(atime))
+            for chunk in chunks
+            for seqid, atime in zip(chunk["seqid"], chunk["atime"], strict=True)
+        ]
+
+    def _iter_verified(  # noqa: PLR0913
+        self,
+        pipeline_id: str,
+        start: int,
+        end: int,
+        *,
+        chunk_size: int | AdaptiveChunkSize | str = 1000,
+        columnar: bool = False,
+        window: int = 1,
+        trim: bool = False,
+    ) -> Iterator[dict[str, list]] | Iterator[DataColumns]:
+        """Download the data points after position start up to end, checking no points are missing.
+
+        Each chunk must continue from the seqid of the last point received. If points are missing,
+        the replies still in flight are dropped and the download restarts after the last point
+        received, so only the missing points and the chunks in flight are downloaded again.
+        Assumes seqid is the position of the data point in the test.
+        """
+        position = start
+        retries = 0
+        while position < end:
+            before = position
+            chunks = self._iter_download_range(
+                pipeline_id, position, end, chunk_size=chunk_size, columnar=columnar, window=window, trim=trim
+            )
+            with contextlib.closing(chunks):
+                for chunk in chunks:
+                    seqids = chunk["seqid"]
+                    first = bisect.bisect_right(seqids, position)  # Skip points already received
+                    n_new = 0
+                    while first + n_new < len(seqids) and seqids[first + n_new] == position + n_new + 1:
+                        n_new += 1
+                    if n_new:
+                        yield chunk if n_new == len(seqids) else _slice_chunk(chunk, first, first + n_new)
+                        position += n_new
+                    if first + n_new < len(seqids):
+                        break
+            retries = _count_retries(
+                retries, position - before, f"Data points {position + 1} to {end} of {pipeline_id}"
             )
-            xml_string = self.command(cmd_string)
-            data += _xml_to_records(xml_string)
-            n_remaining -= chunk_size
-        # Orient as dict of lists
-        return _lod_to_dol(data)
+
+    def _chunk_sizer(self, chunk_size: int | AdaptiveChunkSize | str) -> AdaptiveChunkSize | None:
+        """Get the adaptive chunk size to use, or None for a fixed chunk size."""
+        if isinstance(chunk_size, AdaptiveChunkSize):
+            return chunk_size
+        if chunk_size == "auto":
+            return AdaptiveChunkSize(server=self.ip)
+        if isinstance(chunk_size, int) and chunk_size > 0:
+            return None
+        msg = "chunk_size must be a positive integer, 'auto', or an AdaptiveChunkSize."
+        raise ValueError(msg)
 
     def getdevinfo(self) -> dict[str, dict]:
         """Get device information.
@@ -409,13 +1253,7 @@ class NewareAPI:
             IP, device type, device id, sub-device id and channel id of all channels
 
         """
-        command = "<cmd>getdevinfo</cmd>"
-        xml_string = self.command(command)
-        devices = _xml_to_records(xml_string, "middle")
-        if not devices:
-            msg = "No devices found. Check that devices are working in BTS Client."
-            raise ValueError(msg)
-        return {f"{d['devid']}-{d['subdevid']}-{d['Channelid']}": d for d in devices}
+        return _parse_devinfo(self.command("<cmd>getdevinfo</cmd>"))
 
     def light(self, pipeline_ids: str | list[str], light_on: bool = True) -> list[dict]:
         """Set light on channel.
@@ -428,20 +1266,9 @@ class NewareAPI:
             a dictionary per channel, key 'light' has value 'ok' if function worked
 
         """
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
+        pipelines = self._select_pipelines(pipeline_ids)
         light_str = "true" if light_on else "false"
-        header = f'<cmd>light</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<light ip="{pip["ip"]}" devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}">{light_str}</light>'
-            )
-        footer = "</list>"
-        xml_string = self.command(header + middle + footer)
+        xml_string = self.command(self._channel_command("light", "light", pipelines, body=light_str))
         return _xml_to_records(xml_string)
 
     def clearflag(self, pipeline_ids: str | list[str]) -> list[dict]:
@@ -454,55 +1281,81 @@ class NewareAPI:
             a dictionary per channel, key 'clearflag' has value 'ok' if function worked
 
         """
-        if isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-        header = f'<cmd>clearflag</cmd><list count = "{len(pipelines)}">'
-        middle = ""
-        for pip in pipelines.values():
-            middle += (
-                f'<clearflag ip="{pip["ip"]}" devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}">true</clearflag>'
-            )
-        footer = "</list>"
-        xml_string = self.command(header + middle + footer)
+        pipelines = self._select_pipelines(pipeline_ids)
+        xml_string = self.command(self._channel_command("clearflag", "clearflag", pipelines))
         return _xml_to_records(xml_string)
 
     def get_steps(self, pipeline_id: str) -> list[dict]:
         """Get the step layer of data, such as step index and type, start and end time etc."""
-        pip = self.get_pipeline(pipeline_id)
-        command = (
-            f"<cmd>downloadStepLayer</cmd>"
-            f'<downloadStepLayer devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-            f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" />'
-        )
-        xml_string = self.command(command)
-        return _xml_to_records(xml_string)
+        xml_string = self.command(_build_download_step_layer(self._address_of(pipeline_id, ip=False)))
+        return _xml_to_records(xml_string, command="downloadStepLayer")
+
+    def export(
+        self,
+        pipeline_id: str,
+        path: str | Path,
+        kind: str = "data",
+        *,
+        last_n_points: int = 0,
+        compression: str = "zstd",
+    ) -> int:
+        """Write the data, step layer or log of the latest test to a Parquet or Feather file.
+
+        Data is written chunk by chunk, with the full test ID in the file metadata. Needs pyarrow.
+
+        Args:
+            pipeline_id: ID of the pipeline in format {devid}-{subdevid}-{chlid} e.g. 220-10-2
+            path: path of the file ending in .parquet, .feather or .arrow
+            kind: 'data' for the data points, 'steps' for the step layer, or 'log' for the log
+            last_n_points: for data, how many datapoints to export, 0 for all data
+            compression: compression codec e.g. 'zstd', 'lz4' or 'none'
+
+        Returns:
+            number of rows written
+
+        """
+        return export_test(self, pipeline_id, path, kind, last_n_points=last_n_points, compression=compression)
 
     def get_testid(self, pipeline_ids: str | list[str] | None = None) -> dict[str, dict]:
-        """Get the test ID of pipelines."""
-        if pipeline_ids is None:
-            pipelines = self.channel_map
-        elif isinstance(pipeline_ids, str):
-            pipelines = {pipeline_ids: self.get_pipeline(pipeline_ids)}
-        elif isinstance(pipeline_ids, list):
-            pipelines = {p: self.get_pipeline(p) for p in pipeline_ids}
-        else:
-            msg = "Pipeline_ids must be None, a string, or list of strings."
-            raise ValueError(msg)
-        # Download 0 data points to find test ID
-        for pip in pipelines.values():
-            command = (
-                "<cmd>download</cmd>"
-                f'<download devtype="{pip["devtype"]}" devid="{pip["devid"]}" '
-                f'subdevid="{pip["subdevid"]}" chlid="{pip["Channelid"]}" '
-                f'auxid="0" testid="0" startpos="0" count="0"/>'
-            )
-            resp = self.command(command)
-            match = re.search(r'(?<=testid=")\d+(?=")', resp)
-            assert match, "Could not find a 'testid' in response."  # noqa: S101
-            # Add test number to the channel map info
-            pip["test_id"] = int(match.group())
-            pip["full_test_id"] = f"{pip['devid']}-{pip['subdevid']}-{pip['Channelid']}-{int(match.group())}"
-        return pipelines
+        """Get the test ID of pipelines.
+
+        The test IDs of all pipelines are read from one inquiredf command. For pipelines where it does
+        not give a test ID, 0 data points are downloaded instead, with the commands pipelined on the
+        socket.
+        """
+        pipelines = self._select_pipelines(pipeline_ids, default_all=True)
+        test_ids = self._fill_test_ids({p: res.get("testid") for p, res in self.inquiredf(pipeline_ids).items()})
+        return {
+            pipeline_id: {
+                **channel,
+                "test_id": test_ids[pipeline_id],
+                "full_test_id": f"{pipeline_id}-{test_ids[pipeline_id]}",
+            }
+            for pipeline_id, channel in pipelines.items()
+        }
+
+    def _fill_test_ids(self, test_ids: dict[str, Any]) -> dict[str, int]:
+        """Fill in test IDs from inquiredf which are missing or 0, by downloading 0 data points."""
+        missing = [
+            pipeline_id for pipeline_id, test_id in test_ids.items() if not isinstance(test_id, int) or not test_id
+        ]
+        if missing:
+            replies = self._pipelined_commands([_build_download(self._address_of(p, ip=False), 0, 0) for p in missing])
+            test_ids.update(zip(missing, (_parse_testid(reply) for reply in replies), strict=True))
+        return test_ids
+
+    def _pipelined_commands(self, cmds: list[str], window: int = 64) -> Iterator[str]:
+        """Send commands keeping up to 'window' in flight on the socket, yield the replies in order."""
+        n_sent = n_received = 0
+        try:
+            while n_received < len(cmds):
+                while n_sent < len(cmds) and n_sent - n_received < window:
+                    self._send(cmds[n_sent])
+                    n_sent += 1
+                reply = self._read_reply().decode()
+                n_received += 1
+                yield reply
+        finally:
+            # If the caller stops early, read the replies still in flight so the socket stays in sync
+            for _ in range(n_sent - n_received):
+                self._read_reply()
@@ -0,0 +1,372 @@
+"""Parsing of XML replies from the BTS server.
+
+Most replies are a flat list of elements with attributes, e.g. one <data .../> per data point. These
+are scanned with regular expressions in one pass. Values are converted with converters compiled once
+from the schema of each command, see schema.py. Anything else, including any reply with a DOCTYPE,
+entity, comment, CDATA section or character reference, falls back to the generic defusedxml parser,
+so the fast path never has to deal with the XML features that make parsing unsafe.
+
+RecordStream parses a reply the same way while it is still being received, so parsing overlaps with
+the network on large replies.
+"""
+
+import codecs
+import functools
+import re
+from collections.abc import Callable
+
+from defusedxml import ElementTree
+
+from .schema import REPLY_SCHEMAS
+
+
+def _auto_convert_type(value: str) -> int | float | str | None:
+    """Try to automatically convert a string to float or int."""
+    if value == "--":
+        return None
+    try:
+        if "." in value:
+            return float(value)
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _int(value: str) -> int | float | str | None:
+    """Convert a string to int, falling back to guessing the type."""
+    try:
+        return int(value)
+    except ValueError:
+        return _auto_convert_type(value)
+
+
+def _float(value: str) -> int | float | str | None:
+    """Convert a string to float, falling back to guessing the type."""
+    try:
+        return float(value)
+    except ValueError:
+        return _auto_convert_type(value)
+
+
+def _str(value: str) -> str | None:
+    """Keep a string, missing values become None."""
+    return None if value == "--" else value
+
+
+# Converters compiled from the declared schemas, keyed by command then field
+_TYPE_CONVERTERS: dict[type, Callable[[str], object]] = {int: _int, float: _float, str: _str}
+CONVERTERS: dict[str, dict[str, Callable[[str], object]]] = {
+    command: {field: _TYPE_CONVERTERS[field_type] for field, field_type in schema.items()}
+    for command, schema in REPLY_SCHEMAS.items()
+}
+# Builtins which convert a whole column at once, if no value needs the fallback
+_BULK_CONVERTERS: dict[Callable[[str], object], type] = {_int: int, _float: float}
+
+# One element of a flat list: <tag attr="value" ... /> or <tag attr="value" ...>text</tag>
+_ELEMENT = re.compile(r'\s*<(\w+)((?:\s+\w+="[^"<&\t\n\r]*")*)\s*(?:/>|>([^<&]*)</\1\s*>)')
+_ATTRIBUTE = re.compile(r'(\w+)="[^"]*"')
+_ATTRIBUTE_VALUE = re.compile(r'(\w+)="([^"]*)"')
+# Anything the fast path does not handle: DOCTYPE, entities, comments, CDATA, character references
+_UNSAFE = ("<!", "&")
+
+
+@functools.lru_cache(maxsize=64)
+def _list_pattern(list_name: str) -> re.Pattern:
+    """Compile the pattern of the start tag of a list."""
+    return re.compile(rf'<{list_name}(?:\s+\w+="[^"]*")*\s*(/?)>')
+
+
+@functools.lru_cache(maxsize=256)
+def _row_pattern(tag: str, fields: tuple[str, ...]) -> re.Pattern:
+    """Compile the pattern of an element with exactly these attributes in this order."""
+    attributes = "".join(rf'\s+{field}="([^"<&\t\n\r]*)"' for field in fields)
+    return re.compile(rf"<{tag}{attributes}\s*(?:/>|>([^<&]*)</{tag}\s*>)")
+
+
+def _list_body(xml_string: str, list_name: str) -> str | None:
+    """Get the text between the start and end tag of the list, or None if the fast path cannot be used."""
+    if any(marker in xml_string for marker in _UNSAFE):
+        return None
+    start = _list_pattern(list_name).search(xml_string)
+    if start is None:
+        return None
+    if start.group(1):  # Self-closing, empty list
+        return ""
+    end = xml_string.find(f"</{list_name}", start.end())
+    if end == -1:
+        return None
+    return xml_string[start.end() : end]
+
+
+def scan_table(xml_string: str, list_name: str = "list") -> tuple[str, list[str], list[tuple[str, ...]]] | None:
+    """Scan a flat list of elements which all have the same tag and attributes into columns.
+
+    The first element gives the shape of a row, then all rows are matched with one regular expression
+    compiled for that shape. The body of the list must be fully covered by rows of that shape.
+
+    Args:
+        xml_string: raw xml string
+        list_name: the tag that contains the list of elements to scan
+
+    Returns:
+        the tag, the field names, and one tuple of raw string values per field, if the element text
+        is not empty it is the last field named after the tag. None if the reply is not a plain
+        homogeneous list.
+
+    """
+    body = _list_body(xml_string, list_name)
+    if body is None:
+        return None
+    first = _ELEMENT.match(body)
+    if first is None:
+        return ("", [], []) if not body.strip() else None
+    tag = first.group(1)
+    fields = tuple(_ATTRIBUTE.findall(first.group(2)))
+    rows = _row_pattern(tag, fields).findall(body)
+    # Every tag in the body must belong to a matched row
+    if len(rows) != body.count(f"<{tag}") or body.count("<") != len(rows) + body.count(f"</{tag}"):
+        return None
+    # With only the text group, findall gives strings instead of tuples
+    columns = list(zip(*rows, strict=True)) if fields else [tuple(rows)]
+    texts = columns.pop()
+    if any(texts):
+        if not all(texts):  # Some elements have text and some do not
+            return None
+        return tag, [*fields, tag], [*columns, tuple(texts)]
+    return tag, list(fields), columns
+
+
+def scan_elements(xml_string: str, list_name: str = "list") -> list[tuple[str, dict[str, str], str]] | None:
+    """Scan a flat list of elements which may have different tags and attributes, one at a time.
+
+    Args:
+        xml_string: raw xml string
+        list_name: the tag that contains the list of elements to scan
+
+    Returns:
+        list of (tag, attributes, text) per element, or None if the reply is not a plain flat list
+
+    """
+    body = _list_body(xml_string, list_name)
+    if body is None:
+        return None
+    elements = []
+    pos = 0
+    while m := _ELEMENT.match(body, pos):
+        elements.append((m.group(1), dict(_ATTRIBUTE_VALUE.findall(m.group(2))), m.group(3) or ""))
+        pos = m.end()
+    if body[pos:].strip():
+        return None
+    return elements
+
+
+def _convert_column(values: tuple[str, ...], conv: Callable[[str], object]) -> list:
+    """Convert a column of strings, with a builtin over the whole column where possible."""
+    builtin = _BULK_CONVERTERS.get(conv)
+    if builtin is not None:
+        try:
+            return list(map(builtin, values))
+        except ValueError:
+            pass
+    elif conv is _str and "--" not in values:
+        return list(values)
+    return list(map(conv, values))
+
+
+def fast_records(xml_string: str, list_name: str = "list", command: str | None = None) -> list[dict] | None:
+    """Convert the elements of a flat list to a list of dictionaries, see _xml_to_records.
+
+    Returns:
+        list of dictionaries, or None if the reply must be parsed with the generic parser
+
+    """
+    converters = CONVERTERS.get(command, {})
+    table = scan_table(xml_string, list_name)
+    if table is not None:
+        _tag, fields, columns = table
+        converted = [
+            _convert_column(values, converters.get(field, _auto_convert_type))
+            for field, values in zip(fields, columns, strict=True)
+        ]
+        return [dict(zip(fields, row, strict=True)) for row in zip(*converted, strict=True)]
+
+    elements = scan_elements(xml_string, list_name)
+    if elements is None:
+        return None
+    records = []
+    for tag, attrib, text in elements:
+        if text:
+            attrib[tag] = text
+        records.append({field: converters.get(field, _auto_convert_type)(v) for field, v in attrib.items()})
+    return records
+
+
+def generic_records(xml_string: str, list_name: str = "list", command: str | None = None) -> list[dict]:
+    """Extract elements inside <list> tags with defusedxml, convert to a list of dictionaries."""
+    converters = CONVERTERS.get(command, {})
+    # Parse response XML string
+    root = ElementTree.fromstring(xml_string)
+    # Find <list> element
+    list_element = root.find(list_name)
+    # Extract <name> elements to a list of dictionaries
+    result = []
+    for el in list_element:
+        el_dict = el.attrib
+        if el.text:
+            el_dict[el.tag] = el.text
+        result.append(el_dict)
+    return [{k: converters.get(k, _auto_convert_type)(v) for k, v in el.items()} for el in result]
+
+
+class _ListTarget:
+    """Parser target which collects the elements directly inside the list as raw records."""
+
+    def __init__(self, list_name: str) -> None:
+        self.list_name = list_name
+        self.records: list[dict[str, str]] = []
+        self._depth = 0
+        self._in_list = False
+        self._found = False
+        self._record: dict[str, str] | None = None
+        self._tag = ""
+        self._text: list[str] = []
+        self._collect = False
+
+    def start(self, tag: str, attrib: dict[str, str]) -> None:
+        """Start an element, the root is at depth 1 and the elements of the list at depth 3."""
+        self._depth += 1
+        if self._in_list and self._depth == 3:
+            self._record, self._tag, self._text, self._collect = dict(attrib), tag, [], True
+        elif self._depth == 2 and tag == self.list_name and not self._found:
+            self._in_list = self._found = True
+        else:  # Text after a child element is not the text of the element, like ElementTree
+            self._collect = False
+
+    def data(self, data: str) -> None:
+        """Collect the text of an element of the list."""
+        if self._collect:
+            self._text.append(data)
+
+    def end(self, _tag: str) -> None:
+        """End an element, finishing a record at depth 3."""
+        if self._depth == 3 and self._record is not None:
+            text = "".join(self._text)
+            if text:
+                self._record[self._tag] = text
+            self.records.append(self._record)
+            self._record, self._collect = None, False
+        elif self._depth == 2 and self._in_list:
+            self._in_list = False
+        self._depth -= 1
+
+    def close(self) -> None:
+        """Finish the document."""
+
+
+class RecordStream:
+    """Parse the elements inside <list> tags incrementally, from parts of a reply as they are received.
+
+    The elements received so far are scanned with the fast parser, up to the last complete element.
+    If the reply is not a plain flat list, everything received is parsed again with defusedxml,
+    skipping the records already returned, and so is the rest of the reply. The records are the same
+    as from _xml_to_records, and DOCTYPEs and entities are refused the same way.
+    """
+
+    def __init__(self, list_name: str = "list", command: str | None = None) -> None:
+        """Initialize the parser.
+
+        Args:
+            list_name: the tag that contains the list of elements to parse
+            command (optional): the command of the reply, to convert values with its schema
+
+        """
+        self.list_name = list_name
+        self.command = command
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._received: list[bytes] = []
+        self._text = ""  # Received text which has not been scanned yet
+        self._started = False
+        self._ended = False
+        self._n_records = 0
+        # Used after falling back to defusedxml
+        self._target: _ListTarget | None = None
+        self._parser: ElementTree.XMLParser | None = None
+        self._skip = 0
+
+    def feed(self, data: bytes) -> list[dict]:
+        """Parse the next part of the reply, returning the records it completed."""
+        if self._parser is not None:
+            self._parser.feed(data)
+            return self._take()
+        self._received.append(data)
+        self._text += self._decoder.decode(data)
+        records = self._scan()
+        if records is None:
+            return self._fall_back()
+        self._n_records += len(records)
+        return records
+
+    def close(self) -> list[dict]:
+        """Finish parsing at the end of the reply, returning the last records."""
+        if self._parser is None:
+            self._text += self._decoder.decode(b"", final=True)
+            records = self._scan()
+            if records is not None and self._ended:
+                return records
+            records = self._fall_back()
+        else:
+            records = []
+        self._parser.close()
+        return records + self._take()
+
+    def _scan(self) -> list[dict] | None:
+        """Scan the complete elements received so far, None if the reply must be parsed with defusedxml."""
+        text = self._text
+        # The unscanned text is kept, so markers split across parts are found
+        if any(marker in text for marker in _UNSAFE):
+            return None
+        if self._ended:
+            self._text = text[-1:]
+            return []
+        if not self._started:
+            start = _list_pattern(self.list_name).search(text)
+            if start is None:  # Wait for the rest of the start tag
+                return []
+            self._started = True
+            text = text[start.end() :]
+            if start.group(1):  # Self-closing, empty list
+                self._ended = True
+                self._text = text
+                return []
+        end = text.find(f"</{self.list_name}")
+        if end != -1:
+            self._ended = True
+            cut = end
+        else:  # Up to the end of the last complete element
+            cut = idx + 2 if (idx := text.rfind("/>")) != -1 else 0
+            close = text.rfind("</")
+            if close != -1 and (close_end := text.find(">", close)) != -1:
+                cut = max(cut, close_end + 1)
+        body, self._text = text[:cut], text[cut:]
+        if not body.strip():
+            return []
+        return fast_records(f"<{self.list_name}>{body}</{self.list_name}>", self.list_name, self.command)
+
+    def _fall_back(self) -> list[dict]:
+        """Parse everything received so far with defusedxml, returning the records not returned yet."""
+        self._target = _ListTarget(self.list_name)
+        self._parser = ElementTree.XMLParser(target=self._target)
+        self._skip = self._n_records
+        received, self._received = b"".join(self._received), []
+        self._parser.feed(received)
+        return self._take()
+
+    def _take(self) -> list[dict]:
+        """Take the records completed by defusedxml so far, converting their values."""
+        records, self._target.records = self._target.records, []
+        if self._skip:
+            n_skip = min(self._skip, len(records))
+            records = records[n_skip:]
+            self._skip -= n_skip
+        converters = CONVERTERS.get(self.command, {})
+        return [{k: converters.get(k, _auto_convert_type)(v) for k, v in record.items()} for record in records]
@@ -0,0 +1,178 @@
+"""Pool of connections to one BTS server, for downloading from many channels in parallel."""
+
+import contextlib
+import queue
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from types import TracebackType
+from typing import Any, ClassVar
+
+from .cache import DownloadCache
+from .neware import NewareAPI
+
+
+class ConnectionPool:
+    """Pool of authenticated connections to the same BTS server.
+
+    Each connection does its own 'connect' handshake, but all connections share one channel map, so
+    getdevinfo is called at most once. The number of commands running at once on a server is capped
+    across all pools in the process, so the BTS service is not overwhelmed.
+    """
+
+    # Limit on concurrent connections in use per (ip, port), shared by all pools
+    _server_limits: ClassVar[dict[tuple[str, int], threading.BoundedSemaphore]] = {}
+    _server_limits_lock = threading.Lock()
+
+    def __init__(  # noqa: PLR0913
+        self,
+        ip: str = "127.0.0.1",
+        port: int = 502,
+        size: int = 4,
+        channel_map: dict[str, dict] | None = None,
+        max_per_server: int = 8,
+        *,
+        server_limit: bool = True,
+        recv_size: int = 65536,
+        download_cache: DownloadCache | None = None,
+        incremental_parse: bool = False,
+    ) -> None:
+        """Initialize the pool, connections are opened with open() or when entering the context.
+
+        Args:
+            ip: IP address of the BTS server
+            port: port of the BTS server
+            size: number of connections in the pool
+            channel_map (optional): channel map to share, fetched with getdevinfo() if not given
+            max_per_server: maximum number of connections in use at once on this server across all
+                pools, only the first pool created for a server sets the limit
+            server_limit: count the connections in use against the per-server limit, False for
+                connections opened on behalf of a connection which already holds a slot
+            recv_size: passed to each NewareAPI connection
+            download_cache (optional): passed to each NewareAPI connection, can be shared
+            incremental_parse: passed to each NewareAPI connection
+
+        """
+        self.ip = ip
+        self.port = port
+        self.size = size
+        self.channel_map = channel_map
+        self.server_limit = server_limit
+        self.recv_size = recv_size
+        self.download_cache = download_cache
+        self.incremental_parse = incremental_parse
+        self._connections: list[NewareAPI] = []
+        self._idle: queue.Queue[NewareAPI] = queue.Queue()
+        with self._server_limits_lock:
+            self._limit = self._server_limits.setdefault((ip, port), threading.BoundedSemaphore(max_per_server))
+
+    def open(self) -> None:
+        """Open and authenticate all connections.
+
+        If there is no channel map yet, the first connection fetches it, then the other connections
+        do their handshakes at the same time. If any handshake fails, all connections are closed.
+        """
+        n_new = self.size - len(self._connections)
+        try:
+            if n_new > 0 and self.channel_map is None:
+                self._add_connection()
+                n_new -= 1
+            if n_new > 0:
+                with ThreadPoolExecutor(max_workers=n_new) as executor:
+                    list(executor.map(lambda _i: self._add_connection(), range(n_new)))
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_connection(self) -> None:
+        """Open, authenticate and add one connection."""
+        nw = NewareAPI(
+            self.ip,
+            self.port,
+            recv_size=self.recv_size,
+            download_cache=self.download_cache,
+            incremental_parse=self.incremental_parse,
+        )
+        try:
+            nw.connect(channel_map=self.channel_map)
+        except BaseException:
+            nw.disconnect()
+            raise
+        self.channel_map = nw.channel_map
+        self._connections.append(nw)
+        self._idle.put(nw)
+
+    def close(self) -> None:
+        """Close all connections."""
+        for nw in self._connections:
+            nw.disconnect()
+        self._connections.clear()
+        self._idle = queue.Queue()
+
+    def __enter__(self) -> "ConnectionPool":
+        """Open the connections when entering the context."""
+        self.open()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the connections when exiting the context."""
+        self.close()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[NewareAPI]:
+        """Borrow a connection from the pool, waiting for the per-server limit.
+
+        While borrowed, the connection is marked as holding a slot, so a parallel download on it opens
+        its extra connections without waiting for more slots, which could deadlock.
+        """
+        nw = self._idle.get()
+        try:
+            with self._limit if self.server_limit else contextlib.nullcontext():
+                nw._holds_server_slot = True  # noqa: SLF001
+                yield nw
+        finally:
+            nw._holds_server_slot = False  # noqa: SLF001
+            self._idle.put(nw)
+
+    def download_many(
+        self,
+        pipeline_ids: list[str] | None = None,
+        last_n_points: int = 10000,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> tuple[dict[str, dict[str, list]], dict[str, float]]:
+        """Download data from many channels in parallel, spread over the connections.
+
+        Args:
+            pipeline_ids (optional): pipeline IDs to download, default all in the channel map
+            last_n_points: how many datapoints to download per channel, set to 0 to get all data
+            **kwargs: passed to NewareAPI.download, e.g. window or chunk_size
+
+        Returns:
+            dictionary of the downloaded data keyed by pipeline ID,
+            dictionary of the download time in seconds keyed by pipeline ID
+
+        """
+        if not self._connections:
+            self.open()
+        if pipeline_ids is None:
+            pipeline_ids = list(self.channel_map)
+        for pipeline_id in pipeline_ids:
+            self._connections[0].get_pipeline(pipeline_id)  # Fail early on unknown pipelines
+
+        def download_one(pipeline_id: str) -> tuple[dict[str, list], float]:
+            with self.connection() as nw:
+                start = time.perf_counter()
+                data = nw.download(pipeline_id, last_n_points, **kwargs)
+                return data, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=len(self._connections)) as executor:
+            results = dict(zip(pipeline_ids, executor.map(download_one, pipeline_ids), strict=True))
+        data = {pipeline_id: result[0] for pipeline_id, result in results.items()}
+        timings = {pipeline_id: result[1] for pipeline_id, result in results.items()}
+        return data, timings
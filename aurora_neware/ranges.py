@@ -0,0 +1,147 @@
+"""Turn cycle, step and time ranges into ranges of data point positions, using the step layer as an index.
+
+Each record of the step layer (NewareAPI.get_steps) has the first and last seqid of the step, the
+cycle it belongs to, its end time and duration. The seqid of a data point is its position in the
+test, starting from 1, so the data points of any cycles or steps can be downloaded without fetching
+the rest of the test. For time ranges, the step layer narrows down the positions, which are then
+found exactly by probing a few data points.
+"""
+
+import math
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+# A single value, or first and last value inclusive
+Bounds = int | Sequence[int]
+
+
+def parse_bounds(value: Bounds, name: str) -> tuple[int, int]:
+    """Get the first and last value of a range given as an int or a pair of ints."""
+    if isinstance(value, int):
+        return value, value
+    if len(value) != 2 or value[0] > value[1]:
+        msg = f"{name} must be one number or (first, last) with first <= last, got {value!r}"
+        raise ValueError(msg)
+    return int(value[0]), int(value[1])
+
+
+def seqid_ranges(
+    step_layer: list[dict],
+    *,
+    cycles: Bounds | None = None,
+    steps: Bounds | None = None,
+) -> list[tuple[int, int]]:
+    """Get the seqid ranges of the steps in some cycles and/or steps.
+
+    Args:
+        step_layer: records from NewareAPI.get_steps
+        cycles (optional): cycle ID, or first and last cycle ID inclusive
+        steps (optional): step index counting every step of the test, or first and last inclusive
+
+    Returns:
+        sorted list of first and last seqid inclusive, adjacent steps are merged into one range
+
+    """
+    first_cycle, last_cycle = parse_bounds(cycles, "cycles") if cycles is not None else (None, None)
+    first_step, last_step = parse_bounds(steps, "steps") if steps is not None else (None, None)
+    ranges: list[tuple[int, int]] = []
+    for step in sorted(step_layer, key=lambda s: s["startseqid"]):
+        if cycles is not None and not first_cycle <= step["cycleid"] <= last_cycle:
+            continue
+        if steps is not None and not first_step <= step["stepindex"] <= last_step:
+            continue
+        start, end = step["startseqid"], step["endseqid"]
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def split_ranges(ranges: list[tuple[int, int]], n: int) -> list[list[tuple[int, int]]]:
+    """Split ranges of positions into at most n contiguous spans with about the same number of points.
+
+    Args:
+        ranges: list of (start, end) for the points after start up to and including end
+        n: number of spans
+
+    Returns:
+        list of spans in order, each a list of (start, end)
+
+    """
+    size = math.ceil(sum(end - start for start, end in ranges) / max(n, 1))
+    spans: list[list[tuple[int, int]]] = []
+    span: list[tuple[int, int]] = []
+    room = size
+    for start, end in ranges:
+        while start < end:
+            take = min(room, end - start)
+            span.append((start, start + take))
+            start += take  # noqa: PLW2901
+            room -= take
+            if room == 0:
+                spans.append(span)
+                span, room = [], size
+    if span:
+        spans.append(span)
+    return spans
+
+
+def to_cycler_time(value: datetime) -> datetime:
+    """Convert a datetime to the naive local time used in BTS timestamps.
+
+    Naive datetimes are assumed to already be in the local time of the cycler.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def parse_time(value: str | None) -> datetime | None:
+    """Parse a BTS timestamp, None if it is missing."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else None
+
+
+def time_anchors(step_layer: list[dict]) -> list[tuple[int, datetime]]:
+    """Get positions with known times from the step layer, sorted by position.
+
+    The last point of each step is at its end time. Position 0, before the first point, is given
+    the start time of the first step from its end time and duration.
+
+    Args:
+        step_layer: records from NewareAPI.get_steps
+
+    Returns:
+        list of (seqid, time) with times in increasing order
+
+    """
+    anchors: list[tuple[int, datetime]] = []
+    for step in sorted(step_layer, key=lambda s: s["startseqid"]):
+        end_time = parse_time(step.get("endatime"))
+        if end_time is None:
+            continue
+        if not anchors and isinstance(step.get("steptime"), int | float):
+            anchors.append((0, end_time - timedelta(milliseconds=step["steptime"])))
+        if not anchors or end_time >= anchors[-1][1]:
+            anchors.append((step["endseqid"], end_time))
+    return anchors
+
+
+def interpolate(lo: tuple[int, datetime | None], hi: tuple[int, datetime | None], value: datetime) -> int:
+    """Guess the position of a time between two positions, assuming points are evenly spaced in time.
+
+    Args:
+        lo: position and time of a point before the time, the time may be None if unknown
+        hi: position and time of a point after the time, the time may be None if unknown
+        value: time to find
+
+    Returns:
+        position strictly between lo and hi, the midpoint if a time is unknown
+
+    """
+    (lo_pos, lo_time), (hi_pos, hi_time) = lo, hi
+    if lo_time is None or hi_time is None or hi_time <= lo_time:
+        guess = (lo_pos + hi_pos) // 2
+    else:
+        guess = lo_pos + round((hi_pos - lo_pos) * (value - lo_time) / (hi_time - lo_time))
+    return min(max(guess, lo_pos + 1), hi_pos - 1)
@@ -0,0 +1,231 @@
+"""Poll channels at intervals which depend on their state and how recently they changed.
+
+Idle channels are polled rarely, with the cheaper getchlstatus command, and working channels more
+often with inquire. After a channel changes, it is polled quickly and the interval doubles with
+every unchanged poll, until it is back to the interval of its state. All channels which are due at
+the same time are polled with one command, and the commands sent to each BTS server are limited by
+a token bucket shared by all schedulers in the process.
+"""
+
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import Any, ClassVar
+
+from .watch import ChangeDetector
+
+# Seconds between polls of a channel in a state, when it has not changed recently
+DEFAULT_INTERVALS = {"working": 5.0, "pause": 30.0, "protect": 60.0, "stop": 300.0, "finish": 300.0}
+# States polled with getchlstatus instead of inquire
+IDLE_STATES = frozenset({"finish", "stop"})
+
+# Cap on the doublings of the interval after a change, a channel at the cap is polled at its state interval
+_MAX_DOUBLINGS = 32
+
+# Called with pipeline ID, old state, new state and the inquire record
+TransitionCallback = Callable[[str, str, str, dict], None]
+
+
+class TokenBucket:
+    """Limit the rate of requests, allowing short bursts."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize a full bucket.
+
+        Args:
+            rate: requests per second in the long run
+            capacity (optional): maximum burst of requests, by default the same as rate or at least 1
+            clock: function giving the time in seconds
+            sleep: function to wait
+
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, waiting until one is available. Returns the seconds waited."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class _ChannelSchedule:
+    """Scheduling state of one channel."""
+
+    __slots__ = ("next_due", "state", "unchanged_polls")
+
+    def __init__(self) -> None:
+        self.state: str | None = None
+        self.next_due = float("-inf")
+        self.unchanged_polls = _MAX_DOUBLINGS
+
+
+def _server_key(nw: Any) -> tuple | None:  # noqa: ANN401
+    """Get the key of the shared budget for the server of a NewareAPI or DaemonClient, if known."""
+    if getattr(nw, "ip", None) is not None and getattr(nw, "port", None) is not None:
+        return ("server", nw.ip, nw.port)
+    if getattr(nw, "path", None) is not None:  # Each daemon serves one server
+        return ("daemon", str(nw.path))
+    return None
+
+
+class PollScheduler:
+    """Poll the status of channels with per-channel intervals, batched commands and a request budget."""
+
+    # Request budget per server, shared by all schedulers
+    _server_budgets: ClassVar[dict[tuple, TokenBucket]] = {}
+    _server_budgets_lock = threading.Lock()
+
+    def __init__(  # noqa: PLR0913
+        self,
+        nw: Any,  # noqa: ANN401
+        pipeline_ids: str | list[str] | None = None,
+        *,
+        intervals: dict[str, float] | None = None,
+        default_interval: float = 60.0,
+        fast_interval: float = 1.0,
+        requests_per_second: float = 2.0,
+        budget: TokenBucket | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize the scheduler, every channel is polled with inquire on the first tick.
+
+        Args:
+            nw: connected NewareAPI, or a DaemonClient
+            pipeline_ids (optional): pipeline IDs or selectors, all pipelines if not given
+            intervals (optional): seconds between polls per state, updates DEFAULT_INTERVALS
+            default_interval: seconds between polls for states not in intervals
+            fast_interval: seconds until the first poll after a channel changed
+            requests_per_second: request budget of the BTS server, only the first scheduler created
+                for a server sets it
+            budget (optional): token bucket to use instead of the one shared per server
+            clock: function giving the time in seconds, the shared budget always uses time.monotonic
+            sleep: function to wait, the shared budget always uses time.sleep
+
+        """
+        self.nw = nw
+        self.intervals = {**DEFAULT_INTERVALS, **(intervals or {})}
+        self.default_interval = default_interval
+        self.fast_interval = fast_interval
+        self.clock = clock
+        self.sleep = sleep
+        if budget is None:
+            key = _server_key(nw)
+            if key is None:  # The server is unknown, so the budget cannot be shared
+                budget = TokenBucket(requests_per_second, clock=clock, sleep=sleep)
+            else:
+                with self._server_budgets_lock:
+                    if key not in self._server_budgets:
+                        self._server_budgets[key] = TokenBucket(requests_per_second)
+                    budget = self._server_budgets[key]
+        self.budget = budget
+        self._channels = {pipeline_id: _ChannelSchedule() for pipeline_id in nw.select(pipeline_ids)}
+        self._detector = ChangeDetector()
+        self._callbacks: list[tuple[str | None, str | None, TransitionCallback]] = []
+
+    def on_transition(
+        self,
+        callback: TransitionCallback,
+        from_state: str | None = None,
+        to_state: str | None = None,
+    ) -> None:
+        """Call a function when a channel changes state, e.g. from 'working' to 'finish'.
+
+        Args:
+            callback: called with the pipeline ID, old state, new state and the inquire record
+            from_state (optional): only call for transitions from this state
+            to_state (optional): only call for transitions to this state
+
+        """
+        self._callbacks.append((from_state, to_state, callback))
+
+    def interval(self, pipeline_id: str) -> float:
+        """Get the seconds until the next poll of a channel, after it has been polled."""
+        channel = self._channels[pipeline_id]
+        interval = self.intervals.get(channel.state, self.default_interval)
+        return min(interval, self.fast_interval * 2**channel.unchanged_polls)
+
+    def next_due(self) -> float:
+        """Get the time when the next channel is due."""
+        return min((ch.next_due for ch in self._channels.values()), default=float("inf"))
+
+    def tick(self) -> list[dict]:
+        """Poll all channels which are due, with at most one getchlstatus and one inquire command.
+
+        Returns:
+            events of the channels which changed, see ChangeDetector.changes
+
+        """
+        now = self.clock()
+        due = [pipeline_id for pipeline_id, ch in self._channels.items() if ch.next_due <= now]
+        idle = [pipeline_id for pipeline_id in due if self._channels[pipeline_id].state in IDLE_STATES]
+        active = [pipeline_id for pipeline_id in due if self._channels[pipeline_id].state not in IDLE_STATES]
+        if idle:
+            self.budget.acquire()
+            status = self.nw.getchlstatus(idle)
+            for pipeline_id in idle:
+                if status[pipeline_id].get("status") == self._channels[pipeline_id].state:
+                    self._reschedule(pipeline_id, changed=False)
+                else:  # Get the full status of channels which left the idle state
+                    active.append(pipeline_id)
+        if not active:
+            return []
+        self.budget.acquire()
+        records = self.nw.inquire(active)
+        events = self._detector.changes(records)
+        changed = {event["pipeline_id"] for event in events}
+        for pipeline_id, record in records.items():
+            channel = self._channels[pipeline_id]
+            old, new = channel.state, record.get("workstatus")
+            if old is not None and old != new:
+                self._transition(pipeline_id, old, new, record)
+            channel.state = new
+            # The first poll is not a change
+            self._reschedule(pipeline_id, changed=pipeline_id in changed and old is not None)
+        return events
+
+    def run(self, ticks: int | None = None) -> Iterator[dict]:
+        """Poll channels when they are due, yield the events of channels which changed.
+
+        Args:
+            ticks (optional): stop after this many ticks, otherwise run forever
+
+        """
+        n_ticks = 0
+        while ticks is None or n_ticks < ticks:
+            self.sleep(max(0.0, self.next_due() - self.clock()))
+            yield from self.tick()
+            n_ticks += 1
+
+    def _reschedule(self, pipeline_id: str, changed: bool) -> None:
+        """Set the next poll of a channel after it was polled."""
+        channel = self._channels[pipeline_id]
+        if changed:
+            channel.unchanged_polls = 0
+        elif channel.unchanged_polls < _MAX_DOUBLINGS:
+            channel.unchanged_polls += 1
+        channel.next_due = self.clock() + self.interval(pipeline_id)
+
+    def _transition(self, pipeline_id: str, old: str, new: str, record: dict) -> None:
+        """Call the callbacks for a change of state."""
+        for from_state, to_state, callback in self._callbacks:
+            if from_state in (None, old) and to_state in (None, new):
+                callback(pipeline_id, old, new, record)
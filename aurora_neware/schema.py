@@ -0,0 +1,83 @@
+"""Field types of the replies from the BTS server, per command.
+
+Each schema maps the attributes of the list elements in a reply to int, float or str. The text of an
+element, e.g. 'true' in <chl ...>true</chl>, is the field named after the element's tag. Values of
+"--" are always None. Fields which are not declared here have their type guessed from the value.
+"""
+
+_CHANNEL_ADDRESS: dict[str, type] = {
+    "ip": str,
+    "devtype": int,
+    "devid": int,
+    "subdevid": int,
+    "chlid": int,
+}
+
+REPLY_SCHEMAS: dict[str, dict[str, type]] = {
+    "getdevinfo": {
+        **_CHANNEL_ADDRESS,
+        "Channelid": int,
+        "channel": str,
+    },
+    "getchlstatus": {
+        **_CHANNEL_ADDRESS,
+        "reservepause": int,
+        "status": str,
+    },
+    "inquire": {
+        "dev": str,
+        "cycle_id": int,
+        "step_id": int,
+        "step_type": str,
+        "workstatus": str,
+        "barcode": str,
+        "current": float,
+        "voltage": float,
+        "capacity": float,
+        "energy": float,
+        "totaltime": float,
+        "relativetime": float,
+        "open_or_close": int,
+        "log_code": int,
+    },
+    "inquiredf": {
+        **_CHANNEL_ADDRESS,
+        "testid": int,
+        "count": int,
+        "chl": str,
+    },
+    "download": {
+        "seqid": int,
+        "stepid": int,
+        "cycleid": int,
+        "steptype": str,
+        "testtime": float,
+        "atime": str,
+        "volt": float,
+        "curr": float,
+        "cap": float,
+        "eng": float,
+    },
+    "downloadlog": {
+        "seqid": int,
+        "log_code": int,
+        "atime": str,
+    },
+    "downloadStepLayer": {
+        "startseqid": int,
+        "endseqid": int,
+        "stepindex": int,
+        "stepid": int,
+        "cycleid": int,
+        "steptype": str,
+        "steptime": float,
+        "endatime": str,
+        "startvolt": float,
+        "endvolt": float,
+        "startcurr": float,
+        "endcurr": float,
+        "cap": float,
+        "eng": float,
+        "dcir": float,
+    },
+}
@@ -0,0 +1,148 @@
+"""Select pipelines with wildcards, ranges and filters.
+
+Selectors are strings, resolved against the ChannelIndex of the channel map:
+
+- '21-1-3' is one pipeline
+- '21-*-*' is every channel of device 21
+- '21-2-1..8' is channels 1 to 8 of sub-device 2 of device 21
+- 'state:working' keeps pipelines in a state, from inquire
+- 'barcode:251203_*' keeps pipelines with a barcode matching a pattern, from inquire
+
+Pipelines matching any address selector are selected, or all pipelines if there are none. Filters
+of the same kind are combined with or, filters of different kinds with and. Selectors must have all
+three parts, so a pipeline ID with a part missing, e.g. '21-1', is not mistaken for a wildcard.
+"""
+
+import fnmatch
+from collections.abc import Iterable, Mapping
+
+from .channels import Channel, ChannelIndex
+
+# Filter kinds and the inquire field they match
+FILTERS = {"state": "workstatus", "barcode": "barcode"}
+
+# Part of an address selector, None matches anything, otherwise an inclusive range
+_Part = tuple[int, int] | None
+
+
+def _parse_part(part: str) -> _Part:
+    """Parse '*', '3' or '1..8'."""
+    if part == "*":
+        return None
+    first, sep, last = part.partition("..")
+    low = int(first)
+    high = int(last) if sep else low
+    if high < low:
+        msg = f"Empty range {part!r}."
+        raise ValueError(msg)
+    return (low, high)
+
+
+def parse_address(selector: str) -> tuple[_Part, _Part, _Part] | None:
+    """Parse an address selector into (devid, subdevid, chlid) parts, or None if it is not one."""
+    parts = selector.split("-")
+    if len(parts) != 3:
+        return None
+    try:
+        devid, subdevid, chlid = (_parse_part(part.strip()) for part in parts)
+    except ValueError:
+        return None
+    return devid, subdevid, chlid
+
+
+def is_filter(selector: str) -> bool:
+    """Check if a selector is a filter like 'state:working'."""
+    kind, sep, _pattern = selector.partition(":")
+    return bool(sep) and kind in FILTERS
+
+
+def split_filters(selectors: Iterable[str]) -> tuple[list[str], dict[str, list[str]]]:
+    """Split selectors into address selectors, and filter patterns by kind."""
+    addresses: list[str] = []
+    filters: dict[str, list[str]] = {}
+    for selector in selectors:
+        if is_filter(selector):
+            kind, _sep, pattern = selector.partition(":")
+            filters.setdefault(kind, []).append(pattern)
+        else:
+            addresses.append(selector)
+    return addresses, filters
+
+
+def _in_part(value: int, part: _Part) -> bool:
+    """Check if a value is in a part of an address selector."""
+    return part is None or part[0] <= value <= part[1]
+
+
+def _exact(part: _Part) -> int | None:
+    """Get the value of a part which matches one value, otherwise None."""
+    return part[0] if part is not None and part[0] == part[1] else None
+
+
+def match_address(index: ChannelIndex, address: tuple[_Part, _Part, _Part]) -> list[Channel]:
+    """Get the channels matching an address selector, in channel map order."""
+    devid, subdevid, chlid = (_exact(part) for part in address)
+    if None not in (devid, subdevid, chlid):
+        channel = index.find(devid, subdevid, chlid)
+        return [channel] if channel is not None else []
+    if devid is not None and subdevid is not None:
+        candidates = index.subdevice(devid, subdevid)
+    elif devid is not None:
+        candidates = index.device(devid)
+    else:
+        candidates = index.values()
+    dev_part, subdev_part, chl_part = address
+    return [
+        ch
+        for ch in candidates
+        if _in_part(ch.devid, dev_part) and _in_part(ch.subdevid, subdev_part) and _in_part(ch.chlid, chl_part)
+    ]
+
+
+def resolve(index: ChannelIndex, selectors: Iterable[str]) -> list[str]:
+    """Resolve address selectors and pipeline IDs to a list of pipeline IDs without duplicates.
+
+    Pipeline IDs are kept as they are, also if they are not in the index, so looking them up gives
+    the usual error.
+
+    Raises:
+        KeyError: if a selector matches no pipelines
+        ValueError: if a filter is given, these need the channel status, see apply_filters
+
+    """
+    pipeline_ids: dict[str, None] = {}
+    for selector in selectors:
+        if selector in index:
+            pipeline_ids[selector] = None
+            continue
+        if is_filter(selector):
+            msg = f"Filter {selector!r} needs the channel status, use select() to apply filters."
+            raise ValueError(msg)
+        address = parse_address(selector)
+        if address is None or None not in (_exact(part) for part in address):
+            pipeline_ids[selector] = None
+            continue
+        channels = match_address(index, address)
+        if not channels:
+            msg = f"No pipelines in the channel map match {selector!r}."
+            raise KeyError(msg)
+        pipeline_ids.update(dict.fromkeys(ch.pipeline_id for ch in channels))
+    return list(pipeline_ids)
+
+
+def apply_filters(status: Mapping[str, Mapping], filters: Mapping[str, list[str]]) -> list[str]:
+    """Get the pipeline IDs whose status passes the filters.
+
+    Args:
+        status: status of the pipelines, e.g. from inquire
+        filters: patterns by filter kind, e.g. from split_filters
+
+    """
+    return [
+        pipeline_id
+        for pipeline_id, record in status.items()
+        if all(
+            any(fnmatch.fnmatchcase(str(record.get(FILTERS[kind])), pattern) for pattern in patterns)
+            for kind, patterns in filters.items()
+        )
+    ]
@@ -0,0 +1,87 @@
+"""Watch the status of channels, reporting only the channels which changed.
+
+The status is polled with inquire, and only the few fields which mark a real change are compared,
+so a lab with hundreds of idle channels gives a few events instead of a full dump on every poll.
+"""
+
+import time
+from collections.abc import Callable, Iterator, Mapping
+
+# Fields of an inquire reply which are compared between polls
+WATCH_FIELDS = ("workstatus", "step_id", "cycle_id", "log_code")
+
+
+class ChangeDetector:
+    """Remember the watched fields of each channel, and report the channels which changed."""
+
+    def __init__(self, fields: tuple[str, ...] = WATCH_FIELDS) -> None:
+        """Initialize with no channels seen.
+
+        Args:
+            fields: fields to compare, a channel has changed if any of them is different
+
+        """
+        self.fields = fields
+        self._last: dict[str, tuple] = {}
+
+    def changes(self, status: Mapping[str, Mapping]) -> list[dict]:
+        """Compare a new status with the last one seen, and remember it.
+
+        Args:
+            status: status of the channels keyed by pipeline ID, e.g. from inquire
+
+        Returns:
+            one event per channel which changed or was not seen before, with the pipeline ID, the
+            list of changed fields, and the full status record
+
+        """
+        events = []
+        for pipeline_id, record in status.items():
+            values = tuple(record.get(field) for field in self.fields)
+            last = self._last.get(pipeline_id)
+            if values == last:
+                continue
+            self._last[pipeline_id] = values
+            changed = (
+                list(self.fields)
+                if last is None
+                else [field for field, old, new in zip(self.fields, last, values, strict=True) if old != new]
+            )
+            events.append({"pipeline_id": pipeline_id, "changed": changed, **record})
+        return events
+
+
+def watch_status(  # noqa: PLR0913
+    inquire: Callable[[list[str] | None], dict[str, dict]],
+    pipeline_ids: list[str] | None = None,
+    *,
+    interval: float = 5.0,
+    fields: tuple[str, ...] = WATCH_FIELDS,
+    polls: int | None = None,
+    sleep: Callable[[float], None] | None = None,
+) -> Iterator[dict]:
+    """Poll the status of channels, yield an event for each channel which changed.
+
+    On the first poll every channel is reported, with all fields marked as changed.
+
+    Args:
+        inquire: function which gets the status of pipelines, e.g. NewareAPI.inquire
+        pipeline_ids (optional): pipelines to watch, all pipelines if not given
+        interval: seconds between the start of each poll
+        fields: fields to compare between polls
+        polls (optional): stop after this many polls, otherwise watch forever
+        sleep (optional): function to wait between polls, by default time.sleep
+
+    Yields:
+        dictionary with the pipeline ID, the list of changed fields, and the status record
+
+    """
+    sleep = sleep or time.sleep
+    detector = ChangeDetector(fields)
+    n_polls = 0
+    while polls is None or n_polls < polls:
+        started = time.monotonic()
+        yield from detector.changes(inquire(pipeline_ids))
+        n_polls += 1
+        if polls is None or n_polls < polls:
+            sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,43 @@
+"""Benchmark reading large replies in NewareAPI.command.
+
+Run from the repository root with:
+    python -m benchmarks.bench_command
+
+Replies of increasing size are queued on a FakeSocket and read back with NewareAPI.command. The
+throughput should stay roughly constant as the reply size grows, i.e. the reader is linear time.
+"""
+
+import time
+
+from aurora_neware import NewareAPI
+from tests.mocks import FakeSocket
+
+SIZES_MB = [1, 5, 10, 25, 50]
+ROW = (
+    b'<data seqid="219576" stepid="24" cycleid="29" steptype="dc" testtime="36070000" '
+    b'atime="2025-12-28 22:29:05" volt="3.6780698299408" curr="-0.000295051460852847" '
+    b'cap="0.00295628436449786" eng="0.0135611368830335" />\r\n'
+)
+
+
+def make_reply(size_mb: int) -> bytes:
+    """Make a download-like reply of roughly the given size in MB."""
+    n_rows = size_mb * 1024 * 1024 // len(ROW)
+    return b'<bts version="1.0"><list count="%d">%s</list></bts>' % (n_rows, ROW * n_rows)
+
+
+def bench(size_mb: int) -> float:
+    """Return the time in seconds to read a reply of the given size."""
+    nw = NewareAPI()
+    nw.neware_socket = FakeSocket()
+    nw.neware_socket._response_map = {"<cmd>big</cmd>": make_reply(size_mb)}  # noqa: SLF001
+    start = time.perf_counter()
+    nw.command("<cmd>big</cmd>")
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"{'size / MB':>10} {'time / s':>10} {'MB/s':>10}")
+    for size in SIZES_MB:
+        elapsed = bench(size)
+        print(f"{size:>10} {elapsed:>10.3f} {size / elapsed:>10.0f}")
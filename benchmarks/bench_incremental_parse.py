@@ -0,0 +1,57 @@
+"""Benchmark parsing download replies while they are received, against NewareAPI(incremental_parse=False).
+
+Run from the repository root with:
+    python -m benchmarks.bench_incremental_parse
+
+Downloads large chunks one at a time from a local fake BTS server with limited bandwidth, parsing each
+reply after it has arrived, or while it arrives. Also times the parsers alone, without the network.
+"""
+
+import time
+
+from aurora_neware import NewareAPI
+from aurora_neware.neware import _xml_to_records
+from aurora_neware.parsing import RecordStream
+from tests.mocks import _download_synthetic_response
+
+from .fake_server import serve_in_process
+
+N_POINTS = 50000
+CHUNK_SIZE = 10000
+LATENCY = 0.01
+BANDWIDTHS = [5e6, 20e6, None]
+
+
+def bench(port: int, incremental_parse: bool) -> float:
+    """Return the time in seconds to download N_POINTS points."""
+    with NewareAPI(port=port, incremental_parse=incremental_parse) as nw:
+        start = time.perf_counter()
+        nw.download("21-1-1", last_n_points=N_POINTS, chunk_size=CHUNK_SIZE)
+        return time.perf_counter() - start
+
+
+def bench_parsers() -> tuple[float, float]:
+    """Return the time in seconds to parse one chunk all at once, and fed in 64 KiB pieces."""
+    reply = _download_synthetic_response(1, 1, 1, CHUNK_SIZE, n_total=CHUNK_SIZE)
+    start = time.perf_counter()
+    _xml_to_records(reply.decode(), command="download")
+    whole = time.perf_counter() - start
+    start = time.perf_counter()
+    stream = RecordStream(command="download")
+    for i in range(0, len(reply), 65536):
+        stream.feed(reply[i : i + 65536])
+    stream.close()
+    return whole, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    whole, incremental = bench_parsers()
+    print(f"Parsing {CHUNK_SIZE} points: {whole * 1000:.0f} ms whole, {incremental * 1000:.0f} ms incremental")
+    print(f"{N_POINTS} points in chunks of {CHUNK_SIZE}, {LATENCY * 1000:.0f} ms round-trip time")
+    print(f"{'MB/s':>8} {'whole / s':>10} {'incremental / s':>16} {'speedup':>10}")
+    for bandwidth in BANDWIDTHS:
+        with serve_in_process(latency=LATENCY, bandwidth=bandwidth) as port:
+            baseline = bench(port, incremental_parse=False)
+            elapsed = bench(port, incremental_parse=True)
+        label = f"{bandwidth / 1e6:.0f}" if bandwidth else "max"
+        print(f"{label:>8} {baseline:>10.3f} {elapsed:>16.3f} {baseline / elapsed:>10.2f}")
@@ -0,0 +1,43 @@
+"""Benchmark splitting one large download over several connections.
+
+Run from the repository root with:
+    python -m benchmarks.bench_parallel_download
+
+Downloads from a local fake BTS server with an injected round-trip time. The sequential loop with one
+request in flight is the baseline, then the points are split into spans downloaded at the same time
+over 2 up to 8 connections.
+"""
+
+import time
+
+from aurora_neware import NewareAPI
+
+from .fake_server import serve_in_process
+
+N_POINTS = 40000
+LATENCY = 0.05
+PARALLELISM = [1, 2, 4, 8]
+
+
+def bench(port: int, parallelism: int, window: int = 1) -> float:
+    """Return the time in seconds to download N_POINTS points."""
+    with NewareAPI(port=port) as nw:
+        start = time.perf_counter()
+        data = nw.download("21-1-1", last_n_points=N_POINTS, window=window, parallelism=parallelism)
+        elapsed = time.perf_counter() - start
+    if data["seqid"] != list(range(data["seqid"][0], data["seqid"][0] + N_POINTS)):
+        msg = "Points are missing or out of order"
+        raise ValueError(msg)
+    return elapsed
+
+
+if __name__ == "__main__":
+    with serve_in_process(latency=LATENCY) as port:
+        print(f"{N_POINTS} points in chunks of 1000, {LATENCY * 1000:.0f} ms round-trip time")
+        print(f"{'parallelism':>12} {'window':>8} {'time / s':>10} {'speedup':>10}")
+        baseline = None
+        for window in (1, 4):
+            for parallelism in PARALLELISM:
+                elapsed = bench(port, parallelism, window)
+                baseline = baseline or elapsed
+                print(f"{parallelism:>12} {window:>8} {elapsed:>10.3f} {baseline / elapsed:>10.1f}")
@@ -0,0 +1,40 @@
+"""Benchmark parsing download replies.
+
+Run from the repository root with:
+    python -m benchmarks.bench_parsing
+
+Compares the generic defusedxml parser with the fast flat-list parser on download replies of 1k,
+10k and 100k data points, and checks that both give the same records. Parsing straight into typed
+columns with DataColumns is shown for comparison.
+"""
+
+import time
+
+from aurora_neware.columns import DataColumns
+from aurora_neware.parsing import fast_records, generic_records
+from tests.mocks import _download_synthetic_response
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+def best_time(func: object, xml_string: str, repeat: int = 3) -> float:
+    """Return the best time in seconds of several runs."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(xml_string)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    print(f"{'records':>10} {'generic / s':>12} {'fast / s':>10} {'speedup':>8} {'columnar / s':>13}")
+    for n in SIZES:
+        xml_string = _download_synthetic_response(1, 1, 1, n, n_total=n).decode()
+        if fast_records(xml_string, command="download") != generic_records(xml_string, command="download"):
+            msg = "Fast and generic parsers disagree"
+            raise ValueError(msg)
+        generic = best_time(lambda x: generic_records(x, command="download"), xml_string)
+        fast = best_time(lambda x: fast_records(x, command="download"), xml_string)
+        columnar = best_time(lambda x: DataColumns().append_xml(x), xml_string)
+        print(f"{n:>10} {generic:>12.3f} {fast:>10.3f} {generic / fast:>8.1f} {columnar:>13.3f}")
@@ -0,0 +1,37 @@
+"""Benchmark pipelined chunk requests in NewareAPI.download.
+
+Run from the repository root with:
+    python -m benchmarks.bench_pipelined_download
+
+Downloads from a local fake BTS server with an injected round-trip time, keeping 1 (sequential) up to
+16 chunk requests in flight.
+"""
+
+import time
+
+from aurora_neware import NewareAPI
+
+from .fake_server import serve_in_process
+
+N_POINTS = 20000
+LATENCY = 0.05
+WINDOWS = [1, 2, 4, 8, 16]
+
+
+def bench(port: int, window: int) -> float:
+    """Return the time in seconds to download N_POINTS points."""
+    with NewareAPI(port=port) as nw:
+        start = time.perf_counter()
+        nw.download("21-1-1", last_n_points=N_POINTS, window=window)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    with serve_in_process(latency=LATENCY) as port:
+        print(f"{N_POINTS} points in chunks of 1000, {LATENCY * 1000:.0f} ms round-trip time")
+        print(f"{'window':>8} {'time / s':>10} {'speedup':>10}")
+        baseline = None
+        for window in WINDOWS:
+            elapsed = bench(port, window)
+            baseline = baseline or elapsed
+            print(f"{window:>8} {elapsed:>10.3f} {baseline / elapsed:>10.1f}")
@@ -0,0 +1,109 @@
+"""A local TCP server which answers like a BTS server, with an injected round-trip time.
+
+Replies are generated by tests.mocks.FakeSocket. Each reply is sent 'latency' seconds after its
+request arrives, and requests on one connection are answered in order, so several requests in flight
+share the same wait like on a real network. With a bandwidth, replies are sent in pieces paced to
+that many bytes per second, so large replies take time to arrive like on a slow link.
+"""
+
+import contextlib
+import multiprocessing
+import queue
+import socketserver
+import threading
+import time
+from collections.abc import Iterator
+from types import TracebackType
+
+from tests.mocks import FakeSocket
+
+TERMINATION = b"\n\n#\r\n"
+# Bytes sent at once when the bandwidth is limited
+_PIECE_SIZE = 16384
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Answer the requests on one connection."""
+
+    server: "FakeBTSServer"
+
+    def handle(self) -> None:
+        """Read requests and queue the replies to be sent after the latency."""
+        replies: queue.Queue[tuple[float, bytes] | None] = queue.Queue()
+        sender = threading.Thread(target=self._send_replies, args=(replies,), daemon=True)
+        sender.start()
+        fake = FakeSocket()
+        buffer = b""
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            buffer += data
+            while (end := buffer.find(TERMINATION)) != -1:
+                request, buffer = buffer[: end + len(TERMINATION)], buffer[end + len(TERMINATION) :]
+                fake.sendall(request)
+                replies.put((time.monotonic() + self.server.latency, fake.recv(len(fake._recv_buffer))))  # noqa: SLF001
+        replies.put(None)
+        sender.join()
+
+    def _send_replies(self, replies: "queue.Queue[tuple[float, bytes] | None]") -> None:
+        """Send each reply once it is due."""
+        while (item := replies.get()) is not None:
+            due, reply = item
+            time.sleep(max(0.0, due - time.monotonic()))
+            if not self.server.bandwidth:
+                self.request.sendall(reply)
+                continue
+            for i in range(0, len(reply), _PIECE_SIZE):
+                self.request.sendall(reply[i : i + _PIECE_SIZE])
+                time.sleep(_PIECE_SIZE / self.server.bandwidth)
+
+
+class FakeBTSServer(socketserver.ThreadingTCPServer):
+    """Fake BTS server on localhost, use as a context manager."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency: float = 0.02, bandwidth: float | None = None) -> None:
+        """Bind to a free port on localhost, bandwidth in bytes per second is unlimited if None."""
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.port = self.server_address[1]
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeBTSServer":
+        """Start serving in a background thread."""
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(latency: float, bandwidth: float | None, ports: "multiprocessing.Queue[int]") -> None:
+    """Serve forever, reporting the port."""
+    with FakeBTSServer(latency, bandwidth) as server:
+        ports.put(server.port)
+        server._thread.join()  # noqa: SLF001
+
+
+@contextlib.contextmanager
+def serve_in_process(latency: float = 0.02, bandwidth: float | None = None) -> Iterator[int]:
+    """Run a fake server in a separate process so it does not compete for the GIL, yield the port."""
+    ports: multiprocessing.Queue[int] = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(latency, bandwidth, ports), daemon=True)
+    process.start()
+    try:
+        yield ports.get(timeout=10)
+    finally:
+        process.terminate()
+        process.join()
@@ -1,12 +1,21 @@
 """Fixtures for tests."""
 
 import socket
+from pathlib import Path
 
 import pytest
 
 from .mocks import FakeSocket
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Use a temporary cache directory, so tests do not see files or daemons of the user."""
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("AURORA_NEWARE_CACHE_DIR", str(directory))
+    return directory
+
+
 @pytest.fixture
 def mock_bts(monkeypatch: pytest.MonkeyPatch) -> None:
     """Replace socket.socket() with FakeSocket."""
@@ -1,5 +1,9 @@
 """Mocks and fakes for testing."""
 
+import asyncio
+import contextlib
+import re
+from collections.abc import AsyncIterator, Callable
 from typing import ClassVar
 
 _connect_response = (
@@ -261,6 +265,49 @@ def _download0_repsonse(i: int, j: int) -> bytes:
     )
 
 
+_download_pattern = re.compile(
+    r'<cmd>download</cmd><download devtype="27" devid="21" subdevid="(\d+)" chlid="(\d+)" '
+    r'auxid="0" testid="0" startpos="(\d+)" count="(\d+)"/>'
+)
+
+
+def _download_synthetic_response(  # noqa: PLR0913
+    subdevid: int,
+    chlid: int,
+    startpos: int,
+    count: int,
+    *,
+    n_total: int = 219585,
+    atime: Callable[[int], str] | None = None,
+) -> bytes:
+    """Make a download response with synthetic data points, seqid is the position in the test."""
+    seqids = range(max(startpos, 1), min(startpos + count, n_total + 1))
+    rows = b"".join(
+        b'    <data seqid="%d" stepid="%d" cycleid="%d" steptype="cc" testtime="%d" atime="%s" '
+        b'volt="%.6f" curr="0.0003" cap="%.6f" eng="%.6f" />\r\n'
+        % (
+            seqid,
+            seqid // 100 + 1,
+            seqid // 1000 + 1,
+            seqid * 10000,
+            (atime(seqid) if atime else "2025-12-28 22:29:05").encode(),
+            3 + (seqid % 100) / 100,
+            seqid / 1e6,
+            seqid / 1e5,
+        )
+        for seqid in seqids
+    )
+    return (
+        b'<?xml version="1.0" encoding="UTF-8"?>\r\n'
+        b'<bts version="1.0">\r\n'
+        b"  <cmd>donwload_resp</cmd>\r\n"
+        b'  <download devtype="27" devid="21" subdevid="%d" chlid="%d" testid="143" startpos="%d" count="%d" '
+        b'auxid="0" />\r\n'
+        b'  <list count="%d">\r\n%s  </list>\r\n'
+        b"</bts>" % (subdevid, chlid, startpos, count, len(seqids), rows)
+    )
+
+
 _downloadlog_21_1_1_response = (
     b'<?xml version="1.0" encoding="UTF-8"?>\r\n'
     b'<bts version="1.0">\r\n'
@@ -319,7 +366,7 @@ class FakeSocket:
     def __init__(self) -> None:
         """Initialise the 'socket'."""
         self.sent_data: list[str] = []
-        self._recv_buffer = b""
+        self._recv_buffer = bytearray()
 
     def connect(self, address: tuple[str, int]) -> None:
         """Fake connect to an IP and port."""
@@ -333,12 +380,16 @@ class FakeSocket:
 
     def recv(self, bufsize: int) -> bytes:
         """Receive the response."""
-        if not self._recv_buffer:
-            return b""
-        chunk = self._recv_buffer[:bufsize]
-        self._recv_buffer = self._recv_buffer[bufsize:]
+        chunk = bytes(self._recv_buffer[:bufsize])
+        del self._recv_buffer[:bufsize]
         return chunk
 
+    def recv_into(self, buffer: memoryview, nbytes: int = 0) -> int:
+        """Receive the response into a buffer."""
+        chunk = self.recv(nbytes or len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
     def close(self) -> None:
         """Close the fake connection."""
         return
@@ -348,9 +399,21 @@ class FakeSocket:
             if pattern in text:
                 self._recv_buffer += response + b"\n\n#\r\n"
                 return
+        match = _download_pattern.search(text)
+        if match:
+            response = _download_synthetic_response(
+                *(int(g) for g in match.groups()), n_total=self.n_datapoints, atime=self.atime
+            )
+            self._recv_buffer += response + b"\n\n#\r\n"
+            return
         msg = f"Unknown command:\n{text}"
         raise AssertionError(msg)
 
+    # Number of data points on the server for synthetic download responses
+    n_datapoints: ClassVar = 219585
+    # Function giving the atime of a synthetic data point from its seqid, by default all are the same
+    atime: ClassVar[Callable[[int], str] | None] = None
+
     _response_map: ClassVar = {
         "<cmd>connect</cmd>": _connect_response,
         "<cmd>getdevinfo</cmd>": _get_devinfo_response,
@@ -397,3 +460,28 @@ class FakeSocket:
         '<cmd>clearflag</cmd><list count = "1"><clearflag ip="127.0.0.1" devtype="27" devid="21" subdevid="1" chlid="1">true</clearflag></list>': _clear_flag_response,
         '<cmd>light</cmd><list count = "1"><light ip="127.0.0.1" devtype="27" devid="21" subdevid="1" chlid="1">true</light></list>': _light_response,
     }
+
+
+@contextlib.asynccontextmanager
+async def fake_bts_server(delay: float = 0.0) -> AsyncIterator[int]:
+    """Serve FakeSocket replies over TCP on localhost, yield the port.
+
+    Each reply is sent 'delay' seconds after its request arrives.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        fake = FakeSocket()
+        try:
+            while request := await reader.readuntil(b"\n\n#\r\n"):
+                fake.sendall(request)
+                await asyncio.sleep(delay)
+                writer.write(fake.recv(len(fake._recv_buffer)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    async with server:
+        yield server.sockets[0].getsockname()[1]
@@ -0,0 +1,137 @@
+"""Tests for async_api.py."""
+
+import asyncio
+from typing import Any
+
+import pytest
+
+from aurora_neware import AsyncNewareAPI, NewareAPI
+
+from . import mocks
+from .mocks import FakeSocket, fake_bts_server
+
+
+def test_async_commands() -> None:
+    """Test the async commands give the same results as NewareAPI."""
+    sync_nw = NewareAPI()
+    sync_nw.neware_socket = FakeSocket()
+    with sync_nw as nw:
+        expected = {
+            "inquire": nw.inquire(),
+            "inquiredf": nw.inquiredf("21-1-1"),
+            "getchlstatus": nw.getchlstatus(),
+            "downloadlog": nw.downloadlog("21-1-1"),
+            "get_steps": nw.get_steps("21-1-1"),
+            "download": nw.download("21-1-1", last_n_points=2500),
+        }
+
+    async def run() -> dict:
+        async with fake_bts_server() as port, AsyncNewareAPI(port=port, timeout=5) as nw:
+            assert len(nw.channel_map) == 16
+            return {
+                "inquire": await nw.inquire(),
+                "inquiredf": await nw.inquiredf("21-1-1"),
+                "getchlstatus": await nw.getchlstatus(),
+                "downloadlog": await nw.downloadlog("21-1-1"),
+                "get_steps": await nw.get_steps("21-1-1"),
+                "download": await nw.download("21-1-1", last_n_points=2500),
+            }
+
+    assert asyncio.run(run()) == expected
+
+
+def test_async_many_servers() -> None:
+    """Test one event loop drives several servers concurrently."""
+
+    async def run() -> list[dict]:
+        async with fake_bts_server(delay=0.1) as port1, fake_bts_server(delay=0.1) as port2:
+            clients = [AsyncNewareAPI(port=port) for port in (port1, port2, port1, port2)]
+            await asyncio.gather(*(nw.connect() for nw in clients))
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            results = await asyncio.gather(*(nw.inquiredf("21-1-1") for nw in clients))
+            # Four replies with 0.1 s delay each, in about the time of one
+            assert loop.time() - start < 0.3
+            await asyncio.gather(*(nw.disconnect() for nw in clients))
+            return results
+
+    results = asyncio.run(run())
+    assert all(r["21-1-1"]["count"] == 219585 for r in results)
+
+
+def test_async_timeout() -> None:
+    """Test a reply which is too slow raises TimeoutError and closes the connection."""
+
+    async def run() -> None:
+        async with fake_bts_server(delay=0.05) as port:
+            nw = AsyncNewareAPI(port=port)
+            await nw.connect()
+            with pytest.raises(asyncio.TimeoutError):
+                await nw.inquire("21-1-1", timeout=0.01)
+            assert nw.writer is None
+            with pytest.raises(ConnectionError):
+                await nw.inquire("21-1-1")
+
+    asyncio.run(run())
+
+
+def test_async_cancelled() -> None:
+    """Test a command cancelled by the caller closes the connection, so its reply is not read by the next command."""
+
+    async def run() -> None:
+        async with fake_bts_server(delay=0.05) as port:
+            nw = AsyncNewareAPI(port=port)
+            await nw.connect()
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(nw.inquiredf("21-1-1"), 0.01)
+            assert nw.writer is None
+            with pytest.raises(ConnectionError):
+                await nw.get_steps("21-1-1")
+
+            await nw.connect()
+            task = asyncio.create_task(nw.inquiredf("21-1-1"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert nw.writer is None
+            await nw.connect()
+            assert len(await nw.get_steps("21-1-1")) == 3
+            await nw.disconnect()
+
+    asyncio.run(run())
+
+
+def test_async_pipeline_ids() -> None:
+    """Test pipeline IDs are checked before anything is sent."""
+
+    async def run() -> None:
+        async with fake_bts_server() as port, AsyncNewareAPI(port=port) as nw:
+            with pytest.raises(KeyError):
+                await nw.stop("99-9-9")
+            with pytest.raises(ValueError, match="Pipeline_ids must be"):
+                await nw.stop(None)
+
+    asyncio.run(run())
+
+
+def test_async_short_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test short replies leave no holes, and replies without points raise after a few attempts."""
+    synthetic = mocks._download_synthetic_response
+    max_points = [300]
+
+    def capped(subdevid: int, chlid: int, startpos: int, count: int, **kwargs: Any) -> bytes:  # noqa: ANN401
+        """Give at most max_points points per chunk."""
+        return synthetic(subdevid, chlid, startpos, min(count, max_points[0]), **kwargs)
+
+    monkeypatch.setattr(mocks, "_download_synthetic_response", capped)
+
+    async def run() -> None:
+        async with fake_bts_server() as port, AsyncNewareAPI(port=port, timeout=5) as nw:
+            data = await nw.download("21-1-1", last_n_points=2500)
+            assert data["seqid"] == list(range(217086, 219586))
+            max_points[0] = 0
+            with pytest.raises(ValueError, match="missing"):
+                await nw.download("21-1-1", last_n_points=2500)
+
+    asyncio.run(run())
@@ -0,0 +1,292 @@
+"""Tests for cache.py."""
+
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from aurora_neware import ChannelMapCache, DownloadCache, NewareAPI
+
+from . import mocks
+from .mocks import FakeSocket, _inquiredf_21_1_1_response
+
+
+def _downloads(nw: NewareAPI) -> list[str]:
+    """Get the download commands sent to the fake socket."""
+    return [s for s in nw.neware_socket.sent_data if "<cmd>download</cmd>" in s]
+
+
+def test_download_cached(mock_bts, tmp_path: Path) -> None:
+    """Test repeated downloads only fetch points after the cached tail."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        res = nw.download("21-1-1", last_n_points=2500)
+        assert res["seqid"] == list(range(217086, 219586))
+        assert len(_downloads(nw)) == 3
+        assert cache.get("127.0.0.1-502-21-1-1-143")["last_seqid"] == 219585
+
+        # Everything is already cached
+        res = nw.download("21-1-1", last_n_points=10)
+        assert res == nw.download("21-1-1", last_n_points=10)
+        assert res["seqid"] == list(range(219576, 219586))
+        assert len(_downloads(nw)) == 3
+
+        # Request starts before the cache, download again
+        res = nw.download("21-1-1", last_n_points=3000)
+        assert len(res["seqid"]) == 3000
+        assert len(_downloads(nw)) == 6
+
+        # Without a cache the result is the same
+        nw.download_cache = None
+        assert nw.download("21-1-1", last_n_points=3000) == res
+
+
+def test_download_cached_tail(mock_bts, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test new points on the server are appended to the cache."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        monkeypatch.setitem(
+            FakeSocket._response_map,
+            '<cmd>inquiredf</cmd><list count = "1">',
+            _inquiredf_21_1_1_response.replace(b'count="219585"', b'count="219000"'),
+        )
+        monkeypatch.setattr(FakeSocket, "n_datapoints", 219000)
+        res = nw.download("21-1-1", last_n_points=100)
+        assert res["seqid"][-1] == 219000
+        n_sent = len(_downloads(nw))
+
+        monkeypatch.setitem(
+            FakeSocket._response_map, '<cmd>inquiredf</cmd><list count = "1">', _inquiredf_21_1_1_response
+        )
+        monkeypatch.setattr(FakeSocket, "n_datapoints", 219585)
+        res = nw.download("21-1-1", last_n_points=500)
+        assert res["seqid"] == list(range(219086, 219586))
+        sent = _downloads(nw)[n_sent:]
+        assert len(sent) == 1
+        assert 'startpos="219001"' in sent[0]
+
+
+def test_download_cached_resume(mock_bts, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test a download interrupted part way resumes after the last cached chunk."""
+    synthetic = mocks._download_synthetic_response
+    failed = []
+
+    def fail_once(subdevid: int, chlid: int, startpos: int, count: int, **kwargs: Any) -> bytes:  # noqa: ANN401
+        """Lose the connection the first time the fourth chunk is requested."""
+        if startpos == 217586 and not failed:
+            failed.append(startpos)
+            msg = "Connection lost"
+            raise ConnectionError(msg)
+        return synthetic(subdevid, chlid, startpos, count, **kwargs)
+
+    monkeypatch.setattr(mocks, "_download_synthetic_response", fail_once)
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        with pytest.raises(ConnectionError):
+            nw.download("21-1-1", last_n_points=5000)
+        checkpoint = cache.get("127.0.0.1-502-21-1-1-143")["last_seqid"]
+        assert 214585 < checkpoint < 219585
+        n_sent = len(_downloads(nw))
+        res = nw.download("21-1-1", last_n_points=5000)
+        assert res["seqid"] == list(range(214586, 219586))
+        assert f'startpos="{checkpoint + 1}"' in _downloads(nw)[n_sent]
+
+
+def test_download_cached_without_data(mock_bts, tmp_path: Path) -> None:
+    """Test a test in the index without data is downloaded again."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        expected = nw.download("21-1-1", last_n_points=10)
+        (tmp_path / "127.0.0.1-502-21-1-1-143.ndjson").unlink()
+        assert cache.get("127.0.0.1-502-21-1-1-143") is None
+        assert nw.download("21-1-1", last_n_points=10) == expected
+        # Interrupted first append, the index is written but no data
+        for suffix in (".ndjson", ".lines"):
+            (tmp_path / f"127.0.0.1-502-21-1-1-143{suffix}").unlink()
+        assert cache.get("127.0.0.1-502-21-1-1-143") is None
+        assert nw.download("21-1-1", last_n_points=10) == expected
+        assert cache.get("127.0.0.1-502-21-1-1-143")["last_seqid"] == 219585
+
+
+def test_download_cached_parallel(mock_bts, tmp_path: Path) -> None:
+    """Test parallel downloads are appended to the cache in order."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        res = nw.download("21-1-1", last_n_points=3000, parallelism=3)
+        assert res["seqid"] == list(range(216586, 219586))
+        assert cache.read("127.0.0.1-502-21-1-1-143") == res
+
+
+def test_test_id_change(mock_bts, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the cache of a pipeline is dropped when the test ID changes."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        nw.download("21-1-1", last_n_points=10)
+        assert cache.get("127.0.0.1-502-21-1-1-143")
+        monkeypatch.setitem(
+            FakeSocket._response_map,
+            '<cmd>inquiredf</cmd><list count = "1">',
+            _inquiredf_21_1_1_response.replace(b'testid="143"', b'testid="150"'),
+        )
+        nw.download("21-1-1", last_n_points=10)
+        assert cache.get("127.0.0.1-502-21-1-1-143") is None
+        assert cache.get("127.0.0.1-502-21-1-1-150")
+        assert not (tmp_path / "127.0.0.1-502-21-1-1-143.ndjson").exists()
+
+
+def test_test_id_from_download(mock_bts, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the test ID is found with a download if inquiredf does not give one."""
+    monkeypatch.setitem(
+        FakeSocket._response_map,
+        '<cmd>inquiredf</cmd><list count = "1">',
+        _inquiredf_21_1_1_response.replace(b'testid="143"', b'testid="0"'),
+    )
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(download_cache=cache) as nw:
+        nw.download("21-1-1", last_n_points=10)
+    assert cache.get("127.0.0.1-502-21-1-1-143")
+    assert cache.get("127.0.0.1-502-21-1-1-0") is None
+
+
+def test_cache_per_server(mock_bts, tmp_path: Path) -> None:
+    """Test servers with the same pipeline and test IDs do not share cached data."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI("127.0.0.1", download_cache=cache) as nw1, NewareAPI("127.0.0.2", download_cache=cache) as nw2:
+        nw1.download("21-1-1", last_n_points=10)
+        nw2.download("21-1-1", last_n_points=10)
+        assert len(_downloads(nw2)) == 1
+    assert cache.get("127.0.0.1-502-21-1-1-143")
+    assert cache.get("127.0.0.2-502-21-1-1-143")
+
+
+def test_lru_eviction(tmp_path: Path) -> None:
+    """Test least recently used tests are evicted when the cache is too big."""
+    cache = DownloadCache(tmp_path, max_bytes=1000)
+    chunk = {"seqid": list(range(1, 51)), "volt": [3.5] * 50}
+    cache.append("1-1-1-1", chunk)
+    cache.append("1-1-2-1", chunk)
+    assert cache.get("1-1-1-1")
+    cache.read("1-1-1-1")  # 1-1-1-1 is now used more recently than 1-1-2-1
+    cache.append("1-1-3-1", chunk)
+    assert cache.get("1-1-1-1")
+    assert cache.get("1-1-2-1") is None
+    assert cache.get("1-1-3-1")
+    assert cache.size() <= 1000
+
+    # A single test larger than the limit is kept
+    cache.append("1-1-4-1", {"seqid": list(range(1, 501)), "volt": [3.5] * 500})
+    assert cache.get("1-1-4-1")
+    assert cache.get("1-1-1-1") is None
+
+
+def test_read(tmp_path: Path) -> None:
+    """Test reading from the cache."""
+    cache = DownloadCache(tmp_path)
+    assert cache.read("1-1-1-1") == {}
+    cache.append("1-1-1-1", {"seqid": [1, 2, 3], "volt": [3.1, 3.2, 3.3]})
+    cache.append("1-1-1-1", {"seqid": [4, 5], "volt": [3.4, 3.5]})
+    cache.append("1-1-1-1", {})
+    assert cache.read("1-1-1-1") == {"seqid": [1, 2, 3, 4, 5], "volt": [3.1, 3.2, 3.3, 3.4, 3.5]}
+    assert cache.read("1-1-1-1", first_seqid=4) == {"seqid": [4, 5], "volt": [3.4, 3.5]}
+    assert cache.get("1-1-1-1")["first_seqid"] == 1
+    assert cache.get("1-1-1-1")["last_seqid"] == 5
+    cache.drop("1-1-1-1")
+    assert cache.read("1-1-1-1") == {}
+
+
+def test_read_seeks(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test reading the tail of a test only decodes the lines it needs, and the index is not rewritten per chunk."""
+    cache = DownloadCache(tmp_path)
+    n_writes = []
+    write_index = DownloadCache._write_index
+    monkeypatch.setattr(
+        DownloadCache, "_write_index", lambda self, index: n_writes.append(1) or write_index(self, index)
+    )
+    for first in range(1, 1001, 10):
+        cache.append("1-1-1-1", {"seqid": list(range(first, first + 10)), "volt": [3.5] * 10})
+    assert len(n_writes) == 1
+    assert cache.get("1-1-1-1")["last_seqid"] == 1000
+
+    n_decoded = []
+    loads = json.loads
+    monkeypatch.setattr(json, "loads", lambda line: n_decoded.append(1) or loads(line))
+    assert cache.read("1-1-1-1", first_seqid=985)["seqid"] == list(range(985, 1001))
+    assert len(n_decoded) == 2
+    assert len(n_writes) == 1
+    assert cache.read("1-1-1-1", first_seqid=2000) == {}
+
+
+def test_read_without_line_index(tmp_path: Path) -> None:
+    """Test data cached before line indexes existed, or repeated by an interrupted append, is read correctly."""
+    cache = DownloadCache(tmp_path)
+    cache.append("1-1-1-1", {"seqid": [1, 2, 3], "volt": [3.1, 3.2, 3.3]})
+    with (tmp_path / "1-1-1-1.ndjson").open("a") as f:
+        f.write(json.dumps({"seqid": [3, 4], "volt": [3.3, 3.4]}) + "\n")
+    (tmp_path / "1-1-1-1.lines").unlink()
+    assert cache.get("1-1-1-1")["last_seqid"] == 4
+    cache.append("1-1-1-1", {"seqid": [5], "volt": [3.5]})
+    assert cache.read("1-1-1-1") == {"seqid": [1, 2, 3, 4, 5], "volt": [3.1, 3.2, 3.3, 3.4, 3.5]}
+    assert cache.read("1-1-1-1", first_seqid=4) == {"seqid": [4, 5], "volt": [3.4, 3.5]}
+
+
+def _getdevinfo_count(nw: NewareAPI) -> int:
+    """Count the getdevinfo commands sent to the fake socket."""
+    return sum("<cmd>getdevinfo</cmd>" in s for s in nw.neware_socket.sent_data)
+
+
+def test_channel_map_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test cached channel maps expire after the TTL."""
+    cache = ChannelMapCache(tmp_path, ttl=60)
+    assert cache.get("127.0.0.1", 502) is None
+    cache.put("127.0.0.1", 502, {"1-1-1": {"devid": 1}})
+    assert cache.get("127.0.0.1", 502) == {"1-1-1": {"devid": 1}}
+    assert cache.get("127.0.0.1", 503) is None
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("127.0.0.1", 502) is None
+    cache.drop("127.0.0.1", 502)
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_connect_with_channel_map_cache(mock_bts, tmp_path: Path) -> None:
+    """Test connect only calls getdevinfo if the cached channel map is missing."""
+    cache = ChannelMapCache(tmp_path)
+    with NewareAPI(channel_map_cache=cache) as nw:
+        assert _getdevinfo_count(nw) == 1
+        channel_map = nw.channel_map
+    with NewareAPI(channel_map_cache=cache) as nw:
+        assert _getdevinfo_count(nw) == 0
+        assert nw.channel_map == channel_map
+        assert nw.inquire("21-1-1")["21-1-1"]["workstatus"] == "finish"
+
+
+def test_stale_channel_map(mock_bts, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test a cached channel map is refreshed when a pipeline is missing or a reply does not match."""
+    cache = ChannelMapCache(tmp_path)
+    with NewareAPI(channel_map_cache=cache) as nw:
+        channel_map = nw.channel_map
+    cache.put("127.0.0.1", 502, {k: v for k, v in channel_map.items() if k != "21-1-1"})
+
+    with NewareAPI(channel_map_cache=cache) as nw:
+        assert nw.inquire("21-1-1")["21-1-1"]["workstatus"] == "finish"
+        assert _getdevinfo_count(nw) == 1
+        assert cache.get("127.0.0.1", 502) == channel_map
+        # The map is only refreshed once, really missing pipelines still raise
+        with pytest.raises(KeyError):
+            nw.inquire("99-9-9")
+        assert _getdevinfo_count(nw) == 1
+
+    # The reply has two channels instead of one
+    monkeypatch.setitem(
+        FakeSocket._response_map,
+        '<cmd>inquire</cmd><list count = "1"><inquire ip="127.0.0.1" devtype="27" devid="21" subdevid="1" chlid="1"',
+        FakeSocket._response_map[
+            '<cmd>inquire</cmd><list count = "2"><inquire ip="127.0.0.1" devtype="27" devid="21" subdevid="1" chlid="1"'
+        ],
+    )
+    with NewareAPI(channel_map_cache=cache) as nw:
+        with pytest.raises(ValueError, match="requested channels"):
+            nw.inquire("21-1-1")
+        assert _getdevinfo_count(nw) == 1
@@ -0,0 +1,81 @@
+"""Tests for channels.py."""
+
+import pytest
+
+from aurora_neware import Channel, ChannelIndex, NewareAPI
+from aurora_neware.channels import match_records
+
+
+def _index() -> ChannelIndex:
+    """Index with two sub-devices of device 13 and one of device 14."""
+    return ChannelIndex(
+        Channel("127.0.0.1", 27, devid, subdevid, chlid, channel="true")
+        for devid, subdevid in ((13, 1), (13, 5), (14, 1))
+        for chlid in range(1, 9)
+    )
+
+
+def test_channel() -> None:
+    """Test a channel has typed fields, and behaves like a getdevinfo record."""
+    record = {"ip": "127.0.0.1", "devtype": "27", "devid": "13", "subdevid": "5", "Channelid": "5", "channel": "true"}
+    channel = Channel.from_record(record)
+    assert not hasattr(channel, "__dict__")
+    assert (channel.devid, channel.subdevid, channel.chlid) == (13, 5, 5)
+    assert channel.pipeline_id == "13-5-5"
+    assert channel["Channelid"] == 5
+    assert dict(channel) == {**record, "devtype": 27, "devid": 13, "subdevid": 5, "Channelid": 5}
+    assert {**channel}["ip"] == "127.0.0.1"
+    assert channel.address == 'ip="127.0.0.1" devtype="27" devid="13" subdevid="5" chlid="5"'
+    assert channel.address_no_ip == 'devtype="27" devid="13" subdevid="5" chlid="5"'
+    with pytest.raises(KeyError):
+        channel["test_id"]
+    with pytest.raises(AttributeError):
+        channel.test_id = 1
+
+
+def test_channel_index() -> None:
+    """Test channels are found by pipeline ID, address, device and sub-device."""
+    index = _index()
+    assert len(index) == 24
+    assert index["13-5-2"].key == (13, 5, 2)
+    assert index.find(13, 5, 2) is index["13-5-2"]
+    assert index.find(13, 2, 2) is None
+    assert [ch.pipeline_id for ch in index.subdevice(13, 5)] == [f"13-5-{i}" for i in range(1, 9)]
+    assert len(index.device(13)) == 16
+    assert index.device(15) == []
+    assert ChannelIndex.from_records(index) is index
+    assert ChannelIndex.from_records(index.to_dict()) == index
+
+
+def test_match_records() -> None:
+    """Test reply records are matched to the requested channels by address, also if subdevid is wrong."""
+    index = _index()
+    pipelines = {p: index[p] for p in ("13-1-1", "13-5-5", "14-1-2")}
+
+    # Order of the reply does not matter
+    records = [{"devid": 14, "subdevid": 1, "chlid": 2}, {"devid": 13, "subdevid": 1, "chlid": 1}]
+    records.insert(1, {"dev": "27-13-5-5-0"})
+    matched = match_records(pipelines, records)
+    assert list(matched) == ["13-1-1", "13-5-5", "14-1-2"]
+    assert matched["14-1-2"] is records[0]
+    assert matched["13-5-5"] is records[1]
+
+    # 13-5-5 reported as 13-1-5
+    records = [{"devid": 13, "subdevid": 1, "chlid": 5, "status": "working"}]
+    assert match_records({"13-5-5": index["13-5-5"]}, records)["13-5-5"]["status"] == "working"
+
+    # 13-5-5 and 13-1-5 both reported as 13-1-5, matched by position
+    records = [{"devid": 13, "subdevid": 1, "chlid": 5, "n": 0}, {"devid": 13, "subdevid": 1, "chlid": 5, "n": 1}]
+    matched = match_records({"13-5-5": index["13-5-5"], "13-1-5": index["13-1-5"]}, records)
+    assert (matched["13-5-5"]["n"], matched["13-1-5"]["n"]) == (0, 1)
+
+    with pytest.raises(ValueError, match="requested channels"):
+        match_records(pipelines, records)
+
+
+def test_get_testid_does_not_modify_channel_map(mock_bts) -> None:
+    """Test get_testid returns new dictionaries instead of adding to the channel map."""
+    with NewareAPI() as nw:
+        res = nw.get_testid("21-1-1")
+        assert res["21-1-1"]["full_test_id"] == "21-1-1-143"
+        assert "test_id" not in nw.get_pipeline("21-1-1")
@@ -0,0 +1,115 @@
+"""Tests for chunking.py."""
+
+import time
+from collections import deque
+
+import pytest
+
+from aurora_neware import AdaptiveChunkSize, NewareAPI
+
+from .mocks import FakeSocket
+
+
+@pytest.fixture(autouse=True)
+def forget_sizes() -> None:
+    """Start each test without remembered chunk sizes."""
+    AdaptiveChunkSize.forget()
+
+
+def test_grow_and_shrink() -> None:
+    """Test the chunk size moves towards the target reply time within the bounds."""
+    sizer = AdaptiveChunkSize(initial=1000, min_size=500, max_size=5000, target_time=0.5)
+    assert sizer.update(1000, 100_000, 0.1) == 2000  # at most doubles
+    assert sizer.update(2000, 200_000, 0.4) == 2500
+    assert sizer.update(2500, 250_000, 0.1) == 5000
+    assert sizer.update(5000, 500_000, 0.1) == 5000  # capped at max_size
+    assert sizer.update(5000, 500_000, 5.0) == 2500  # at most halves
+    assert sizer.update(2500, 250_000, 5.0) == 1250
+    assert sizer.update(1250, 250_000, 5.0) == 625
+    assert sizer.update(625, 250_000, 5.0) == 500  # capped at min_size
+    assert sizer.bytes_per_second is not None
+    assert sizer.round_trip_time is not None
+
+    # A partial last chunk which is quick does not shrink the size
+    assert sizer.update(10, 1000, 0.01) == 500
+
+    with pytest.raises(ValueError):
+        AdaptiveChunkSize(min_size=100, max_size=10)
+
+
+def test_session_memory() -> None:
+    """Test the chunk size is remembered per server."""
+    sizer = AdaptiveChunkSize(server="10.0.0.1")
+    sizer.update(1000, 100_000, 0.1)
+    assert AdaptiveChunkSize(server="10.0.0.1").size == 2000
+    assert AdaptiveChunkSize(server="10.0.0.2").size == 1000
+    assert AdaptiveChunkSize().size == 1000
+    AdaptiveChunkSize.forget("10.0.0.1")
+    assert AdaptiveChunkSize(server="10.0.0.1").size == 1000
+
+
+def test_download_adaptive(mock_bts) -> None:
+    """Test downloading with an adaptive chunk size."""
+    with NewareAPI() as nw:
+        expect = nw.download("21-1-1", last_n_points=7000)
+        n_sent = len(nw.neware_socket.sent_data)
+        assert nw.download("21-1-1", last_n_points=7000, chunk_size="auto") == expect
+        counts = [
+            int(s.split('count="')[1].split('"')[0]) for s in nw.neware_socket.sent_data[n_sent:] if "startpos" in s
+        ]
+        assert counts[:3] == [1000, 2000, 4000]  # fake replies are fast, so the size grows
+        assert AdaptiveChunkSize(server=nw.ip).size > 1000
+
+        sizer = AdaptiveChunkSize(initial=500, max_size=500)
+        assert nw.download("21-1-1", last_n_points=7000, chunk_size=sizer, window=3) == expect
+
+        with pytest.raises(ValueError):
+            nw.download("21-1-1", chunk_size=0)
+
+
+class TimedSocket(FakeSocket):
+    """Fake socket on a simulated link, replies are sent in order after a latency at a fixed bandwidth."""
+
+    latency = 0.02
+    bandwidth = 1e6
+
+    def __init__(self) -> None:
+        """Start the simulated clock at 0."""
+        super().__init__()
+        self.clock = 0.0
+        self._replies: deque[list] = deque()  # [bytes left, time the reply is complete]
+
+    def sendall(self, data: bytes) -> None:
+        """Queue the reply, it starts arriving after the latency and after the previous reply."""
+        n_before = len(self._recv_buffer)
+        super().sendall(data)
+        n_bytes = len(self._recv_buffer) - n_before
+        previous_done = self._replies[-1][1] if self._replies else 0.0
+        done = max(self.clock + self.latency, previous_done) + n_bytes / self.bandwidth
+        self._replies.append([n_bytes, done])
+
+    def recv(self, bufsize: int) -> bytes:
+        """Receive from the first reply, moving the clock to when it is complete."""
+        reply = self._replies[0]
+        self.clock = max(self.clock, reply[1])
+        chunk = super().recv(min(bufsize, reply[0]))
+        reply[0] -= len(chunk)
+        if not reply[0]:
+            self._replies.popleft()
+        return chunk
+
+
+def test_adaptive_window(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the size converges the same with pipelined commands, time queued behind other replies is not counted."""
+    sizes = {}
+    socket = TimedSocket()
+    monkeypatch.setattr(time, "perf_counter", lambda: socket.clock)
+    with NewareAPI() as nw:
+        for window in (1, 4):
+            socket = nw.neware_socket = TimedSocket()
+            sizer = AdaptiveChunkSize(initial=1000, max_size=50000, target_time=0.5)
+            nw.download("21-1-1", last_n_points=100000, chunk_size=sizer, window=window)
+            sizes[window] = sizer.size
+    # About 0.5 s of the 1 MB/s link per chunk
+    assert 2000 < sizes[1] < 4000
+    assert abs(sizes[4] - sizes[1]) < 0.15 * sizes[1]
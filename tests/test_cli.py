@@ -1,11 +1,16 @@
 """Test CLI."""
 
+import csv
 import json
 from pathlib import Path
 
+import pytest
 from typer.testing import CliRunner
 
+from aurora_neware.cache import ChannelMapCache
 from aurora_neware.cli.main import app
+from aurora_neware.daemon import CLI_CHANNEL_MAP_TTL
+from aurora_neware.neware import NewareAPI
 
 runner = CliRunner()
 
@@ -68,6 +73,19 @@ def test_status(mock_bts) -> None:
     assert result.exit_code == 2
 
 
+def test_status_selectors(mock_bts) -> None:
+    """Test status with wildcards and filters."""
+    result = runner.invoke(app, ["status", "21-*-*", "state:finish"])
+    assert result.exit_code == 0
+    output = json.loads(result.stdout)
+    assert "21-1-1" in output
+    assert all(v["workstatus"] == "finish" for v in output.values())
+
+    result = runner.invoke(app, ["status", "21-1-1..2", "barcode:*_02"])
+    assert result.exit_code == 0
+    assert list(json.loads(result.stdout)) == ["21-1-2"]
+
+
 def test_get_num_datapoints(mock_bts) -> None:
     """Test get-num-datapoints CLI command."""
     result = runner.invoke(app, ["get-num-datapoints", "21-1-1"])
@@ -97,6 +115,58 @@ def test_get_data(mock_bts) -> None:
     )
 
 
+def test_get_data_selector(mock_bts) -> None:
+    """Test get-data needs a selector which matches exactly one pipeline."""
+    result = runner.invoke(app, ["get-data", "barcode:251203_kigr_gen17_01", "10"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["seqid"][-1] == 219585
+
+    result = runner.invoke(app, ["get-data", "21-1-*", "10"])
+    assert result.exit_code == 1
+    assert "must match exactly one" in result.stderr
+
+    result = runner.invoke(app, ["get-data", "barcode:nothing", "10"])
+    assert result.exit_code == 1
+    assert "no pipelines match" in result.stderr
+
+
+def test_get_data_formats(mock_bts, tmp_path: Path) -> None:
+    """Test get-data streams rows as NDJSON and CSV, to stdout or a file."""
+    expected = json.loads(runner.invoke(app, ["get-data", "21-1-1", "10"]).stdout)
+
+    result = runner.invoke(app, ["get-data", "21-1-1", "10", "--format", "ndjson"])
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [row["seqid"] for row in rows] == expected["seqid"]
+    assert rows[0] == {key: values[0] for key, values in expected.items()}
+
+    output = tmp_path / "data.csv"
+    result = runner.invoke(app, ["get-data", "21-1-1", "10", "--format", "csv", "--output", str(output)])
+    assert result.exit_code == 0
+    assert result.stdout == ""
+    with output.open(newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == list(expected)
+    assert [int(row["seqid"]) for row in rows] == expected["seqid"]
+
+    output = tmp_path / "data.json"
+    result = runner.invoke(app, ["get-data", "21-1-1", "10", "--output", str(output)])
+    assert json.loads(output.read_text()) == expected
+
+
+def test_export(mock_bts, tmp_path: Path) -> None:
+    """Test export CLI command."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    result = runner.invoke(app, ["export", "21-1-1", str(tmp_path / "data.parquet"), "--n-points", "10"])
+    assert result.exit_code == 0
+    assert pq.read_table(tmp_path / "data.parquet").num_rows == 10
+    result = runner.invoke(app, ["export", "21-1-1", str(tmp_path / "steps.feather"), "--kind", "steps"])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["export", "21-1-1", str(tmp_path / "data.csv")])
+    assert result.exit_code == 1
+    assert "Unknown file format" in result.stderr
+
+
 def test_start(mock_bts, tmp_path: Path) -> None:
     """Test start CLI command."""
     xml_file = tmp_path / "payload.xml"
@@ -134,6 +204,9 @@ def test_stop(mock_bts) -> None:
     assert result.exit_code == 1
     assert "could not stop job" in result.stderr
 
+    result = runner.invoke(app, ["stop", "21-1-1..2"])
+    assert result.exit_code == 0
+
 
 def test_clear_flag(mock_bts) -> None:
     """Test clear-flag CLI command."""
@@ -163,6 +236,11 @@ def test_get_job_id(mock_bts) -> None:
     output = json.loads(result.stdout)
     assert output == {"21-1-1": "21-1-1-143"}
 
+    result = runner.invoke(app, ["get-job-id", "21-*-*", "barcode:251203_kigr_gen17_01"])
+    assert result.exit_code == 0
+    output = json.loads(result.stdout)
+    assert output == {"21-1-1": 143}
+
 
 def test_log(mock_bts) -> None:
     """Test the log CLI command."""
@@ -176,3 +254,18 @@ def test_log(mock_bts) -> None:
         {"seqid": 139026, "log_code": 100007, "atime": "2025-12-19 16:36:20"},
         {"seqid": 219585, "log_code": 100001, "atime": "2025-12-28 22:30:11"},
     ]
+
+
+def test_refresh_channel_map(mock_bts) -> None:
+    """Test --refresh fetches the channel map instead of using the cached one."""
+    with NewareAPI() as nw:
+        stale = {"21-1-1": nw.channel_map["21-1-1"]}
+    ChannelMapCache(ttl=CLI_CHANNEL_MAP_TTL).put("127.0.0.1", 502, stale)
+    result = runner.invoke(app, ["get-job-id"])
+    assert result.exit_code == 0
+    assert list(json.loads(result.stdout)) == ["21-1-1"]
+    result = runner.invoke(app, ["--refresh", "get-job-id"])
+    assert result.exit_code == 0
+    assert len(json.loads(result.stdout)) == 16
+    result = runner.invoke(app, ["get-job-id"])
+    assert len(json.loads(result.stdout)) == 16
@@ -0,0 +1,96 @@
+"""Tests for columns.py."""
+
+import array
+import math
+import sys
+
+import pytest
+
+from aurora_neware import DataColumns, NewareAPI
+from aurora_neware import columns as columns_module
+from aurora_neware.columns import MISSING_INT
+
+from .mocks import _download_21_1_1_repsonse
+
+
+def test_download_columnar(mock_bts) -> None:
+    """Test columnar download gives the same data as the dictionary of lists."""
+    with NewareAPI() as nw:
+        expect = nw.download("21-1-1", last_n_points=10)
+        res = nw.download("21-1-1", last_n_points=10, columnar=True)
+        assert isinstance(res, DataColumns)
+        assert len(res) == 10
+        assert res.to_dict() == expect
+        assert all(type(v) is float for v in res.to_dict()["testtime"])
+
+        res = nw.download("21-1-1", last_n_points=2500, columnar=True)
+        assert len(res) == 2500
+        assert res.to_dict()["seqid"] == list(range(217086, 219586))
+
+
+def test_append_xml() -> None:
+    """Test parsing a reply straight into columns."""
+    cols = DataColumns()
+    assert cols.append_xml(_download_21_1_1_repsonse.decode()) == 10
+    assert cols.append_xml(_download_21_1_1_repsonse.decode()) == 10
+    assert len(cols) == 20
+    assert cols.keys() == ["seqid", "stepid", "cycleid", "steptype", "testtime", "atime", "volt", "curr", "cap", "eng"]
+    assert cols.to_dict()["atime"][0] == "2025-12-28 22:29:05"
+    assert cols.nbytes == 20 * 9 * 8
+
+
+def test_missing_and_extra_fields() -> None:
+    """Test missing values and fields outside of the schema."""
+    xml = (
+        '<bts version="1.0"><list count="2">'
+        '<data seqid="1" stepid="--" volt="--" steptype="rest" atime="--" />'
+        '<data seqid="2" stepid="1" volt="3.1" steptype="cc" aux="0.5" />'
+        "</list></bts>"
+    )
+    cols = DataColumns()
+    cols.append_xml(xml)
+    res = cols.to_dict()
+    assert res["stepid"] == [MISSING_INT, 1]
+    assert math.isnan(res["volt"][0])
+    assert res["volt"][1] == 3.1
+    assert res["atime"] == [None, None]
+    assert res["steptype"] == ["rest", "cc"]
+    assert res["aux"] == [None, 0.5]
+
+    other = DataColumns()
+    other.append_xml(_download_21_1_1_repsonse.decode())
+    cols.extend(other)
+    assert len(cols) == 12
+    assert cols.to_dict()["aux"] == [None, 0.5] + [None] * 10
+
+
+def test_numpy_columns() -> None:
+    """Test columns are NumPy arrays when NumPy is installed."""
+    np = pytest.importorskip("numpy")
+    cols = DataColumns()
+    cols.append_xml(_download_21_1_1_repsonse.decode())
+    volt = cols["volt"]
+    assert isinstance(volt, np.ndarray)
+    assert volt.dtype == np.float64
+    assert volt[0] == 3.6780698299408
+    assert cols["seqid"].dtype == np.int64
+    assert str(cols["atime"][0]) == "2025-12-28T22:29:05"
+
+
+def test_without_numpy(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test columns are arrays when NumPy is not installed."""
+    monkeypatch.setattr(columns_module, "np", None)
+    cols = DataColumns()
+    cols.append_xml(_download_21_1_1_repsonse.decode())
+    assert isinstance(cols["volt"], array.array)
+    assert isinstance(cols["steptype"], list)
+
+
+def test_memory_per_point() -> None:
+    """Test columns use much less memory per point than dictionaries."""
+    cols = DataColumns()
+    cols.append_xml(_download_21_1_1_repsonse.decode())
+    records = [dict(zip(cols.to_dict(), values, strict=True)) for values in zip(*cols.to_dict().values(), strict=True)]
+    record_bytes = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r.values()) for r in records)
+    column_bytes = cols.nbytes + 8 * len(cols)  # plus pointers to shared strings in steptype
+    assert record_bytes / column_bytes > 5
@@ -0,0 +1,163 @@
+"""Tests for daemon.py."""
+
+import json
+import socket
+import threading
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from aurora_neware import daemon
+from aurora_neware.cli.main import app
+from aurora_neware.daemon import DaemonClient, NewareDaemon, connect_api, daemon_path, daemon_running
+
+from .mocks import FakeSocket
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def neware_daemon() -> Iterator[NewareDaemon]:
+    """Run a daemon connected to a FakeSocket in a background thread."""
+    nd = NewareDaemon()
+    nd.nw.neware_socket = FakeSocket()
+    with nd:
+        thread = threading.Thread(target=nd.serve_forever, daemon=True)
+        thread.start()
+        yield nd
+    thread.join()
+
+
+def test_daemon_client(neware_daemon: NewareDaemon) -> None:
+    """Test commands through the daemon give the same result as NewareAPI."""
+    assert daemon_running(daemon_path())
+    nw = neware_daemon.nw
+    with DaemonClient() as client:
+        assert client.inquire() == nw.inquire()
+        assert client.inquiredf("21-1-1") == nw.inquiredf("21-1-1")
+        assert client.download("21-1-1", 10) == nw.download("21-1-1", 10)
+        assert client.call("getchlstatus", pipeline_ids="21-1-1") == nw.getchlstatus("21-1-1")
+        with pytest.raises(KeyError, match="not in channel map"):
+            client.inquire("99-9-9")
+        with pytest.raises(ValueError, match="cannot be called"):
+            client.call("command", "<cmd>getdevinfo</cmd>")
+        with pytest.raises(AttributeError):
+            client.command  # noqa: B018
+    # The connect handshake and getdevinfo are only sent once
+    sent = nw.neware_socket.sent_data
+    assert sum("<cmd>connect</cmd>" in s for s in sent) == 1
+    assert sum("<cmd>getdevinfo</cmd>" in s for s in sent) == 1
+
+
+def test_daemon_iter_download(neware_daemon: NewareDaemon) -> None:
+    """Test downloading chunk by chunk through the daemon."""
+    nw = neware_daemon.nw
+    with DaemonClient() as client:
+        chunks = list(client.iter_download("21-1-1", start=-10, chunk_size=4))
+        assert [len(chunk["seqid"]) for chunk in chunks] == [4, 4, 2]
+        assert chunks == list(nw.iter_download("21-1-1", start=-10, chunk_size=4))
+        # Stopping early does not leave the rest of the reply on the connection
+        for _ in client.iter_download("21-1-1", start=-10, chunk_size=4):
+            break
+        assert client.inquire("21-1-1") == nw.inquire("21-1-1")
+        with pytest.raises(KeyError, match="not in channel map"):
+            list(client.iter_download("99-9-9"))
+        assert client.inquire("21-1-1") == nw.inquire("21-1-1")
+
+
+def test_daemon_shutdown(neware_daemon: NewareDaemon) -> None:
+    """Test the socket is removed on shutdown and a second daemon cannot start."""
+    with pytest.raises(RuntimeError, match="already running"):
+        NewareDaemon().start()
+    neware_daemon.shutdown()
+    assert not daemon_running(daemon_path())
+    assert not daemon_path().exists()
+
+
+def test_connect_api(neware_daemon: NewareDaemon) -> None:
+    """Test connect_api uses the daemon if it is running."""
+    with connect_api() as nw:
+        assert isinstance(nw, DaemonClient)
+
+
+def test_connect_api_fallback(mock_bts) -> None:
+    """Test connect_api falls back to a direct connection."""
+    with connect_api() as nw:
+        assert not isinstance(nw, DaemonClient)
+        assert len(nw.channel_map) == 16
+
+
+def test_stale_socket(cache_dir: Path) -> None:
+    """Test a socket file left behind by a stopped daemon is not mistaken for a running daemon."""
+    cache_dir.mkdir()
+    daemon_path().touch()
+    assert not daemon_running(daemon_path())
+
+
+def test_cli_through_daemon(neware_daemon: NewareDaemon) -> None:
+    """Test CLI commands use the daemon."""
+    result = runner.invoke(app, ["status", "21-1-1"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == neware_daemon.nw.inquire("21-1-1")
+    result = runner.invoke(app, ["get-data", "21-1-1", "10"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["seqid"] == list(range(219576, 219586))
+
+
+def test_daemon_columnar(neware_daemon: NewareDaemon) -> None:
+    """Test columnar downloads through the daemon give dictionaries of lists."""
+    with DaemonClient() as client:
+        assert client.download("21-1-1", 10, columnar=True) == neware_daemon.nw.download("21-1-1", 10)
+
+
+def test_daemon_datetimes(neware_daemon: NewareDaemon) -> None:
+    """Test datetimes are sent to the daemon as datetimes."""
+    nw = neware_daemon.nw
+    since, until = datetime(2025, 12, 5, 1, 2, 3), datetime(2025, 12, 5, 1, 2, 13)
+    with DaemonClient() as client:
+        assert client.download("21-1-1", since=since, until=until) == nw.download("21-1-1", since=since, until=until)
+        aware = since.astimezone()
+        assert client.download("21-1-1", since=aware, until=until) == nw.download("21-1-1", since=aware, until=until)
+
+
+def test_daemon_keeps_connection(neware_daemon: NewareDaemon, tmp_path: Path) -> None:
+    """Test errors which are not about the connection do not reconnect to the BTS server."""
+    nw = neware_daemon.nw
+    with DaemonClient() as client:
+        with pytest.raises(FileNotFoundError):
+            client.start("21-1-1", "mysample", str(tmp_path / "missing.xml"))
+        assert neware_daemon.nw is nw
+        assert client.inquire("21-1-1") == nw.inquire("21-1-1")
+
+
+def test_daemon_refresh(neware_daemon: NewareDaemon) -> None:
+    """Test connect_api can make the daemon fetch the channel map again."""
+    nw = neware_daemon.nw
+    with connect_api(refresh_channel_map=True) as client:
+        assert isinstance(client, DaemonClient)
+        assert client.inquire("21-1-1") == nw.inquire("21-1-1")
+    assert sum("<cmd>getdevinfo</cmd>" in s for s in nw.neware_socket.sent_data) == 2
+
+
+def test_daemon_tcp_token(cache_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test a daemon on a TCP port only answers requests with its token."""
+    monkeypatch.setattr(daemon, "_HAS_UNIX_SOCKETS", False)
+    nd = NewareDaemon()
+    nd.nw.neware_socket = FakeSocket()
+    with nd:
+        thread = threading.Thread(target=nd.serve_forever, daemon=True)
+        thread.start()
+        token_path = daemon_path().with_name(daemon_path().name + ".token")
+        assert token_path.stat().st_mode & 0o077 == 0
+        with DaemonClient() as client:
+            assert client.inquire("21-1-1") == nd.nw.inquire("21-1-1")
+        with socket.create_connection(("127.0.0.1", int(daemon_path().read_text()))) as sock:
+            sock.sendall(json.dumps({"method": "inquire", "args": ["21-1-1"]}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                assert json.loads(f.readline())["error"] == "PermissionError"
+                assert f.readline() == b""
+    thread.join()
+    assert not token_path.exists()
@@ -0,0 +1,113 @@
+"""Tests for export.py."""
+
+import csv
+import io
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from aurora_neware import NewareAPI
+from aurora_neware import export as export_module
+from aurora_neware.export import ColumnarWriter, export_test, iter_rows, write_csv, write_ndjson
+
+CHUNKS = [
+    {"seqid": [1, 2], "volt": [3.5, 3.6], "atime": ["2025-01-01 00:00:00", "2025-01-01 00:00:01"]},
+    {"seqid": [3], "volt": [3.7], "atime": ["2025-01-01 00:00:02"]},
+]
+
+
+def test_iter_rows() -> None:
+    """Test turning columns into rows."""
+    assert list(iter_rows(CHUNKS[1])) == [{"seqid": 3, "volt": 3.7, "atime": "2025-01-01 00:00:02"}]
+    assert list(iter_rows({})) == []
+
+
+def test_write_ndjson() -> None:
+    """Test writing one JSON object per line."""
+    file = io.StringIO()
+    assert write_ndjson(CHUNKS, file) == 3
+    rows = [json.loads(line) for line in file.getvalue().splitlines()]
+    assert [row["seqid"] for row in rows] == [1, 2, 3]
+    assert rows[2] == {"seqid": 3, "volt": 3.7, "atime": "2025-01-01 00:00:02"}
+
+
+def test_write_csv() -> None:
+    """Test writing CSV with one header."""
+    file = io.StringIO(newline="")
+    assert write_csv(iter(CHUNKS), file) == 3
+    lines = file.getvalue().splitlines()
+    assert lines[0] == "seqid,volt,atime"
+    assert lines[3] == "3,3.7,2025-01-01 00:00:02"
+    assert len(list(csv.DictReader(io.StringIO(file.getvalue())))) == 3
+    empty = io.StringIO()
+    assert write_csv([], empty) == 0
+    assert empty.getvalue() == ""
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".feather"])
+def test_export_data(mock_bts, tmp_path: Path, suffix: str) -> None:
+    """Test exporting data chunk by chunk to a typed columnar file with the test ID."""
+    pa = pytest.importorskip("pyarrow")
+    path = tmp_path / f"data{suffix}"
+    with NewareAPI() as nw:
+        assert nw.export("21-1-1", path, last_n_points=10) == 10
+        expected = nw.download("21-1-1", 10)
+    if suffix == ".parquet":
+        table = pytest.importorskip("pyarrow.parquet").read_table(path)
+    else:
+        table = pytest.importorskip("pyarrow.feather").read_table(path)
+    assert table.schema.metadata[b"full_test_id"] == b"21-1-1-143"
+    assert table.schema.metadata[b"kind"] == b"data"
+    assert table.column("seqid").to_pylist() == expected["seqid"]
+    assert table.column("volt").to_pylist() == expected["volt"]
+    assert table.schema.field("cycleid").type == pa.int64()
+    assert pa.types.is_timestamp(table.schema.field("atime").type)
+    assert table.column("atime")[0].as_py() == datetime.fromisoformat(expected["atime"][0])
+
+
+def test_export_steps_and_log(mock_bts, tmp_path: Path) -> None:
+    """Test exporting the step layer and log."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    with NewareAPI() as nw:
+        assert nw.export("21-1-1", tmp_path / "steps.parquet", "steps") == 3
+        assert nw.export("21-1-1", tmp_path / "log.parquet", "log") == 5
+        steps = nw.get_steps("21-1-1")
+        with pytest.raises(ValueError, match="Unknown export kind"):
+            nw.export("21-1-1", tmp_path / "x.parquet", "everything")
+        with pytest.raises(ValueError, match="Unknown file format"):
+            nw.export("21-1-1", tmp_path / "x.json")
+    table = pq.read_table(tmp_path / "steps.parquet")
+    assert table.column("steptype").to_pylist() == [step["steptype"] for step in steps]
+    assert table.column("startcurr").to_pylist() == [float(step["startcurr"]) for step in steps]
+    assert pq.read_table(tmp_path / "log.parquet").schema.metadata[b"full_test_id"] == b"21-1-1-143"
+
+
+def test_columnar_writer_types(tmp_path: Path) -> None:
+    """Test later chunks are written with the types of the first, and an empty file has the schema."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    with ColumnarWriter(tmp_path / "a.parquet", schema={"seqid": "q"}) as writer:
+        writer.write({"seqid": [1, None], "extra": [1.5, 2]})
+        writer.write({"seqid": [3]})
+    table = pq.read_table(tmp_path / "a.parquet")
+    assert table.column("seqid").to_pylist() == [1, None, 3]
+    assert table.column("extra").to_pylist() == [1.5, 2.0, None]
+    with ColumnarWriter(tmp_path / "b.parquet", schema={"seqid": "q"}):
+        pass
+    assert pq.read_table(tmp_path / "b.parquet").num_rows == 0
+
+
+def test_without_pyarrow(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    """Test a clear error if pyarrow is not installed."""
+    monkeypatch.setattr(export_module, "pa", None)
+    with pytest.raises(ImportError, match="aurora-neware\\[arrow\\]"):
+        ColumnarWriter(tmp_path / "data.parquet")
+
+    class NoCommands:
+        def __getattr__(self, name: str) -> None:
+            msg = f"{name} should not be called without pyarrow"
+            raise AssertionError(msg)
+
+    with pytest.raises(ImportError, match="aurora-neware\\[arrow\\]"):
+        export_test(NoCommands(), "21-1-1", tmp_path / "data.parquet")
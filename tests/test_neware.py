@@ -1,18 +1,29 @@
 """Tests for neware.py."""
 
+import bisect
+import itertools
+import math
+import re
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Any
+from xml.etree.ElementTree import ParseError
 
 import pytest
 
-from aurora_neware import NewareAPI
-from aurora_neware.neware import _lod_to_dol
+from aurora_neware import ChannelIndex, NewareAPI
+from aurora_neware.neware import _build_download, _lod_to_dol
+
+from . import mocks
+from .mocks import FakeSocket, _inquiredf_21_1_1_response
 
 
 def test_init(mock_bts) -> None:
     """Test API object initialisation."""
     with NewareAPI() as nw:
         assert nw.termination == "\n\n#\r\n"
-        assert isinstance(nw.channel_map, dict)
+        assert isinstance(nw.channel_map, ChannelIndex)
         assert len(nw.channel_map) == 16
 
 
@@ -168,6 +179,11 @@ def test_stop(mock_bts) -> None:
         assert res == [{"ip": "127.0.0.1", "devtype": 27, "devid": 21, "subdevid": 1, "chlid": 1, "stop": "ok"}]
         nw.stop(["21-1-1", "21-1-2"])
         assert res == [{"ip": "127.0.0.1", "devtype": 27, "devid": 21, "subdevid": 1, "chlid": 1, "stop": "ok"}]
+        # A pipeline ID with a missing part does not stop every channel
+        n_sent = len(nw.neware_socket.sent_data)
+        with pytest.raises(KeyError):
+            nw.stop("21-1")
+        assert len(nw.neware_socket.sent_data) == n_sent
 
 
 def test_downloadlog(mock_bts) -> None:
@@ -297,6 +313,218 @@ def test_get_test_id(mock_bts) -> None:
         assert res["21-1-1"]["full_test_id"] == "21-1-1-143"
 
 
+def test_get_testid_batched(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test test IDs come from one inquiredf, with downloads only for pipelines without a test ID."""
+    with NewareAPI() as nw:
+        n_sent = len(nw.neware_socket.sent_data)
+        res = nw.get_testid()
+        sent = nw.neware_socket.sent_data[n_sent:]
+        assert len(sent) == 1
+        assert "<cmd>inquiredf</cmd>" in sent[0]
+        assert res["21-1-2"]["full_test_id"] == "21-1-2-144"
+        assert res["21-2-8"]["full_test_id"] == "21-2-8-109"
+
+        monkeypatch.setitem(
+            FakeSocket._response_map,
+            '<cmd>inquiredf</cmd><list count = "1">',
+            _inquiredf_21_1_1_response.replace(b'testid="143"', b'testid="0"'),
+        )
+        n_sent = len(nw.neware_socket.sent_data)
+        res = nw.get_testid("21-1-1")
+        sent = nw.neware_socket.sent_data[n_sent:]
+        assert len(sent) == 2
+        assert 'startpos="0" count="0"' in sent[1]
+        assert res["21-1-1"]["full_test_id"] == "21-1-1-143"
+
+
+def test_pipelined_commands(mock_bts) -> None:
+    """Test pipelined commands give the replies in order, also when stopping early."""
+    with NewareAPI() as nw:
+        pips = [nw.get_pipeline(p) for p in ("21-1-1", "21-1-2", "21-2-8")]
+        cmds = [_build_download(pip.address_no_ip, 0, 0) for pip in pips]
+        replies = list(nw._pipelined_commands(cmds, window=2))
+        assert ['chlid="1"' in replies[0], 'chlid="2"' in replies[1], 'chlid="8"' in replies[2]] == [True] * 3
+        for _reply in nw._pipelined_commands(cmds, window=2):
+            break
+        assert nw.inquiredf("21-1-1")["21-1-1"]["testid"] == 143
+
+
+def test_prerendered_commands(mock_bts) -> None:
+    """Test commands for the whole channel map are rendered once, and match per-pipeline commands."""
+    with NewareAPI() as nw:
+        nw.inquire()
+        nw.inquire()
+        sent = nw.neware_socket.sent_data
+        assert sent[-1] == sent[-2]
+        assert len(nw._full_map_commands) == 1
+        assert sent[-1].count("<inquire ") == 16
+
+        nw.inquire(list(nw.channel_map))
+        assert sent[-1] == sent[-2]
+
+        # Setting a new channel map renders it again
+        nw.channel_map = {"21-1-1": nw.get_pipeline("21-1-1")}
+        assert nw._full_map_commands == {}
+        nw.inquire()
+        assert sent[-1].count("<inquire ") == 1
+
+
+def test_download_cycles_and_steps(mock_bts) -> None:
+    """Test downloading cycles and steps only requests the points of those steps."""
+    with NewareAPI() as nw:
+        n_sent = len(nw.neware_socket.sent_data)
+        data = nw.download("21-1-1", cycles=1)
+        assert data["seqid"] == list(range(1, 7928))
+        data = nw.download("21-1-1", steps=(2, 3), columnar=True)
+        assert list(data["seqid"]) == list(range(4322, 7928))
+        sent = nw.neware_socket.sent_data[n_sent:]
+        # The last request of a range stops at the end of the range
+        assert 'startpos="7322" count="606"' in sent[-1]
+        assert sum("<cmd>download</cmd>" in s for s in sent) == 8 + 4
+        assert nw.download("21-1-1", cycles=2) == {}
+        with pytest.raises(ValueError, match="start"):
+            next(nw.iter_download("21-1-1", start=10, cycles=1))
+
+
+def _step_layer_time(seqid: int) -> datetime:
+    """Time of a data point of 21-1-1, interpolated between the step ends in the step layer."""
+    anchors = [
+        (0, datetime(2025, 12, 3, 16, 44, 2)),
+        (4321, datetime(2025, 12, 4, 4, 44, 2)),
+        (7518, datetime(2025, 12, 4, 13, 34, 1)),
+        (7927, datetime(2025, 12, 4, 14, 39, 33)),
+    ]
+    for (lo, lo_time), (hi, hi_time) in itertools.pairwise(anchors):
+        if seqid <= hi:
+            return lo_time + (hi_time - lo_time) * (seqid - lo) // (hi - lo)
+    # The step after the step layer, with a point every 10 seconds
+    return anchors[-1][1] + timedelta(seconds=10 * (seqid - anchors[-1][0]))
+
+
+def test_download_time_window(mock_bts) -> None:
+    """Test downloading the points between two times, with few extra points transferred."""
+    with NewareAPI() as nw:
+        nw.neware_socket.atime = lambda seqid: str(_step_layer_time(seqid))
+        seqids = range(1, 219586)
+
+        for since, until in [
+            (datetime(2025, 12, 4, 3, 0, 0), datetime(2025, 12, 4, 14, 0, 0)),
+            (datetime(2025, 12, 29, 1, 0, 0), None),
+            (datetime(2025, 12, 5, 1, 2, 3), datetime(2025, 12, 5, 1, 2, 13)),
+        ]:
+            first = bisect.bisect_left(seqids, since, key=_step_layer_time)
+            last = bisect.bisect_right(seqids, until, key=_step_layer_time) if until else len(seqids)
+            expected = list(seqids[first:last])
+            n_sent = len(nw.neware_socket.sent_data)
+            data = nw.download("21-1-1", since=since, until=until)
+            assert data["seqid"] == expected
+            # The data is downloaded after the probes, which transfer few points
+            counts = [int(m) for m in re.findall(r'count="(\d+)"', "".join(nw.neware_socket.sent_data[n_sent:]))]
+            probes = counts[: -math.ceil(len(expected) / 1000)]
+            assert len(probes) < 40
+            assert sum(probes) < 200
+
+        # Naive times are the cycler's local time, aware times are converted
+        aware = datetime(2025, 12, 4, 3, 0, 0).astimezone()
+        data = nw.download("21-1-1", since=aware, until=aware + timedelta(minutes=1))
+        assert _step_layer_time(data["seqid"][0]) >= datetime(2025, 12, 4, 3, 0, 0)
+        assert _step_layer_time(data["seqid"][0] - 1) < datetime(2025, 12, 4, 3, 0, 0)
+        assert nw.download("21-1-1", since=datetime(2026, 1, 1)) == {}
+        assert nw.download("21-1-1", until=datetime(2025, 1, 1)) == {}
+        with pytest.raises(ValueError, match="combined"):
+            nw.download("21-1-1", cycles=1, since=datetime(2025, 1, 1))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_download_verify(mock_bts, monkeypatch: pytest.MonkeyPatch, columnar: bool) -> None:
+    """Test a short chunk is detected and only the missing points are downloaded again."""
+    synthetic = mocks._download_synthetic_response
+    short = {2001: 500, 5001: 0}
+
+    def short_once(subdevid: int, chlid: int, startpos: int, count: int, **kwargs: Any) -> bytes:  # noqa: ANN401
+        """Give fewer points than requested the first time some chunks are requested."""
+        return synthetic(subdevid, chlid, startpos, short.pop(startpos, count), **kwargs)
+
+    monkeypatch.setattr(mocks, "_download_synthetic_response", short_once)
+    with NewareAPI() as nw:
+        data = nw.download("21-1-1", cycles=1, columnar=columnar)
+        assert list(data["seqid"]) == list(range(1, 7928))
+        short.update({2001: 500, 5001: 0})
+        n_sent = len(nw.neware_socket.sent_data)
+        data = nw.download("21-1-1", cycles=1, columnar=columnar, verify=True, window=3)
+        assert list(data["seqid"]) == list(range(1, 7928))
+        sent = "".join(nw.neware_socket.sent_data[n_sent:])
+        assert 'startpos="2501"' in sent
+        assert 'startpos="5001"' in sent
+        # Only the missing points and the chunks in flight are downloaded again
+        assert sent.count("<cmd>download</cmd>") < 8 + 2 * 3
+
+        # Points which never arrive raise an error
+        monkeypatch.setattr(mocks, "_download_synthetic_response", lambda *args, **_kwargs: synthetic(*args[:3], 0))
+        with pytest.raises(ValueError, match="missing"):
+            nw.download("21-1-1", cycles=1, columnar=columnar, verify=True)
+        with pytest.raises(ValueError, match="missing"):
+            nw.download("21-1-1", cycles=1, columnar=columnar)
+
+
+@pytest.mark.parametrize("window", [1, 3])
+def test_download_short_chunks(mock_bts, monkeypatch: pytest.MonkeyPatch, window: int) -> None:
+    """Test short chunks leave no holes without verify, e.g. when the server caps the chunk size."""
+    synthetic = mocks._download_synthetic_response
+
+    def capped(subdevid: int, chlid: int, startpos: int, count: int, **kwargs: Any) -> bytes:  # noqa: ANN401
+        """Give at most 300 points per chunk."""
+        return synthetic(subdevid, chlid, startpos, min(count, 300), **kwargs)
+
+    with NewareAPI() as nw:
+        expect = nw.download("21-1-1", last_n_points=2500)
+        monkeypatch.setattr(mocks, "_download_synthetic_response", capped)
+        assert nw.download("21-1-1", last_n_points=2500, window=window) == expect
+        assert len(nw.inquire()) == 16
+
+
+def test_download_parallel(mock_bts) -> None:
+    """Test splitting a download over several connections gives the same result."""
+    with NewareAPI() as nw:
+        expected = nw.download("21-1-1", last_n_points=5000)
+        assert nw.download("21-1-1", last_n_points=5000, parallelism=3) == expected
+        columns = nw.download("21-1-1", last_n_points=5000, parallelism=4, columnar=True, verify=True)
+        assert list(columns["seqid"]) == expected["seqid"]
+        # Chunks are yielded in order, not one chunk per span
+        chunks = list(nw.iter_download("21-1-1", cycles=1, chunk_size=1000, parallelism=3))
+        assert all(len(chunk["seqid"]) <= 1000 for chunk in chunks)
+        assert [seqid for chunk in chunks for seqid in chunk["seqid"]] == list(range(1, 7928))
+        # Stopping early stops the other spans
+        for _chunk in nw.iter_download("21-1-1", cycles=1, chunk_size=100, parallelism=3):
+            break
+        assert len(nw.inquire()) == 16
+        assert nw.download("21-1-1", cycles=2, parallelism=3) == {}
+
+
+def test_download_parallel_bounded(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test spans of a parallel download only get a few chunks ahead, and errors are raised."""
+    synthetic = mocks._download_synthetic_response
+    requested: list[int] = []
+
+    def counted(subdevid: int, chlid: int, startpos: int, count: int, **kwargs: Any) -> bytes:  # noqa: ANN401
+        """Count the chunks requested, fail on one."""
+        requested.append(startpos)
+        if startpos == 5044:
+            msg = "Connection lost"
+            raise ConnectionError(msg)
+        return synthetic(subdevid, chlid, startpos, count, **kwargs)
+
+    monkeypatch.setattr(mocks, "_download_synthetic_response", counted)
+    with NewareAPI() as nw:
+        chunks = nw.iter_download("21-1-1", cycles=1, chunk_size=100, parallelism=3)
+        next(chunks)
+        time.sleep(0.5)
+        # About 27 chunks per span, each span gets at most the queue size and one more ahead
+        assert len(requested) < 3 * 8
+        with pytest.raises(ConnectionError, match="Connection lost"):
+            list(chunks)
+
+
 def test_get_steps(mock_bts) -> None:
     """Test get_steps function."""
     with NewareAPI() as nw:
@@ -363,3 +591,96 @@ def test_lod_to_dol() -> None:
 
     with pytest.raises(KeyError):
         _lod_to_dol([{"a": 1, "b": 2}, {"b": 2}])
+
+
+def test_command_small_recv_size(mock_bts) -> None:
+    """Test replies larger than the receive size, with multi-byte characters split across reads."""
+    with NewareAPI(recv_size=7) as nw:
+        nw.neware_socket._response_map = {
+            **nw.neware_socket._response_map,
+            "<cmd>hello</cmd>": "<reply>grüß dich, µA</reply>".encode(),
+        }
+        assert nw.command("<cmd>hello</cmd>") == "<reply>grüß dich, µA</reply>"
+        assert len(nw.inquire()) == 16
+
+
+def test_command_connection_closed(mock_bts) -> None:
+    """Test a reply which never terminates."""
+    with NewareAPI() as nw:
+        nw.neware_socket._recv_buffer += b"<bts>half a reply"
+        with pytest.raises(ConnectionError):
+            nw._read_reply()
+
+
+def test_iter_download(mock_bts) -> None:
+    """Test downloading data chunk by chunk."""
+    with NewareAPI() as nw:
+        chunks = list(nw.iter_download("21-1-1", start=-2500, chunk_size=1000))
+        assert [len(chunk["seqid"]) for chunk in chunks] == [1000, 1000, 500]
+        seqids = [s for chunk in chunks for s in chunk["seqid"]]
+        assert seqids == list(range(217086, 219586))
+
+        chunks = list(nw.iter_download("21-1-1", start=219580, chunk_size=1000))
+        assert chunks[0]["seqid"] == [219581, 219582, 219583, 219584, 219585]
+
+        assert list(nw.iter_download("21-1-1", start=219585)) == []
+
+        chunks = list(nw.iter_download("21-1-1", start=-2500, chunk_size=5000))
+        assert len(chunks) == 1
+        assert len(chunks[0]["seqid"]) == 2500
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_incremental_parse(mock_bts, columnar: bool) -> None:
+    """Test parsing download and downloadlog replies while they are received gives the same results."""
+    with NewareAPI(incremental_parse=False) as nw:
+        expect_log = nw.downloadlog("21-1-1")
+        expect = nw.download("21-1-1", last_n_points=2500, columnar=columnar, chunk_size=2000)
+    with NewareAPI(recv_size=1000, incremental_parse=True) as nw:
+        assert nw.downloadlog("21-1-1") == expect_log
+        res = nw.download("21-1-1", last_n_points=2500, columnar=columnar, chunk_size=2000, window=2)
+        if columnar:
+            assert res.to_dict() == expect.to_dict()
+        else:
+            assert res == expect
+        assert len(nw.inquire()) == 16
+
+
+def test_records_before_termination(mock_bts) -> None:
+    """Test records are yielded while the rest of the reply is still being received."""
+    with NewareAPI(recv_size=4096) as nw:
+        nw._send(_build_download(nw._address_of("21-1-1", ip=False), 1, 1000))
+        reader = nw._iter_reply_records("download")
+        first = next(reader)
+        assert first[0]["seqid"] == 1
+        assert len(first) < 1000
+        assert nw.neware_socket._recv_buffer  # Not all received yet
+        n_points = len(first) + sum(len(records) for records in reader)
+        assert n_points == 1000
+        assert not nw.neware_socket._recv_buffer
+
+        # Stopping early, or a reply which cannot be parsed, leaves the socket in sync
+        nw._send(_build_download(nw._address_of("21-1-1", ip=False), 1, 1000))
+        reader = nw._iter_reply_records("download")
+        next(reader)
+        reader.close()
+        nw.neware_socket._recv_buffer += b"<bts><list><a></b></list></bts>\n\n#\r\n"
+        with pytest.raises(ParseError):
+            nw._read_records()
+        assert len(nw.inquire()) == 16
+
+
+def test_download_pipelined(mock_bts) -> None:
+    """Test keeping several download commands in flight."""
+    with NewareAPI() as nw:
+        expect = nw.download("21-1-1", last_n_points=4500)
+        assert nw.download("21-1-1", last_n_points=4500, window=3) == expect
+        assert nw.download("21-1-1", last_n_points=4500, window=10) == expect
+        assert nw.download("21-1-1", last_n_points=10, window=4) == nw.download("21-1-1", last_n_points=10)
+
+        # Stopping early reads the replies still in flight
+        chunks = nw.iter_download("21-1-1", start=-4500, window=3)
+        assert next(chunks)["seqid"][0] == 215086
+        chunks.close()
+        assert not nw.neware_socket._recv_buffer
+        assert len(nw.inquire()) == 16
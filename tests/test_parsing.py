@@ -0,0 +1,183 @@
+"""Tests for parsing.py."""
+
+import re
+
+import pytest
+from defusedxml import EntitiesForbidden
+
+from aurora_neware.neware import _xml_to_records
+from aurora_neware.parsing import RecordStream, fast_records, generic_records, scan_table
+from aurora_neware.schema import REPLY_SCHEMAS
+
+from .mocks import FakeSocket, _download_synthetic_response
+
+
+@pytest.mark.parametrize("pattern", list(FakeSocket._response_map))
+def test_fast_matches_generic(pattern: str) -> None:
+    """Test the fast parser gives the same records as the generic parser for captured replies."""
+    xml_string = FakeSocket._response_map[pattern].decode()
+    list_name = "middle" if "getdevinfo" in pattern else "list"
+    command = re.match(r"<cmd>(\w+)</cmd>", pattern).group(1)
+    try:
+        expected = generic_records(xml_string, list_name, command)
+    except TypeError:  # No list in this reply
+        assert fast_records(xml_string, list_name, command) is None
+        return
+    records = fast_records(xml_string, list_name, command)
+    assert records is None or records == expected
+
+
+def _stream_records(xml_string: str, list_name: str, command: str | None, size: int) -> list[dict]:
+    """Parse a reply with a RecordStream, fed a few bytes at a time."""
+    data = xml_string.encode()
+    stream = RecordStream(list_name, command)
+    records = []
+    for i in range(0, len(data), size):
+        records += stream.feed(data[i : i + size])
+    return records + stream.close()
+
+
+@pytest.mark.parametrize("pattern", list(FakeSocket._response_map))
+def test_stream_matches_generic(pattern: str) -> None:
+    """Test the incremental parser gives the same records as the generic parser, however the reply is split."""
+    xml_string = FakeSocket._response_map[pattern].decode()
+    list_name = "middle" if "getdevinfo" in pattern else "list"
+    command = re.match(r"<cmd>(\w+)</cmd>", pattern).group(1)
+    try:
+        expected = generic_records(xml_string, list_name, command)
+    except TypeError:  # No list in this reply
+        assert _stream_records(xml_string, list_name, command, 1000) == []
+        return
+    for size in (1, 7, 1000):
+        assert _stream_records(xml_string, list_name, command, size) == expected
+
+
+def test_stream_records() -> None:
+    """Test records are returned as soon as their element is complete, falling back to defusedxml if needed."""
+    stream = RecordStream(command="download")
+    assert stream.feed(b'<bts><list><data seqid="1" volt="3.1" /><data seq') == [{"seqid": 1, "volt": 3.1}]
+    assert stream.feed(b'id="2" volt="--" />') == [{"seqid": 2, "volt": None}]
+    assert stream.feed(b"</list></bts>") == []
+    assert stream.close() == []
+
+    # Falls back to defusedxml part way through, without repeating records
+    for xml_string in [
+        '<bts><list><a x="1">t<b y="2" />u</a><a x="&#49;" /></list><list><a /></list></bts>',
+        "<bts><list>" + '<a x="1" />' * 50 + '<a x="2"><b /></a><a x="3" /></list></bts>',
+        "<bts><list a='1'><a x='1' /></list></bts>",
+        '<bts><list count="0" /></bts>',
+    ]:
+        for size in (1, 5, 64):
+            assert _stream_records(xml_string, "list", None, size) == generic_records(xml_string)
+
+
+def test_stream_without_whitespace() -> None:
+    """Test elements without whitespace between them are scanned, however the reply is split."""
+    xml_string = "<bts><list>" + "".join(f'<data seqid="{i}" volt="3.1"/>' for i in range(1, 101)) + "</list></bts>"
+    for size in (1, 7, 50):
+        data = xml_string.encode()
+        stream = RecordStream(command="download")
+        records = []
+        for i in range(0, len(data), size):
+            records += stream.feed(data[i : i + size])
+        assert stream._parser is None  # Did not fall back to defusedxml
+        records += stream.close()
+        assert [r["seqid"] for r in records] == list(range(1, 101))
+
+
+@pytest.mark.parametrize("command", list(REPLY_SCHEMAS))
+def test_schema_types(command: str) -> None:
+    """Test every declared field has the declared type, or is None, in the captured replies."""
+    schema = REPLY_SCHEMAS[command]
+    n_checked = 0
+    for pattern, response in FakeSocket._response_map.items():
+        if not pattern.startswith(f"<cmd>{command}</cmd>"):
+            continue
+        for record in _xml_to_records(response.decode(), "middle" if command == "getdevinfo" else "list", command):
+            for field, value in record.items():
+                if field in schema and value is not None:
+                    assert isinstance(value, schema[field]), (field, value)
+                    n_checked += 1
+    assert n_checked
+
+
+def test_stable_types() -> None:
+    """Test a declared column has one type, and undeclared fields fall back to guessing the type."""
+    records = _xml_to_records(
+        FakeSocket._response_map['<cmd>inquire</cmd><list count = "16">'].decode(), command="inquire"
+    )
+    assert {type(r["totaltime"]) for r in records} == {float}
+    assert records[0]["step_type"] is None
+    assert {type(r["cycle_id"]) for r in records} == {int}
+    xml_string = '<bts><list><inquire totaltime="0" new_field="1" other="1.5" text="abc" /></list></bts>'
+    assert _xml_to_records(xml_string, command="inquire") == [
+        {"totaltime": 0.0, "new_field": 1, "other": 1.5, "text": "abc"}
+    ]
+    # Values which do not match the schema are kept rather than raising
+    xml_string = '<bts><list><data seqid="x" volt="--" /></list></bts>'
+    assert _xml_to_records(xml_string, command="download") == [{"seqid": "x", "volt": None}]
+
+
+def test_fast_download() -> None:
+    """Test download replies take the fast path, with types from the schema."""
+    xml_string = _download_synthetic_response(1, 1, 1, 100).decode()
+    xml_string = xml_string.replace('testtime="10000"', 'testtime="0"').replace('volt="3.010000"', 'volt="--"')
+    records = fast_records(xml_string, command="download")
+    assert records == generic_records(xml_string, command="download")
+    assert len(records) == 100
+    assert records[0]["testtime"] == 0
+    assert isinstance(records[0]["testtime"], float)
+    assert records[0]["volt"] is None
+    assert isinstance(records[1]["volt"], float)
+    assert isinstance(records[0]["seqid"], int)
+
+
+def test_scan_table() -> None:
+    """Test scanning flat lists into columns."""
+    xml_string = '<bts><list count="2"><chl a="1" b="x">true</chl>\r\n<chl a="2" b="y">false</chl></list></bts>'
+    assert scan_table(xml_string) == ("chl", ["a", "b", "chl"], [("1", "2"), ("x", "y"), ("true", "false")])
+    assert scan_table('<bts><list count="0" /></bts>') == ("", [], [])
+    assert scan_table('<bts><list count="0">\r\n  </list></bts>') == ("", [], [])
+
+
+@pytest.mark.parametrize(
+    "xml_string",
+    [
+        '<bts><list><a x="1" /><a y="2" /></list></bts>',
+        '<bts><list><a x="1" /><b x="2" /></list></bts>',
+        '<bts><list><a x="1">t</a><a x="2" /></list></bts>',
+        FakeSocket._response_map['<cmd>inquire</cmd><list count = "16">'].decode(),
+    ],
+)
+def test_fast_heterogeneous(xml_string: str) -> None:
+    """Test flat lists with different tags, attributes or text are scanned one element at a time."""
+    assert scan_table(xml_string) is None
+    assert fast_records(xml_string) == generic_records(xml_string)
+
+
+@pytest.mark.parametrize(
+    "xml_string",
+    [
+        # Nesting
+        '<bts><list><a x="1"><b /></a></list></bts>',
+        # Comments, CDATA, character references
+        '<bts><list><a x="1" /><!-- c --></list></bts>',
+        '<bts><list><a x="&#49;" /></list></bts>',
+        # Single quotes
+        "<bts><list><a x='1' /></list></bts>",
+    ],
+)
+def test_fallback(xml_string: str) -> None:
+    """Test anything but a plain homogeneous list falls back to the generic parser."""
+    assert fast_records(xml_string) is None
+    assert _xml_to_records(xml_string) == generic_records(xml_string)
+
+
+def test_entities_forbidden() -> None:
+    """Test replies with entities are still rejected."""
+    xml_string = '<!DOCTYPE bts [<!ENTITY e "1">]><bts><list><a x="&e;" /></list></bts>'
+    assert fast_records(xml_string) is None
+    with pytest.raises(EntitiesForbidden):
+        _xml_to_records(xml_string)
+    with pytest.raises(EntitiesForbidden):
+        _stream_records(xml_string, "list", None, 1000)
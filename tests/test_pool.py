@@ -0,0 +1,137 @@
+"""Tests for pool.py."""
+
+import socket
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from aurora_neware import ConnectionPool, DownloadCache, NewareAPI
+
+from .mocks import FakeSocket
+
+
+def test_download_many(mock_bts) -> None:
+    """Test downloading from many channels in parallel."""
+    with NewareAPI() as nw:
+        pipelines = ["21-1-1", "21-1-2", "21-2-8"]
+        data, timings = nw.download_many(pipelines, last_n_points=10, connections=2)
+        assert list(data) == pipelines
+        assert list(timings) == pipelines
+        assert all(t >= 0 for t in timings.values())
+        assert data["21-1-1"] == nw.download("21-1-1", last_n_points=10)
+        assert all(len(d["seqid"]) == 10 for d in data.values())
+
+        # All channels in the channel map by default
+        data, timings = nw.download_many(last_n_points=10, connections=4, window=2)
+        assert len(data) == 16
+
+        with pytest.raises(KeyError):
+            nw.download_many(["21-1-1", "99-9-9"])
+
+
+def test_pool_connections(mock_bts) -> None:
+    """Test pool connections share the channel map and only the first fetches it."""
+    with ConnectionPool(size=3) as pool:
+        assert len(pool._connections) == 3
+        assert all(c.channel_map is pool.channel_map for c in pool._connections)
+        sent = [c.neware_socket.sent_data for c in pool._connections]
+        assert sum("<cmd>getdevinfo</cmd>" in s for commands in sent for s in commands) == 1
+        assert all(any("<cmd>connect</cmd>" in s for s in commands) for commands in sent)
+
+        data, _timings = pool.download_many(["21-1-1"], last_n_points=10)
+        assert len(data["21-1-1"]["seqid"]) == 10
+    assert not pool._connections
+
+
+def test_pool_settings(mock_bts, tmp_path: Path) -> None:
+    """Test pool connections get the receive size and download cache of the parent connection."""
+    cache = DownloadCache(tmp_path)
+    with NewareAPI(recv_size=4096, download_cache=cache) as nw:
+        data, _timings = nw.download_many(["21-1-1", "21-1-2"], last_n_points=10, connections=2)
+        assert data["21-1-1"] == nw.download("21-1-1", last_n_points=10)
+    assert cache.get("127.0.0.1-502-21-1-1-143") is not None
+    with ConnectionPool(size=2, recv_size=4096, download_cache=cache) as pool:
+        assert all(c.recv_size == 4096 and c.download_cache is cache for c in pool._connections)
+
+
+def test_pool_open_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test connections already opened are closed if a handshake fails."""
+    sockets: list[FakeSocket] = []
+
+    class FailingSocket(FakeSocket):
+        def __init__(self) -> None:
+            super().__init__()
+            self.closed = False
+            sockets.append(self)
+
+        def connect(self, address: tuple[str, int]) -> None:
+            if len(sockets) == 3:
+                msg = "Connection refused"
+                raise ConnectionRefusedError(msg)
+            super().connect(address)
+
+        def close(self) -> None:
+            self.closed = True
+
+    monkeypatch.setattr(socket, "socket", FailingSocket)
+    pool = ConnectionPool(size=3)
+    with pytest.raises(ConnectionRefusedError):
+        pool.open()
+    assert len(sockets) == 3
+    assert all(s.closed for s in sockets)
+    assert not pool._connections
+
+
+def test_server_limit(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the number of connections in use per server is capped."""
+    monkeypatch.setattr(ConnectionPool, "_server_limits", {})
+    in_use = 0
+    max_in_use = 0
+    lock = threading.Lock()
+    original_download = NewareAPI.download
+
+    def counting_download(self: NewareAPI, *args: object, **kwargs: object) -> dict:
+        nonlocal in_use, max_in_use
+        with lock:
+            in_use += 1
+            max_in_use = max(max_in_use, in_use)
+        try:
+            return original_download(self, *args, **kwargs)
+        finally:
+            with lock:
+                in_use -= 1
+
+    monkeypatch.setattr(NewareAPI, "download", counting_download)
+    with ConnectionPool(size=4, max_per_server=2) as pool:
+        data, _timings = pool.download_many(last_n_points=500)
+    assert len(data) == 16
+    assert max_in_use <= 2
+
+
+def test_parallel_download_many(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test parallel downloads on pool connections do not wait for more slots than the server limit."""
+    monkeypatch.setattr(ConnectionPool, "_server_limits", {})
+    # All outer downloads hold their slot before any opens its extra connections
+    barrier = threading.Barrier(8)
+    original_iter_parallel = NewareAPI._iter_parallel
+
+    def synchronized_iter_parallel(self: NewareAPI, *args: object, **kwargs: object) -> Iterator:
+        barrier.wait(timeout=10)
+        yield from original_iter_parallel(self, *args, **kwargs)
+
+    monkeypatch.setattr(NewareAPI, "_iter_parallel", synchronized_iter_parallel)
+    with NewareAPI() as nw:
+        pipelines = list(nw.channel_map)[:8]
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(nw.download_many(pipelines, last_n_points=100, connections=8, parallelism=2)),
+            daemon=True,
+        )
+        thread.start()
+        thread.join(timeout=30)
+        assert not thread.is_alive(), "download_many deadlocked"
+        data, _timings = results[0]
+        assert list(data) == pipelines
+        assert data["21-1-1"] == nw.download("21-1-1", last_n_points=100)
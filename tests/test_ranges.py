@@ -0,0 +1,88 @@
+"""Tests for ranges.py."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from aurora_neware.ranges import (
+    interpolate,
+    parse_bounds,
+    seqid_ranges,
+    split_ranges,
+    time_anchors,
+    to_cycler_time,
+)
+
+STEP_LAYER = [
+    {"startseqid": 1, "endseqid": 100, "stepindex": 1, "cycleid": 1},
+    {"startseqid": 101, "endseqid": 250, "stepindex": 2, "cycleid": 1},
+    {"startseqid": 251, "endseqid": 400, "stepindex": 3, "cycleid": 2},
+    {"startseqid": 401, "endseqid": 420, "stepindex": 4, "cycleid": 2},
+    {"startseqid": 421, "endseqid": 600, "stepindex": 5, "cycleid": 3},
+]
+
+
+def test_parse_bounds() -> None:
+    """Test parsing single values and ranges."""
+    assert parse_bounds(3, "cycles") == (3, 3)
+    assert parse_bounds((3, 5), "cycles") == (3, 5)
+    assert parse_bounds([3, 5], "cycles") == (3, 5)
+    with pytest.raises(ValueError, match="cycles"):
+        parse_bounds((5, 3), "cycles")
+    with pytest.raises(ValueError, match="steps"):
+        parse_bounds((1, 2, 3), "steps")
+
+
+def test_seqid_ranges() -> None:
+    """Test cycles and steps are turned into merged seqid ranges."""
+    assert seqid_ranges(STEP_LAYER, cycles=2) == [(251, 420)]
+    assert seqid_ranges(STEP_LAYER, cycles=(1, 2)) == [(1, 420)]
+    assert seqid_ranges(STEP_LAYER, steps=(2, 2)) == [(101, 250)]
+    assert seqid_ranges(STEP_LAYER, cycles=(1, 3), steps=(3, 4)) == [(251, 420)]
+    assert seqid_ranges(STEP_LAYER, cycles=4) == []
+    # Steps selected by cycle which are not adjacent give separate ranges
+    assert seqid_ranges(
+        [*STEP_LAYER, {"startseqid": 601, "endseqid": 700, "stepindex": 6, "cycleid": 1}], cycles=1
+    ) == [
+        (1, 250),
+        (601, 700),
+    ]
+
+
+def test_split_ranges() -> None:
+    """Test ranges are split into contiguous spans of about the same size."""
+    assert split_ranges([(0, 10)], 3) == [[(0, 4)], [(4, 8)], [(8, 10)]]
+    assert split_ranges([(0, 4), (10, 16)], 2) == [[(0, 4), (10, 11)], [(11, 16)]]
+    assert split_ranges([(0, 2)], 4) == [[(0, 1)], [(1, 2)]]
+    assert split_ranges([(5, 5)], 4) == []
+
+
+def test_time_anchors() -> None:
+    """Test known times are taken from the end of each step, and the start of the first."""
+    step_layer = [
+        {"startseqid": 101, "endseqid": 200, "steptime": 60000, "endatime": "2025-01-01 00:02:00"},
+        {"startseqid": 1, "endseqid": 100, "steptime": 60000, "endatime": "2025-01-01 00:01:00"},
+        {"startseqid": 201, "endseqid": 300, "steptime": 60000, "endatime": None},
+    ]
+    assert time_anchors(step_layer) == [
+        (0, datetime(2025, 1, 1, 0, 0, 0)),
+        (100, datetime(2025, 1, 1, 0, 1, 0)),
+        (200, datetime(2025, 1, 1, 0, 2, 0)),
+    ]
+
+
+def test_interpolate() -> None:
+    """Test guessing positions between two known times."""
+    lo, hi = (0, datetime(2025, 1, 1, 0, 0, 0)), (100, datetime(2025, 1, 1, 0, 1, 40))
+    assert interpolate(lo, hi, datetime(2025, 1, 1, 0, 0, 30)) == 30
+    assert interpolate(lo, hi, datetime(2024, 1, 1)) == 1
+    assert interpolate(lo, hi, datetime(2026, 1, 1)) == 99
+    assert interpolate(lo, (100, None), datetime(2025, 1, 1, 0, 0, 30)) == 50
+
+
+def test_to_cycler_time() -> None:
+    """Test aware times are converted to naive local time."""
+    naive = datetime(2025, 1, 1, 12, 0, 0)
+    assert to_cycler_time(naive) is naive
+    aware = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert to_cycler_time(aware) == aware.astimezone().replace(tzinfo=None)
@@ -0,0 +1,155 @@
+"""Tests for scheduler.py."""
+
+import time
+from pathlib import Path
+
+import pytest
+
+from aurora_neware.scheduler import PollScheduler, TokenBucket
+
+
+class FakeClock:
+    """Clock which only moves when sleeping."""
+
+    def __init__(self) -> None:
+        """Start at time 0."""
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Move the time forward."""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeAPI:
+    """API with a settable status per channel, which records the commands sent."""
+
+    def __init__(self, status: dict[str, str]) -> None:
+        """Set the workstatus of each channel."""
+        self.status = status
+        self.step = dict.fromkeys(status, 1)
+        self.commands: list[tuple[str, list[str]]] = []
+
+    def select(self, pipeline_ids: list[str] | None) -> list[str]:
+        """Select pipelines without selectors."""
+        return list(pipeline_ids or self.status)
+
+    def inquire(self, pipeline_ids: list[str]) -> dict[str, dict]:
+        """Get the workstatus and step of channels."""
+        self.commands.append(("inquire", pipeline_ids))
+        return {p: {"workstatus": self.status[p], "step_id": self.step[p]} for p in pipeline_ids}
+
+    def getchlstatus(self, pipeline_ids: list[str]) -> dict[str, dict]:
+        """Get the status of channels."""
+        self.commands.append(("getchlstatus", pipeline_ids))
+        return {p: {"status": self.status[p]} for p in pipeline_ids}
+
+
+def _scheduler(nw: FakeAPI, clock: FakeClock) -> PollScheduler:
+    """Scheduler with a fake clock and a generous budget."""
+    return PollScheduler(
+        nw,
+        intervals={"working": 10.0, "finish": 100.0},
+        budget=TokenBucket(100.0, clock=clock, sleep=clock.sleep),
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+
+def test_intervals_and_batching() -> None:
+    """Test channels are polled at the interval of their state, batched per tick."""
+    clock = FakeClock()
+    nw = FakeAPI({"1-1-1": "working", "1-1-2": "working", "1-1-3": "finish"})
+    scheduler = _scheduler(nw, clock)
+
+    events = scheduler.tick()
+    assert len(events) == 3
+    assert nw.commands == [("inquire", ["1-1-1", "1-1-2", "1-1-3"])]
+    assert scheduler.next_due() == 10.0
+
+    nw.commands.clear()
+    list(scheduler.run(ticks=10))
+    # Working channels every 10 s in one inquire, the finished channel once with getchlstatus
+    assert nw.commands.count(("inquire", ["1-1-1", "1-1-2"])) == 10
+    assert nw.commands.count(("getchlstatus", ["1-1-3"])) == 1
+    assert clock.now == 100.0
+
+
+def test_fast_polling_after_change() -> None:
+    """Test a channel which changed is polled quickly, backing off to its state interval."""
+    clock = FakeClock()
+    nw = FakeAPI({"1-1-1": "working"})
+    scheduler = _scheduler(nw, clock)
+    scheduler.tick()
+    clock.sleep(10.0)
+    nw.step["1-1-1"] = 2
+    events = scheduler.tick()
+    assert events[0]["changed"] == ["step_id"]
+    intervals = []
+    for _ in range(5):
+        intervals.append(scheduler.next_due() - clock.now)
+        clock.sleep(intervals[-1])
+        scheduler.tick()
+    assert intervals == [1.0, 2.0, 4.0, 8.0, 10.0]
+
+
+def test_transitions() -> None:
+    """Test callbacks for state transitions, also when the change is seen by getchlstatus."""
+    clock = FakeClock()
+    nw = FakeAPI({"1-1-1": "working", "1-1-2": "finish"})
+    scheduler = _scheduler(nw, clock)
+    finished = []
+    protected = []
+    any_transition = []
+    scheduler.on_transition(lambda p, _old, _new, _rec: finished.append(p), "working", "finish")
+    scheduler.on_transition(lambda p, _old, _new, _rec: protected.append(p), to_state="protect")
+    scheduler.on_transition(lambda p, old, new, _rec: any_transition.append((p, old, new)))
+    scheduler.tick()
+    assert any_transition == []
+
+    nw.status = {"1-1-1": "finish", "1-1-2": "working"}
+    clock.sleep(100.0)
+    nw.commands.clear()
+    scheduler.tick()
+    assert nw.commands == [("getchlstatus", ["1-1-2"]), ("inquire", ["1-1-1", "1-1-2"])]
+    assert finished == ["1-1-1"]
+    assert protected == []
+    assert any_transition == [("1-1-1", "working", "finish"), ("1-1-2", "finish", "working")]
+
+
+def test_token_bucket() -> None:
+    """Test the request rate is limited after a burst."""
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, capacity=3, clock=clock, sleep=clock.sleep)
+    waits = [bucket.acquire() for _ in range(7)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3:] == [0.5, 0.5, 0.5, 0.5]
+
+
+def test_shared_budget(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test schedulers for the same server share one budget, which does not use injected clocks."""
+    monkeypatch.setattr(PollScheduler, "_server_budgets", {})
+    clock = FakeClock()
+    nw = FakeAPI({"1-1-1": "working"})
+    nw.ip, nw.port = "127.0.0.1", 502
+    budget = PollScheduler(nw, clock=clock, sleep=clock.sleep).budget
+    assert PollScheduler(nw).budget is budget
+    assert budget.clock is time.monotonic
+    assert budget.sleep is time.sleep
+    # Clients of other servers and daemons get their own budget
+    other = FakeAPI({"1-1-1": "working"})
+    other.ip, other.port = "127.0.0.2", 502
+    assert PollScheduler(other).budget is not budget
+    daemon_a, daemon_b = FakeAPI({"1-1-1": "working"}), FakeAPI({"1-1-1": "working"})
+    daemon_a.path, daemon_b.path = Path("daemon-a.sock"), Path("daemon-b.sock")
+    assert PollScheduler(daemon_a).budget is PollScheduler(daemon_a).budget
+    assert PollScheduler(daemon_a).budget is not PollScheduler(daemon_b).budget
+    # Clients without a known server are not merged
+    unknown = FakeAPI({"1-1-1": "working"})
+    assert PollScheduler(unknown).budget is not PollScheduler(unknown).budget
+    assert PollScheduler(unknown, clock=clock).budget.clock is clock
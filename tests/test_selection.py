@@ -0,0 +1,76 @@
+"""Tests for selection.py."""
+
+import pytest
+
+from aurora_neware import Channel, ChannelIndex, NewareAPI
+from aurora_neware.selection import apply_filters, parse_address, resolve, split_filters
+
+
+@pytest.fixture
+def index() -> ChannelIndex:
+    """Index with sub-devices 1 and 2 of device 21, and sub-device 1 of device 22."""
+    return ChannelIndex(
+        Channel("127.0.0.1", 27, devid, subdevid, chlid)
+        for devid, subdevid in ((21, 1), (21, 2), (22, 1))
+        for chlid in range(1, 9)
+    )
+
+
+def test_parse_address() -> None:
+    """Test parsing address selectors."""
+    assert parse_address("21-1-3") == ((21, 21), (1, 1), (3, 3))
+    assert parse_address("21-*-1..8") == ((21, 21), None, (1, 8))
+    assert parse_address("21") is None
+    assert parse_address("21-1") is None
+    assert parse_address("21-1-8..1") is None
+    assert parse_address("21-1-1asgadgh") is None
+    assert parse_address("21-1-1-1") is None
+
+
+def test_resolve(index: ChannelIndex) -> None:
+    """Test resolving selectors to pipeline IDs."""
+    assert resolve(index, ["21-1-3"]) == ["21-1-3"]
+    assert resolve(index, ["21-*-*"]) == [f"21-{i}-{j}" for i in (1, 2) for j in range(1, 9)]
+    assert resolve(index, ["21-2-1..3", "22-1-8"]) == ["21-2-1", "21-2-2", "21-2-3", "22-1-8"]
+    assert resolve(index, ["*-1-8"]) == ["21-1-8", "22-1-8"]
+    # In order of the selectors, without duplicates
+    assert resolve(index, ["22-1-1", "*-*-1", "21-1-1"]) == ["22-1-1", "21-1-1", "21-2-1"]
+    # Unknown pipeline IDs are kept so looking them up raises the usual error
+    assert resolve(index, ["99-9-9", "abc"]) == ["99-9-9", "abc"]
+    # Partial pipeline IDs are not wildcards
+    assert resolve(index, ["21", "21-1"]) == ["21", "21-1"]
+    with pytest.raises(KeyError, match="No pipelines"):
+        resolve(index, ["23-*-*"])
+    with pytest.raises(ValueError, match="select"):
+        resolve(index, ["state:working"])
+
+
+def test_filters() -> None:
+    """Test filtering pipelines by state and barcode."""
+    addresses, filters = split_filters(["21-*-*", "state:working", "state:pause", "barcode:abc*"])
+    assert addresses == ["21-*-*"]
+    assert filters == {"state": ["working", "pause"], "barcode": ["abc*"]}
+    status = {
+        "21-1-1": {"workstatus": "working", "barcode": "abc1"},
+        "21-1-2": {"workstatus": "pause", "barcode": "xyz"},
+        "21-1-3": {"workstatus": "finish", "barcode": "abc3"},
+        "21-1-4": {"workstatus": "pause", "barcode": "abc4"},
+    }
+    assert apply_filters(status, filters) == ["21-1-1", "21-1-4"]
+    assert apply_filters(status, {}) == list(status)
+
+
+def test_select(mock_bts) -> None:
+    """Test selecting pipelines through the API, with one command for all pipelines."""
+    with NewareAPI() as nw:
+        assert nw.select() == list(nw.channel_map)
+        assert nw.select("21-2-7..8") == ["21-2-7", "21-2-8"]
+        assert nw._select_pipelines(["21-*-*"], default_all=True) is nw.channel_map
+
+        n_sent = len(nw.neware_socket.sent_data)
+        working = nw.select(["21-*-*", "state:working"])
+        assert len(nw.neware_socket.sent_data) == n_sent + 1
+        assert working
+        assert "21-1-1" not in working
+        assert nw.select(["21-1-1..2", "state:finish"]) == ["21-1-1"]
+        assert nw.select("barcode:251203_kigr_gen17_01") == ["21-1-1"]
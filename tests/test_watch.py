@@ -0,0 +1,87 @@
+"""Tests for watch.py."""
+
+import json
+
+import pytest
+from typer.testing import CliRunner
+
+from aurora_neware import NewareAPI
+from aurora_neware.cli.main import app
+from aurora_neware.watch import ChangeDetector, watch_status
+
+from .mocks import FakeSocket
+
+
+def test_change_detector() -> None:
+    """Test only channels with changed fields are reported."""
+    detector = ChangeDetector()
+    status = {
+        "1-1-1": {"workstatus": "working", "step_id": 1, "cycle_id": 1, "log_code": 0, "voltage": 3.0},
+        "1-1-2": {"workstatus": "finish", "step_id": 5, "cycle_id": 2, "log_code": 0, "voltage": 3.5},
+    }
+    events = detector.changes(status)
+    assert [e["pipeline_id"] for e in events] == ["1-1-1", "1-1-2"]
+    assert events[0]["changed"] == ["workstatus", "step_id", "cycle_id", "log_code"]
+    assert events[0]["voltage"] == 3.0
+
+    # Other fields do not count as a change
+    status["1-1-1"] = {**status["1-1-1"], "voltage": 3.1}
+    assert detector.changes(status) == []
+
+    status["1-1-1"] = {**status["1-1-1"], "step_id": 2, "workstatus": "finish"}
+    events = detector.changes(status)
+    assert len(events) == 1
+    assert events[0]["changed"] == ["workstatus", "step_id"]
+    assert detector.changes(status) == []
+
+
+def test_watch_status() -> None:
+    """Test polling with a fake inquire and sleep."""
+    polls = [
+        {"1-1-1": {"workstatus": "working"}, "1-1-2": {"workstatus": "working"}},
+        {"1-1-1": {"workstatus": "working"}, "1-1-2": {"workstatus": "working"}},
+        {"1-1-1": {"workstatus": "finish"}, "1-1-2": {"workstatus": "working"}},
+    ]
+    requested = []
+    sleeps = []
+
+    def inquire(pipeline_ids: list[str] | None) -> dict:
+        requested.append(pipeline_ids)
+        return polls[len(requested) - 1]
+
+    events = list(watch_status(inquire, ["1-1-1", "1-1-2"], interval=2.0, polls=3, sleep=sleeps.append))
+    assert [(e["pipeline_id"], e["changed"]) for e in events[2:]] == [("1-1-1", ["workstatus"])]
+    assert len(events) == 3
+    assert requested == [["1-1-1", "1-1-2"]] * 3
+    assert len(sleeps) == 2
+    assert all(0 < s <= 2.0 for s in sleeps)
+
+
+def test_watch(mock_bts, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test watching through the API, the second poll has one changed channel."""
+
+    def sleep(_seconds: float) -> None:
+        monkeypatch.setitem(
+            FakeSocket._response_map,
+            '<cmd>inquire</cmd><list count = "16">',
+            FakeSocket._response_map['<cmd>inquire</cmd><list count = "16">'].replace(
+                b'dev="27-21-1-1-0" cycle_id="1"', b'dev="27-21-1-1-0" cycle_id="2"'
+            ),
+        )
+
+    monkeypatch.setattr("aurora_neware.watch.time.sleep", sleep)
+    with NewareAPI() as nw:
+        events = list(nw.watch(polls=2))
+    assert len(events) == 17
+    assert events[-1]["pipeline_id"] == "21-1-1"
+    assert events[-1]["changed"] == ["cycle_id"]
+    assert events[-1]["cycle_id"] == 2
+
+
+def test_watch_cli(mock_bts) -> None:
+    """Test the watch CLI command prints NDJSON."""
+    result = CliRunner().invoke(app, ["watch", "--count", "2", "--interval", "0"])
+    assert result.exit_code == 0
+    lines = result.stdout.splitlines()
+    assert len(lines) == 16
+    assert json.loads(lines[0])["pipeline_id"] == "21-1-1"